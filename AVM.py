@@ -49,6 +49,8 @@ class AVM(sklearn.base.BaseEstimator):
                  max_features=None,
                  learning_rate=None,       # for GradientBoostingRegressor
                  loss=None,
+                 design_matrix_cache=None,  # optional DesignMatrixCache holding the samples
+                 samples_name=None,         # name of the samples in the design_matrix_cache
                  ):
         # NOTE: just capture the parameters (to conform to the sklearn protocol)
         self.model_name = model_name
@@ -71,6 +73,9 @@ class AVM(sklearn.base.BaseEstimator):
         self.learning_rate = learning_rate
         self.loss = loss
 
+        self.design_matrix_cache = design_matrix_cache
+        self.samples_name = samples_name
+
     def fit(self, samples):
         'convert samples to X,Y and fit them'
         self.implementation_module = {
@@ -82,6 +87,24 @@ class AVM(sklearn.base.BaseEstimator):
         fitted = self.implementation_module.fit(self, X_train, y_train)
         return fitted.model  # scikit learn's fitted model
 
+    def fit_predict_path(self, samples_train, samples_test, alphas):
+        'return dict alpha --> (predictions, fitted model); only for ElasticNet'
+        assert self.model_name == 'ElasticNet', self.model_name
+        self.implementation_module = AVM_elastic_net
+        X_train, y_train = self.extract_and_transform(samples_train)
+        X_test, y_test = self.extract_and_transform(samples_test, transform_y=False)
+        assert y_test is None
+        return self.implementation_module.fit_predict_path(self, X_train, y_train, X_test, alphas)
+
+    def fit_predict_grown(self, samples_train, samples_test, n_estimators_seq):
+        'return dict n_estimators --> (predictions, feature_importances); only for RandomForestRegressor'
+        assert self.model_name == 'RandomForestRegressor', self.model_name
+        self.implementation_module = AVM_random_forest_regressor
+        X_train, y_train = self.extract_and_transform(samples_train)
+        X_test, y_test = self.extract_and_transform(samples_test, transform_y=False)
+        assert y_test is None
+        return self.implementation_module.fit_predict_grown(self, X_train, y_train, X_test, n_estimators_seq)
+
     def get_attributes(self):
         'return both sets of attributes, with None if not used by that model'
         pdb.set_trace()
@@ -93,14 +116,32 @@ class AVM(sklearn.base.BaseEstimator):
 
     def extract_and_transform(self, samples, transform_y=True):
         'return X and y'
-        result = self.implementation_module.extract_and_transform(self, samples, transform_y)
-        return result
+        if self.design_matrix_cache is None:
+            result = self.implementation_module.extract_and_transform(self, samples, transform_y)
+            return result
+        # samples are a subset of the samples in the cache
+        units_X, units_y = self.implementation_module.units(self)
+        X, y = self.design_matrix_cache.X_y_subset(
+            self.samples_name,
+            samples,
+            self.features_group,
+            units_X,
+            units_y,
+        )
+        return X, (y if transform_y else None)
 
     def predict(self, samples):
         X_test, y_test = self.extract_and_transform(samples, transform_y=False)
         assert y_test is None
         return self.implementation_module.predict(self, X_test)
 
+    def staged_predict(self, samples, n_estimators_seq):
+        'return dict n_estimators --> predictions; only for GradientBoostingRegressor'
+        assert self.model_name == 'GradientBoostingRegressor', self.model_name
+        X_test, y_test = self.extract_and_transform(samples, transform_y=False)
+        assert y_test is None
+        return self.implementation_module.staged_predict(self, X_test, n_estimators_seq)
+
     def setattr(self, parameter, value):
         setattr(self, parameter, value)
         return self
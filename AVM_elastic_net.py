@@ -7,6 +7,7 @@ import pdb
 import numpy as np
 import sklearn
 
+import elastic_net_path
 from Features import Features
 import layout_transactions
 
@@ -32,6 +33,42 @@ def fit(avm, X_train, y_train):
     return avm
 
 
+def fit_predict_path(avm, X_train, y_train, X_test, alphas):
+    '''return dict alpha --> (predictions, fitted ElasticNet model)
+
+    Solve for all the alphas with one warm-started regularization path.
+    '''
+    if avm.verbose > 0:
+        print 'fit elastic net path: %s~%s alphas: %s l1_ratio: %f' % (
+            avm.units_X, avm.units_y, alphas, avm.l1_ratio)
+
+    avm.scaler = sklearn.preprocessing.MinMaxScaler()
+    avm.scaler.fit(X_train)
+    fitteds = elastic_net_path.fit_path(
+        avm.scaler.transform(X_train),
+        y_train,
+        alphas,
+        avm.l1_ratio,
+        normalize=True,
+        selection='random',   # select random coefficient to update at each iteration
+        random_state=avm.random_state,
+    )
+    X_test_scaled = avm.scaler.transform(X_test)
+    result = {}
+    for alpha, fitted in zip(alphas, fitteds):
+        answer_raw = fitted.predict(X_test_scaled)
+        answer = answer_raw if avm.units_y == 'natural' else np.exp(answer_raw)
+        result[alpha] = (answer, fitted)
+    avm.model = fitteds[-1]
+    avm.alpha = avm.model.alpha
+    return result
+
+
+def units(avm):
+    'return (units_X, units_y) used by extract_and_transform'
+    return (avm.units_X, avm.units_y)
+
+
 def extract_and_transform(avm, df, transform_y):
     f = Features()
     return f.extract_and_transform_X_y(
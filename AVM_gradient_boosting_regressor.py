@@ -1,5 +1,6 @@
 '''gradient boosting regressor module for AVM class'''
 
+import copy
 import pdb
 import sklearn
 
@@ -31,6 +32,11 @@ def fit(avm, X_train, y_train):
     return avm
 
 
+def units(avm):
+    'return (units_X, units_y) used by extract_and_transform'
+    return ('natural', 'natural')
+
+
 def extract_and_transform(avm, df, transform_y):
     f = Features()
     return f.extract_and_transform_X_y(
@@ -47,5 +53,35 @@ def predict(avm, X_test):
     return avm.model.predict(X_test)
 
 
+def staged_predict(avm, X_test, n_estimators_seq):
+    '''return dict n_estimators --> predictions for each n_estimators in n_estimators_seq
+
+    The predictions for n_estimators are those of the first n_estimators stages of
+    the fitted model. Because the stages are fitted in order from the same random
+    state, these are the predictions of a model fitted with just n_estimators.
+    '''
+    wanted = set(n_estimators_seq)
+    assert max(wanted) <= avm.n_estimators, (wanted, avm.n_estimators)
+    result = {}
+    for stage_index, predictions in enumerate(avm.model.staged_predict(X_test)):
+        n_estimators = stage_index + 1
+        if n_estimators in wanted:
+            result[n_estimators] = predictions
+            if len(result) == len(wanted):
+                break
+    return result
+
+
+def feature_importances(avm, n_estimators):
+    'return feature importances of the model consisting of the first n_estimators stages'
+    assert n_estimators <= avm.n_estimators, (n_estimators, avm.n_estimators)
+    if n_estimators == avm.n_estimators:
+        return avm.model.feature_importances_
+    truncated = copy.copy(avm.model)  # shallow: shares the fitted trees
+    truncated.estimators_ = avm.model.estimators_[:n_estimators]
+    truncated.n_estimators = n_estimators
+    return truncated.feature_importances_
+
+
 if __name__ == '__main__':
     pdb
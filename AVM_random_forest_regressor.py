@@ -30,6 +30,43 @@ def fit(avm, X_train, y_train):
     return avm
 
 
+def fit_predict_grown(avm, X_train, y_train, X_test, n_estimators_seq):
+    '''return dict n_estimators --> (predictions, feature_importances)
+
+    Grow one forest with warm_start through the n_estimators in increasing order,
+    predicting X_test at each size. The trees added at each size are those a
+    fresh fit with that n_estimators would build from the same random_state.
+    '''
+    if avm.verbose > 0:
+        print (
+            'fit grown random forest regressor',
+            avm.forecast_time_period,
+            n_estimators_seq,
+            avm.max_depth,
+            avm.max_features,
+            avm.n_months_back,
+        )
+    avm.model = sklearn.ensemble.RandomForestRegressor(
+        n_estimators=min(n_estimators_seq),
+        max_depth=avm.max_depth,
+        random_state=avm.random_state,
+        max_features=avm.max_features,
+        warm_start=True,
+    )
+    result = {}
+    for n_estimators in sorted(set(n_estimators_seq)):
+        avm.model.set_params(n_estimators=n_estimators)
+        avm.model.fit(X_train, y_train)
+        result[n_estimators] = (avm.model.predict(X_test), avm.model.feature_importances_)
+    avm.n_estimators = avm.model.n_estimators
+    return result
+
+
+def units(avm):
+    'return (units_X, units_y) used by extract_and_transform'
+    return ('natural', 'natural')
+
+
 def extract_and_transform(avm, df, transform_y):
     f = Features()
     return f.extract_and_transform_X_y(
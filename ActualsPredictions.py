@@ -1,159 +1,191 @@
-import cPickle as pickle
+import datetime
+import numpy as np
 import os
 import pandas as pd
 import pdb
 from pprint import pprint
+import shutil
+import tempfile
 import unittest
 
-from Date import Date
+import column_store
 import layout_transactions
 import Path
-from TransactionId2 import TransactionId2
+from PredictionCube import PredictionCube
+import transaction_key
+from TransactionId import TransactionId
 
 
 class ActualsPredictions(object):
-    'read and present data from samples2 (actuals) and fit-predict-reduce (predictions)'
+    '''read and present data from samples2 (actuals) and fit-predict-reduce2 (predictions)
+
+    Transactions are identified by their transaction_key, as in PredictionCube.
+    The actual prices are sorted by key and the predictions are the rows of the memory-mapped
+    cube, so that a lookup is a binary search that reads just the pages of the rows looked up.
+    '''
     def __init__(self, training_data, test=False, just_200701=False):
         'setup'
         assert training_data in ('train', 'all')
-        self.actuals = self._load_actuals(training_data, test)
-        self.predictions = self._load_predictions(training_data, just_200701)
-        self.transaction_ids = self._make_common_transaction_ids(
-            self.actuals,
-            self.predictions,
-        )
-        self.dates = ActualsPredictions._make_all_dates(self.actuals, self.predictions)
+        samples = self._load_actuals(training_data, test)
+        cube, rows = self._load_predictions(training_data, just_200701)
+        self._make_index(samples, cube, rows)
 
-    def actuals_predictions(self, date_apn):
-        'return Dict[(fitted, hps_str), (actuals: numpy.ndarray, predictions: numpy.ndarray)]'
-
-    def _load_actuals(self, training_data, test):
-        'return Dict[(date: datetime.date, apn: int), price:float]'
-        'return Dict[date: datetime.date, Dict[apn, price: float]]'
-        path = os.path.join(Path.Path().dir_working(), 'samples2', training_data + '.csv')
-        if False:
-            # I could not get this code to work
-            # hence the workaround below
-            result = pd.read_csv(
-                path,
-                usecols=[layout_transactions.price],
-                low_memory=False,
-                index_col=0,  # the transaction_ids
-            )
+    @classmethod
+    def from_samples(cls, samples, cube, rows=slice(None)):
+        'return ActualsPredictions for samples with sale_date, apn and price columns and the rows of the PredictionCube'
+        self = cls.__new__(cls)
+        self._make_index(samples, cube, rows)
+        return self
 
-        if False:
-            # this code does not work because the transaction_ids are read as strings, not TransactionId values
-            df = pd.read_csv(
-                path,
-                nrows=10000 if test else None,
-                usecols=[
-                    layout_transactions.transaction_id,
-                    layout_transactions.price,
-                ],
-                low_memory=False,
-            )
-            result = pd.DataFrame(
-                data={
-                    'price': df[layout_transactions.price].values,
-                },
-                index=df[layout_transactions.transaction_id]
-            )
-        if True:
-            # constructing the transaction_ids directly works
-            df = pd.read_csv(
-                path,
-                nrows=10 if test else None,
-                usecols=[
-                    layout_transactions.sale_date,
-                    layout_transactions.apn,
-                    layout_transactions.price
-                ],
-                low_memory=False,
-            )
-            # make list of transaction_ids
-            transaction_ids = []
-            for i, sale_date in enumerate(df[layout_transactions.sale_date]):
-                transaction_id = TransactionId2(
-                    sale_date=Date(from_float=sale_date).as_datetime_date(),
-                    apn=long(df[layout_transactions.apn][i]),
-                )
-                transaction_ids.append(transaction_id)
-            result = pd.DataFrame(
-                data={
-                    'price': df[layout_transactions.price],
-                    'transaction_id': transaction_ids},
-                index=range(len(transaction_ids)),
-            )
+    def actuals_predictions(self, date_apn):
+        '''return Dict[(fitted, hps_str), (actual: float, prediction: float)] for the predictions present
+
+        date_apn: (sale_date, apn), with sale_date a datetime.date or yyyymmdd; ex: a TransactionId
+        The actual is nan if the transaction is not in the samples.
+        '''
+        sale_date, apn = date_apn
+        actuals, predictions, present = self.lookup(np.array([sale_date], dtype=object), [apn])
+        result = {}
+        for fitted_index, hps_index in zip(*np.nonzero(present[0])):
+            fitted = self.predictions.fitteds[fitted_index]
+            hps_str = self.predictions.hps_strs[fitted[2]][hps_index]
+            result[(fitted, hps_str)] = (actuals[0], predictions[0, fitted_index, hps_index])
         return result
 
-    def _reduction_item_to_s(self, k, v):
-        'return str'
-        def key_to_str(k):
-            fitted, transaction_ids = k
-            return 'key(fitted=%s, len(transaction_ids)=%d, transaction_ids[0]=%s)' % (
-                    fitted,
-                    len(transaction_ids),
-                    transaction_ids[0],
+    def lookup(self, sale_dates, apns):
+        '''return (actuals, predictions, present) for the transactions with the sale_dates and apns
+
+        sale_dates: yyyymmdd numbers or datetime.date values
+
+        actuals: array [transaction], nan where the transaction is not in the samples
+        predictions, present: arrays [transaction, fitted, hps] from the PredictionCube
+        Raise KeyError if a transaction is not in the rows of the cube.
+        '''
+        keys = transaction_key.pack(sale_dates, apns)
+        cube = self.predictions
+        rows = self._prediction_keys_start + transaction_key.rows(self._prediction_keys, keys)
+        order = np.argsort(rows, kind='mergesort')  # read the memory-mapped rows in file order
+        predictions = np.empty((len(rows),) + cube.predictions.shape[1:], dtype=cube.predictions.dtype)
+        present = np.empty((len(rows),) + cube.present.shape[1:], dtype=bool)
+        predictions[order] = cube.predictions[rows[order]]
+        present[order] = cube.present[rows[order]]
+
+        if len(self._actual_keys) == 0:
+            return np.full(len(keys), np.nan), predictions, present
+        found = transaction_key.is_in(keys, self._actual_keys)
+        positions = np.minimum(np.searchsorted(self._actual_keys, keys), len(self._actual_keys) - 1)
+        actuals = np.where(found, self._actual_prices[positions], np.nan)
+        return actuals, predictions, present
+
+    def transaction_ids(self):
+        'return list of TransactionId (sale_date as yyyymmdd) for the transactions with actuals and predictions'
+        return [
+            TransactionId(sale_date=sale_date, apn=apn)
+            for sale_date, apn in zip(
+                transaction_key.sale_dates(self.transaction_keys),
+                transaction_key.apns(self.transaction_keys),
             )
+        ]
+
+    def _make_index(self, samples, cube, rows):
+        self.predictions = cube
+        self.prediction_rows = rows
+        self._prediction_keys = cube.keys[rows]  # sorted
+        self._prediction_keys_start = rows.start or 0
+        keys = transaction_key.pack(
+            samples[layout_transactions.sale_date].values,
+            samples[layout_transactions.apn].values,
+        )
+        order = np.argsort(keys, kind='mergesort')
+        self._actual_keys = keys[order]
+        self._actual_prices = samples[layout_transactions.price].values[order]
+        # for a key in several samples, the lookup finds the first one
+        self.transaction_keys = np.intersect1d(self._actual_keys, self._prediction_keys)  # in both
+        self.dates = np.unique(transaction_key.sale_dates(self.transaction_keys))  # yyyymmdd
 
-        def value_to_str(v):
-            assert isinstance(v, dict)
-            for k, v in v.iteritems():
-                return 'value(first key=%s, first value head=%s)' % (k, v[:5])
-
-        return key_to_str(k) + ' ' + value_to_str(v)
+    def _load_actuals(self, training_data, test):
+        'return DataFrame with the sale_date, apn and price of the samples'
+        path = os.path.join(Path.Path().dir_working(), 'samples2', training_data + '.csv')
+        return column_store.read(
+            path,
+            nrows=10 if test else None,
+            usecols=[
+                layout_transactions.sale_date,
+                layout_transactions.apn,
+                layout_transactions.price
+            ],
+        )
 
     def _load_predictions(self, training_data, just_200701):
-        'return Dict[date: datetime.date, Dict[apn, Dict[fitted, Dict[hps_str, predictions: numpy.ndarray]]]]'
-        pdb.set_trace()
-        filename = 'reduction' + ('_200701' if just_200701 else '') + '.pickle'
-        path = os.path.join(Path.Path().dir_working(), 'fit-predict-reduce2', filename)
-        with open(path, 'r') as f:
-            d = pickle.load(f)
-        assert isinstance(d, dict)
-        print 'teduction has %d items' % len(d)
-        for k, v in d.iteritems():
-            print 'first item in reduction'
-            print self._reduction_item_to_s(k, v)
-            break
-        print 'fitted values from predictions'
-        for k in d.iterkeys():
-            fitted, transaction_ids = k
-            print 'fitted %s %d transaction_ids one sale_date %s' % (
-                fitted,
-                len(transaction_ids),
-                transaction_ids[0].sale_date,
-            )
-        pdb.set_trace()
-        return d
-
-    def _make_common_transaction_ids(self, actuals, predictions):
-        'return Set[TransactionId] that are in both'
-        pdb.set_trace()
-        transaction_ids_actuals = set(actuals.index)
-        for transaction_id in transaction_ids_actuals:
-            # known date is 2007-01-22
-            pdb.set_trace()
-            if transaction_id.sale_year.year == 2007 and transaction_id.sale_year.month == 1:
-                print transaction_id
-        pdb.set_trace()
-
-        transaction_ids_common = set()
-        for fitted, transaction_ids in predictions.iterkeys():
-            for prediction_transaction_id in transaction_ids:
-                print prediction_transaction_id
-                if prediction_transaction_id in transaction_ids_actuals:
-                    transaction_ids_common.add(prediction_transaction_id)
-        if len(transaction_ids_common) == 0:
-            print len(actuals), len(predictions)
-            pdb.set_trace()
-        return transaction_ids_common
+        'return (PredictionCube from fit-predict-reduce2, slice of the rows used)'
+        path = os.path.join(Path.Path().dir_working(), 'fit-predict-reduce2', 'cube')
+        cube = PredictionCube(path)
+        rows = cube.rows_in_month(200701) if just_200701 else slice(0, len(cube.keys))
+        n_transactions, n_fitted, n_hps = cube.predictions.shape
+        print 'prediction cube has %d transactions, %d fitted models, %d hps; using rows %s' % (
+            n_transactions,
+            n_fitted,
+            n_hps,
+            rows,
+        )
+        return cube, rows
 
 
 class TestActualsPredictions(unittest.TestCase):
-    def test_construction(self):
-        ap = ActualsPredictions('train', just_200701=True, test=True)
-        self.assertTrue(isinstance(ap, ActualsPredictions))
+    def setUp(self):
+        self.dir_temp = tempfile.mkdtemp()
+        tids = [
+            TransactionId(sale_date=datetime.date(2007, 1, 5), apn=12L),
+            TransactionId(sale_date=datetime.date(2006, 12, 31), apn=13L),
+            TransactionId(sale_date=datetime.date(2007, 1, 5), apn=10L),
+        ]
+        self.en = ('train', 'global', 'en')
+        self.rf = ('train', 'MALIBU', 'rf')
+        cube = PredictionCube.create(self.dir_temp, tids, [self.en, self.rf], {'en': ['a', 'b'], 'rf': ['x']})
+        cube.put(self.en, cube.transaction_rows(tids), 'b', np.array([1.0, 2.0, 3.0]))
+        cube.put(self.rf, cube.transaction_rows(tids[:1]), 'x', np.array([4.0]))
+        cube.close()
+        self.cube = PredictionCube(self.dir_temp)
+        t = layout_transactions
+        self.samples = pd.DataFrame({
+            t.sale_date: [20070105.0, 20061231.0, 20070301.0],
+            t.apn: [12.0, 13.0, 14.0],
+            t.price: [100.0, 200.0, 300.0],
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_temp)
+
+    def test_actuals_predictions(self):
+        ap = ActualsPredictions.from_samples(self.samples, self.cube)
+        self.assertEqual(
+            {(self.en, 'b'): (100.0, 1.0), (self.rf, 'x'): (100.0, 4.0)},
+            ap.actuals_predictions((datetime.date(2007, 1, 5), 12L)),
+        )
+        result = ap.actuals_predictions((20070105, 10))  # no actual
+        self.assertEqual([(self.en, 'b')], result.keys())
+        self.assertTrue(np.isnan(result[(self.en, 'b')][0]))
+        self.assertRaises(KeyError, ap.actuals_predictions, (20070301, 14))  # no predictions
+        self.assertEqual([20061231, 20070105], list(ap.dates))
+        self.assertEqual(TransactionId(sale_date=20061231, apn=13), ap.transaction_ids()[0])
+
+    def test_lookup_batch(self):
+        ap = ActualsPredictions.from_samples(self.samples, self.cube)
+        actuals, predictions, present = ap.lookup([20070105, 20061231, 20070105], [12, 13, 10])
+        self.assertEqual([100.0, 200.0], list(actuals[:2]))
+        en, rf = self.cube.fitted_index(self.en), self.cube.fitted_index(self.rf)
+        self.assertEqual([1.0, 2.0, 3.0], list(predictions[:, en, 1]))
+        self.assertEqual([True, False, False], list(present[:, rf, 0]))
+        no_samples = ActualsPredictions.from_samples(self.samples.iloc[0:0], self.cube)
+        actuals, predictions, present = no_samples.lookup([20070105, 20061231], [12, 13])
+        self.assertTrue(np.all(np.isnan(actuals)))
+        self.assertEqual([1.0, 2.0], list(predictions[:, en, 1]))
+
+    def test_rows(self):
+        ap = ActualsPredictions.from_samples(self.samples, self.cube, self.cube.rows_in_month(200701))
+        en = self.cube.fitted_index(self.en)
+        self.assertEqual([3.0], list(ap.lookup([20070105], [10])[1][:, en, 1]))
+        self.assertRaises(KeyError, ap.lookup, [20061231], [13])
 
 
 if __name__ == '__main__':
@@ -5,6 +5,8 @@ import pdb
 import time
 import unittest
 
+import serialize
+
 if False:
     # example
     class Cache(object):
@@ -28,7 +30,7 @@ class Cache(object):
         'return whatever read_data_function(**kwds) returns'
         start_time = time.time()
         if os.path.exists(path_to_cache):
-            with open(path_to_cache, 'r') as f:
+            with open(path_to_cache, 'rb') as f:
                 cache = pickle.load(f)
             if self.verbose:
                 print 'read cache; elapsed wall clock time', time.time() - start_time
@@ -37,8 +39,8 @@ class Cache(object):
             if self.verbose:
                 print 'read underlying data; elapsed wall clock time', time.time() - start_time
             start_time = time.time()
-            with open(path_to_cache, 'w') as f:
-                pickle.dump(cache, f)
+            with open(path_to_cache, 'wb') as f:
+                serialize.dump(cache, f)
             if self.verbose:
                 print 'write cache: elapsed wall clock time', time.time() - start_time
         return cache
@@ -0,0 +1,146 @@
+'''in-process cache of transformed X and y for named sets of samples
+
+An entry holds the X and y that Features().extract_and_transform_X_y returns for all the
+samples in a set, for one features_group, units_X and units_y. Callers get the rows for
+any subset of the samples, such as the training samples in a time window, by position
+or by the index labels of the subset.
+
+When the entries use more than max_bytes, the least recently used entries are evicted.
+'''
+
+import collections
+import numpy as np
+import pandas as pd
+import pdb
+import unittest
+
+from Features import Features
+import layout_transactions
+
+
+class DesignMatrixCache(object):
+    def __init__(self, max_bytes=2 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self._samples = {}  # name --> DataFrame
+        self._entries = collections.OrderedDict()  # (name, features_group, units_X, units_y) --> (X, y)
+        self._n_bytes = 0
+
+    def add_samples(self, name, samples):
+        'register a set of samples; its index labels identify the rows of its subsets'
+        assert name not in self._samples, name
+        assert samples.index.is_unique
+        self._samples[name] = samples
+
+    def samples(self, name):
+        'return the named samples'
+        return self._samples[name]
+
+    def n_bytes(self):
+        'return number of bytes in the cached X and y arrays'
+        return self._n_bytes
+
+    def X_y(self, name, features_group, units_X, units_y, rows=None):
+        '''return (X, y) for the rows (positions or slice in the samples; default all rows) of the named samples
+
+        When rows is None or a slice, the arrays returned are the cached arrays or views of them;
+        callers must not modify them.
+        '''
+        key = (name, features_group, units_X, units_y)
+        if key in self._entries:
+            X, y = self._entries.pop(key)  # re-inserted below as the most recently used
+        else:
+            f = Features()
+            X, y = f.extract_and_transform_X_y(
+                self._samples[name],
+                f.ege(features_group),
+                layout_transactions.price,
+                units_X,
+                units_y,
+                True,
+            )
+            self._n_bytes += X.nbytes + y.nbytes
+        self._entries[key] = (X, y)
+        self.evict()
+        if rows is None:
+            return X, y
+        return X[rows], y[rows]
+
+    def X_y_subset(self, name, subset, features_group, units_X, units_y):
+        'return (X, y) for subset, a DataFrame whose index labels are in the named samples'
+        samples = self._samples[name]
+        if subset.index.equals(samples.index):
+            return self.X_y(name, features_group, units_X, units_y)
+        rows = samples.index.get_indexer(subset.index)
+        assert np.all(rows >= 0), 'subset has rows not in samples %s' % name
+        if len(rows) > 0 and rows[-1] - rows[0] + 1 == len(rows) and np.all(np.diff(rows) == 1):
+            rows = slice(rows[0], rows[-1] + 1)  # ex: a window of months from a SampleSelector; a view
+        return self.X_y(name, features_group, units_X, units_y, rows)
+
+    def evict(self):
+        'drop least recently used entries until within max_bytes; always keep the most recent'
+        while self._n_bytes > self.max_bytes and len(self._entries) > 1:
+            key, (X, y) = self._entries.popitem(last=False)
+            self._n_bytes -= X.nbytes + y.nbytes
+
+    def clear(self):
+        'drop all the entries'
+        self._entries.clear()
+        self._n_bytes = 0
+
+
+class TestDesignMatrixCache(unittest.TestCase):
+    def setUp(self):
+        t = layout_transactions
+        self.samples = pd.DataFrame({
+            t.building_living_square_feet: [1000.0, 2000.0, 3000.0, 4000.0],
+            t.lot_land_square_feet: [5000.0, 6000.0, 7000.0, 8000.0],
+            t.price: [100000.0, 200000.0, 300000.0, 400000.0],
+        })
+
+    def direct(self, df, units_X, units_y):
+        f = Features()
+        return f.extract_and_transform_X_y(df, f.ege('s'), layout_transactions.price, units_X, units_y, True)
+
+    def test_same_as_direct(self):
+        cache = DesignMatrixCache()
+        cache.add_samples('train', self.samples)
+        for units_X in ('natural', 'log'):
+            for units_y in ('natural', 'log'):
+                X, y = cache.X_y('train', 's', units_X, units_y)
+                X_direct, y_direct = self.direct(self.samples, units_X, units_y)
+                self.assertTrue(np.array_equal(X_direct, X))
+                self.assertTrue(np.array_equal(y_direct, y))
+
+    def test_subset(self):
+        cache = DesignMatrixCache()
+        cache.add_samples('train', self.samples)
+        subset = self.samples.loc[self.samples[layout_transactions.price] > 150000.0]
+        X, y = cache.X_y_subset('train', subset, 's', 'log', 'log')
+        X_direct, y_direct = self.direct(subset, 'log', 'log')
+        self.assertTrue(np.array_equal(X_direct, X))
+        self.assertTrue(np.array_equal(y_direct, y))
+
+    def test_contiguous_subset_is_view(self):
+        cache = DesignMatrixCache()
+        cache.add_samples('train', self.samples)
+        X_all, y_all = cache.X_y('train', 's', 'log', 'log')
+        X, y = cache.X_y_subset('train', self.samples.iloc[1:3], 's', 'log', 'log')
+        self.assertTrue(np.array_equal(X_all[1:3], X))
+        self.assertTrue(np.may_share_memory(X, X_all))
+
+    def test_evict(self):
+        cache = DesignMatrixCache(max_bytes=100)  # one entry uses 4 * 2 * 8 + 4 * 8 = 96 bytes
+        cache.add_samples('train', self.samples)
+        cache.X_y('train', 's', 'natural', 'natural')
+        self.assertEqual(96, cache.n_bytes())
+        cache.X_y('train', 's', 'log', 'log')
+        self.assertEqual(96, cache.n_bytes())
+        self.assertEqual([('train', 's', 'log', 'log')], cache._entries.keys())
+        cache.clear()
+        self.assertEqual(0, cache.n_bytes())
+
+
+if __name__ == '__main__':
+    unittest.main()
+    if False:
+        pdb
@@ -1,28 +1,76 @@
+'''dictionary kept in a disk file of pickled (key, value) records
+
+The keys and the positions of their records are kept in an index file alongside the
+disk file, written by RecordLog, so that get(key), keys() and key in dd do not unpickle
+any other values. When a key is appended more than once, get returns its last value
+and compact() drops the earlier records.
+'''
+
 import os
 import pdb
 import cPickle as pickle
 import unittest
 
+from RecordLog import RecordLog
+
 
 class DiskDictionary(object):
     def __init__(self, filepath):
         self.filepath = filepath
         self.f = None
+        self.log = None  # RecordLog for the disk file and its index
+        self.writing = False
 
     def append(self, key, value):
         'write key and value to disk'
-        if self.f is None:
-            self.f = open(self.filepath, 'wb')
-        record = (key, value)
-        pickle.dump(record, self.f)
+        if not self.writing:
+            # the first append starts a new disk file
+            self.close()
+            for path in (self.filepath, self.filepath + '.index'):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.log = RecordLog(self.filepath)
+            self.writing = True
+        self.log.append(key, value)
 
     def close(self):
         if self.f is not None:
             self.f.close()
+            self.f = None
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+        self.writing = False
+
+    def _indexed(self):
+        'return RecordLog for the disk file, which must exist'
+        if self.log is None:
+            self.log = RecordLog(self.filepath)
+        return self.log
+
+    def get(self, key):
+        'return value for the key from its record, without reading the other records'
+        if not self.file_exists():
+            raise KeyError(key)
+        return self._indexed().get(key)
+
+    def keys(self):
+        'return list of keys, without unpickling the values'
+        if not self.file_exists():
+            return []
+        return self._indexed().keys()
+
+    def __contains__(self, key):
+        return self.file_exists() and key in self._indexed()
+
+    def compact(self):
+        'rewrite the disk file with just the last record for each key'
+        if self.file_exists():
+            self._indexed().compact()
 
     def items(self):
         'generate (key, value) pairs that are in the disk file'
-        if self.f is not None:
+        if self.f is not None or self.writing:
             raise RuntimeError('backing file already opened')
         self.f = open(self.filepath, 'rb')
         while True:
@@ -42,20 +90,14 @@ class DiskDictionary(object):
 
     def keyset(self):
         'return set of keys in the disk file'
-        result = set()
-        if self.file_exists():
-            for k, v in self.items():
-                # assert k not in result, 'duplicate key: %s' % str(k)
-                result.add(k)
-        return result
+        return set(self.keys())
 
     # implement with DiskDictionary(path) as dd:
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
-        if self.f is not None:
-            self.f.close()
+        self.close()
 
 
 class Test(unittest.TestCase):
@@ -93,6 +135,35 @@ class Test(unittest.TestCase):
         path = '/tmp/blah blah'
         with DiskDictionary(path) as dd:
             self.assertFalse(dd.file_exists())
+            self.assertFalse('key1' in dd)
+            self.assertEqual([], dd.keys())
+
+    def test_get_keys_contains(self):
+        path = '/tmp/DiskDictionary'
+        with DiskDictionary(path) as dd:
+            dd.append('key1', ['value1', 1])
+            dd.append('key2', ['value2', 2])
+            self.assertEqual(['value2', 2], dd.get('key2'))
+        with DiskDictionary(path) as dd:
+            self.assertEqual(['key1', 'key2'], dd.keys())
+            self.assertTrue('key1' in dd)
+            self.assertFalse('key3' in dd)
+            self.assertEqual(['value1', 1], dd.get('key1'))
+            self.assertRaises(KeyError, dd.get, 'key3')
+
+    def test_compact(self):
+        path = '/tmp/DiskDictionary'
+        with DiskDictionary(path) as dd:
+            dd.append('key1', 'rec1')
+            dd.append('key2', 'rec2')
+            dd.append('key1', 'rec3')
+        with DiskDictionary(path) as dd:
+            self.assertEqual('rec3', dd.get('key1'))
+            self.assertEqual(3, len(list(dd.items())))
+            dd.compact()
+        with DiskDictionary(path) as dd:
+            self.assertEqual([('key2', 'rec2'), ('key1', 'rec3')], list(dd.items()))
+            self.assertEqual(['key2', 'key1'], dd.keys())
 
 
 if __name__ == '__main__':
@@ -1,4 +1,3 @@
-import math
 import numpy as np
 from pprint import pprint as pp
 import pdb
@@ -83,38 +82,35 @@ class Features(object):
                                   units_y,
                                   transform_y,
                                   ):
-        'return X and y'
-        def transform_series(value, how_to_transform=None):
-            if how_to_transform is None:
-                return value
+        'return X and y; y is None if not transform_y'
+        def transform_column(feature_name, how_to_transform, units, out):
+            'fill out with the transformed values of the column'
+            values = df[feature_name].values
+            if units == 'natural' or how_to_transform is None:
+                out[:] = values
             elif how_to_transform == 'log':
-                return math.log(value)
+                np.log(values, out=out)
             elif how_to_transform == 'log1p':
-                return math.log1p(value)
+                np.log1p(values, out=out)
             else:
                 print 'bad how_to_transform:', how_to_transform
                 pdb.set_trace()
 
-        def transform_column(feature_name, how_to_transform, units):
-            series = df[feature_name]
-            transformed = (
-                series if units == 'natural' else
-                series.apply(transform_series, how_to_transform=how_to_transform)
-            )
-            return transformed.values
-
-        X_transposed = np.empty((len(features_transforms), len(df),),
-                                dtype='float64',
-                                )
-        for i, feature_transform in enumerate(features_transforms):
-            feature_name, how_to_transform = feature_transform
-            X_transposed[i] = transform_column(feature_name, how_to_transform, units_X)
-
-        y = (transform_column(target_feature_name, 'log', units_y)
-             if transform_y
-             else None)
-        y_float64 = y.astype('float64', casting='safe')  # don't loose precision
-        assert y_float64.dtype == 'float64', (y.dtype, y_float64.dtype)
+        # raise, as math.log and math.log1p did, instead of returning -inf or nan
+        with np.errstate(divide='raise', invalid='raise'):
+            X_transposed = np.empty((len(features_transforms), len(df),),
+                                    dtype='float64',
+                                    )
+            for i, feature_transform in enumerate(features_transforms):
+                feature_name, how_to_transform = feature_transform
+                transform_column(feature_name, how_to_transform, units_X, X_transposed[i])
+
+            if transform_y:
+                assert np.can_cast(df[target_feature_name].dtype, 'float64', casting='safe')  # don't loose precision
+                y_float64 = np.empty(len(df), dtype='float64')
+                transform_column(target_feature_name, 'log', units_y, y_float64)
+            else:
+                y_float64 = None
 
         return X_transposed.T, y_float64
 
@@ -0,0 +1,180 @@
+'''per-month sufficient statistics for fitting linear models on windows of months
+
+For each units_X and units_y combination, hold for every month the number of samples,
+the column sums, X^T X, X^T y and y^T y. The statistics for any window of months are
+the sums of the statistics of its months, so fitting a linear model on a window does
+not depend on the number of samples in the window.
+
+The statistics are accumulated about the mean over all the samples, which avoids losing
+precision when the window is centered.
+'''
+
+import collections
+import numpy as np
+import pandas as pd
+import pdb
+import unittest
+
+from Features import Features
+import layout_transactions
+from Month import Month
+
+
+Gram = collections.namedtuple(
+    'Gram',
+    'n_samples X_shift y_shift X_sum y_sum XtX Xty yty',  # sums are of the shifted values
+)
+
+
+def make_gram(X, y, X_shift, y_shift):
+    'return Gram for the samples in X and y'
+    X_shifted = X - X_shift
+    y_shifted = y - y_shift
+    return Gram(
+        n_samples=len(y),
+        X_shift=X_shift,
+        y_shift=y_shift,
+        X_sum=np.sum(X_shifted, axis=0),
+        y_sum=np.sum(y_shifted),
+        XtX=np.dot(X_shifted.T, X_shifted),
+        Xty=np.dot(X_shifted.T, y_shifted),
+        yty=np.dot(y_shifted, y_shifted),
+    )
+
+
+def add(a, b):
+    'return Gram for the union of the disjoint samples in a and b'
+    assert a.X_shift is b.X_shift
+    assert a.y_shift == b.y_shift
+    return Gram(
+        n_samples=a.n_samples + b.n_samples,
+        X_shift=a.X_shift,
+        y_shift=a.y_shift,
+        X_sum=a.X_sum + b.X_sum,
+        y_sum=a.y_sum + b.y_sum,
+        XtX=a.XtX + b.XtX,
+        Xty=a.Xty + b.Xty,
+        yty=a.yty + b.yty,
+    )
+
+
+def centered(gram):
+    'return (X_mean, y_mean, XtX, Xty, yty) with X and y centered on their means'
+    n = float(gram.n_samples)
+    X_mean_shifted = gram.X_sum / n
+    y_mean_shifted = gram.y_sum / n
+    XtX = gram.XtX - n * np.outer(X_mean_shifted, X_mean_shifted)
+    Xty = gram.Xty - n * X_mean_shifted * y_mean_shifted
+    yty = gram.yty - n * y_mean_shifted * y_mean_shifted
+    return (
+        gram.X_shift + X_mean_shifted,
+        gram.y_shift + y_mean_shifted,
+        XtX,
+        Xty,
+        yty,
+    )
+
+
+class GramStore(object):
+    def __init__(self, samples, features_group='swpn', units=None):
+        '''precompute the per-month statistics
+
+        samples: DataFrame with the features, the price and the sale date
+        units: iterable of (units_X, units_y); default is all four combinations
+        '''
+        if units is None:
+            units = (('natural', 'natural'), ('natural', 'log'), ('log', 'natural'), ('log', 'log'))
+        f = Features()
+        sale_dates = samples[layout_transactions.sale_date].values  # float YYYYMMDD
+        yyyymms = (sale_dates // 100).astype('int64')
+        month_rows = {int(yyyymm): np.flatnonzero(yyyymms == yyyymm) for yyyymm in np.unique(yyyymms)}
+
+        self._grams = {}
+        for units_X, units_y in units:
+            X, y = f.extract_and_transform_X_y(
+                samples,
+                f.ege(features_group),
+                layout_transactions.price,
+                units_X,
+                units_y,
+                True,
+            )
+            X_shift = np.mean(X, axis=0)
+            y_shift = np.mean(y)
+            self._grams[(units_X, units_y)] = {
+                yyyymm: make_gram(X[rows], y[rows], X_shift, y_shift)
+                for yyyymm, rows in month_rows.iteritems()
+            }
+
+    def months(self):
+        'return sorted list of YYYYMM ints for which there are samples'
+        a_units = self._grams.keys()[0]
+        return sorted(self._grams[a_units].keys())
+
+    def window(self, units_X, units_y, first_month, last_month):
+        'return Gram for samples in first_month through last_month (Month instances) or None if no samples'
+        first = first_month.as_int()
+        last = last_month.as_int()
+        result = None
+        for yyyymm, gram in sorted(self._grams[(units_X, units_y)].iteritems()):
+            if first <= yyyymm <= last:
+                result = gram if result is None else add(result, gram)
+        return result
+
+
+class TestGramStore(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(123)
+        n = 300
+        t = layout_transactions
+        self.samples = pd.DataFrame({
+            t.building_living_square_feet: random_state.randint(500, 5000, n).astype('float64'),
+            t.lot_land_square_feet: random_state.randint(1000, 20000, n).astype('float64'),
+            t.sale_date: random_state.choice([20061215.0, 20070103.0, 20070220.0, 20070331.0], n),
+        })
+        self.samples[t.price] = (
+            100.0 * self.samples[t.building_living_square_feet] +
+            10.0 * self.samples[t.lot_land_square_feet] +
+            random_state.randint(1, 10000, n)
+        )
+
+    def in_window(self, first, last):
+        sale_dates = self.samples[layout_transactions.sale_date]
+        return self.samples.loc[(sale_dates >= first * 100) & (sale_dates <= last * 100 + 31)]
+
+    def test_months(self):
+        store = GramStore(self.samples, features_group='s')
+        self.assertEqual([200612, 200701, 200702, 200703], store.months())
+
+    def test_window_same_as_direct(self):
+        store = GramStore(self.samples, features_group='s')
+        for units_X in ('natural', 'log'):
+            for units_y in ('natural', 'log'):
+                gram = store.window(units_X, units_y, Month(200701), Month(200703))
+                X, y = Features().extract_and_transform_X_y(
+                    self.in_window(200701, 200703),
+                    Features().ege('s'),
+                    layout_transactions.price,
+                    units_X,
+                    units_y,
+                    True,
+                )
+                self.assertEqual(len(y), gram.n_samples)
+                X_mean, y_mean, XtX, Xty, yty = centered(gram)
+                X_centered = X - np.mean(X, axis=0)
+                y_centered = y - np.mean(y)
+                self.assertTrue(np.allclose(np.mean(X, axis=0), X_mean))
+                self.assertTrue(np.allclose(np.mean(y), y_mean))
+                self.assertTrue(np.allclose(np.dot(X_centered.T, X_centered), XtX))
+                self.assertTrue(np.allclose(np.dot(X_centered.T, y_centered), Xty))
+                self.assertTrue(np.allclose(np.dot(y_centered, y_centered), yty))
+
+    def test_window_without_samples(self):
+        store = GramStore(self.samples, features_group='s')
+        self.assertTrue(store.window('natural', 'natural', Month(200801), Month(200812)) is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
+    if False:
+        pdb
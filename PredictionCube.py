@@ -0,0 +1,212 @@
+'''dense memory-mapped cube of the predictions of the fitted models
+
+The cube in directory dir_path has these files:
+ predictions.npy: float32 array [transaction, fitted, hps]
+ present.npy: bool array [transaction, fitted, hps], True where there is a prediction
+ sale_date.npy, apn.npy: the transactions, sorted by sale_date (as yyyymmdd) and then apn
+ 0manifest.json: the fitted models and the hps strings for each model
+
+A fitted model is a tuple (training_data, neighborhood, model). The hps index of a
+prediction is the position of its hps string in the hps strings for the model of the
+fitted model, so that the models share the hps axis.
+
+The transactions in a month or year are a slice of the rows, so that they are read from
+the memory-mapped files without reading the other months. The cube is complete only
+once the manifest is written, when the writer is closed.
+'''
+
+import datetime
+import json
+import numpy as np
+import os
+import pdb
+import shutil
+import tempfile
+import unittest
+
+import dirutility
+import transaction_key
+from TransactionId import TransactionId
+
+
+manifest_file_name = '0manifest.json'
+
+
+class PredictionCube(object):
+    def __init__(self, dir_path, mode='r'):
+        'open the cube in dir_path; mode is "r" to read or "r+" to write predictions'
+        self.dir_path = dir_path
+        with open(os.path.join(dir_path, manifest_file_name), 'r') as f:
+            manifest = json.load(f)
+        self._set_indices(
+            fitteds=[tuple(str(x) for x in fitted) for fitted in manifest['fitteds']],
+            hps_strs={str(model): [str(x) for x in strs] for model, strs in manifest['hps_strs'].iteritems()},
+        )
+        self.sale_date = np.load(os.path.join(dir_path, 'sale_date.npy'))
+        self.apn = np.load(os.path.join(dir_path, 'apn.npy'))
+        self.predictions = np.load(os.path.join(dir_path, 'predictions.npy'), mmap_mode=mode)
+        self.present = np.load(os.path.join(dir_path, 'present.npy'), mmap_mode=mode)
+        self._set_rows()
+
+    @classmethod
+    def create(cls, dir_path, transaction_ids, fitteds, hps_strs):
+        '''return PredictionCube for writing, with no predictions present
+
+        transaction_ids: iterable of TransactionId with datetime.date sale dates
+        fitteds: iterable of (training_data, neighborhood, model)
+        hps_strs: dict[model] list of hps strings
+        '''
+        dirutility.assure_exists(dir_path)
+        manifest_path = os.path.join(dir_path, manifest_file_name)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)  # the cube is incomplete until the new manifest is written
+        keys = np.unique(transaction_key.from_transaction_ids(transaction_ids))  # sorted
+        fitteds = sorted(set(fitteds))
+        np.save(os.path.join(dir_path, 'sale_date.npy'), transaction_key.sale_dates(keys).astype('int32'))
+        np.save(os.path.join(dir_path, 'apn.npy'), transaction_key.apns(keys))
+        shape = (len(keys), len(fitteds), max(len(strs) for strs in hps_strs.itervalues()))
+        # the pages are not written until they hold predictions, so files for sparse cubes stay small
+        np.lib.format.open_memmap(os.path.join(dir_path, 'predictions.npy'), 'w+', 'float32', shape).flush()
+        np.lib.format.open_memmap(os.path.join(dir_path, 'present.npy'), 'w+', 'bool', shape).flush()
+
+        self = cls.__new__(cls)
+        self.dir_path = dir_path
+        self._set_indices(fitteds, hps_strs)
+        self.sale_date = np.load(os.path.join(dir_path, 'sale_date.npy'))
+        self.apn = np.load(os.path.join(dir_path, 'apn.npy'))
+        self.predictions = np.load(os.path.join(dir_path, 'predictions.npy'), mmap_mode='r+')
+        self.present = np.load(os.path.join(dir_path, 'present.npy'), mmap_mode='r+')
+        self._set_rows()
+        return self
+
+    def _set_indices(self, fitteds, hps_strs):
+        self.fitteds = list(fitteds)
+        self.hps_strs = hps_strs
+        self._fitted_index = {fitted: i for i, fitted in enumerate(self.fitteds)}
+        self._hps_index = {
+            model: {hps_str: i for i, hps_str in enumerate(strs)}
+            for model, strs in hps_strs.iteritems()
+        }
+
+    def _set_rows(self):
+        self.keys = transaction_key.pack(self.sale_date, self.apn)  # sorted
+        yyyymm = self.sale_date // 100
+        self._months, starts = np.unique(yyyymm, return_index=True)
+        self._starts = np.append(starts, len(yyyymm))
+
+    def fitted_index(self, fitted):
+        return self._fitted_index[fitted]
+
+    def hps_index(self, model, hps_str):
+        return self._hps_index[model][hps_str]
+
+    def transaction_rows(self, transaction_ids):
+        'return array of the rows of the transaction_ids; raise KeyError if one is not in the cube'
+        return self.key_rows(transaction_key.from_transaction_ids(transaction_ids))
+
+    def key_rows(self, keys):
+        'return array of the rows of the transaction keys; raise KeyError if one is not in the cube'
+        return transaction_key.rows(self.keys, keys)
+
+    def transaction_ids(self, rows=slice(None)):
+        'return list of TransactionId for the rows'
+        return [
+            TransactionId(sale_date=sale_date, apn=apn)  # sale_date is yyyymmdd
+            for sale_date, apn in zip(self.sale_date[rows], self.apn[rows])
+        ]
+
+    def rows_between(self, first_yyyymm, last_yyyymm):
+        'return slice of the rows of the transactions in months first_yyyymm through last_yyyymm'
+        start = self._starts[np.searchsorted(self._months, first_yyyymm, side='left')]
+        stop = self._starts[np.searchsorted(self._months, last_yyyymm, side='right')]
+        return slice(start, stop)
+
+    def rows_in_month(self, yyyymm):
+        return self.rows_between(yyyymm, yyyymm)
+
+    def rows_in_year(self, year):
+        return self.rows_between(year * 100 + 1, year * 100 + 12)
+
+    def put(self, fitted, rows, hps_str, predictions):
+        'store the predictions of the fitted model with the hps for the transactions in rows'
+        i = self._fitted_index[fitted]
+        j = self._hps_index[fitted[2]][hps_str]
+        self.predictions[rows, i, j] = predictions
+        self.present[rows, i, j] = True
+
+    def get(self, fitted, hps_str, rows=slice(None)):
+        'return (predictions, present) for the fitted model with the hps for the transactions in rows'
+        i = self._fitted_index[fitted]
+        j = self._hps_index[fitted[2]][hps_str]
+        return self.predictions[rows, i, j], self.present[rows, i, j]
+
+    def close(self):
+        'flush the predictions; when writing, write the manifest, which completes the cube'
+        writing = self.predictions.mode == 'r+'
+        self.predictions.flush()
+        self.present.flush()
+        if not writing:
+            return
+        manifest = {
+            'fitteds': [list(fitted) for fitted in self.fitteds],
+            'hps_strs': self.hps_strs,
+            'shape': list(self.predictions.shape),
+        }
+        manifest_path = os.path.join(self.dir_path, manifest_file_name)
+        temp_path = manifest_path + '.temp'
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.rename(temp_path, manifest_path)
+
+
+class TestPredictionCube(unittest.TestCase):
+    def setUp(self):
+        self.dir_temp = tempfile.mkdtemp()
+        self.dir_path = os.path.join(self.dir_temp, 'cube')
+        self.tids = [
+            TransactionId(sale_date=datetime.date(2007, 2, 3), apn=11L),
+            TransactionId(sale_date=datetime.date(2007, 1, 5), apn=12L),
+            TransactionId(sale_date=datetime.date(2006, 12, 31), apn=13L),
+            TransactionId(sale_date=datetime.date(2007, 1, 5), apn=10L),
+        ]
+        self.en = ('train', 'global', 'en')
+        self.rf = ('train', 'MALIBU', 'rf')
+        self.hps_strs = {'en': ['a', 'b', 'c'], 'rf': ['x', 'y']}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_temp)
+
+    def test_put_get(self):
+        cube = PredictionCube.create(self.dir_path, self.tids, [self.rf, self.en], self.hps_strs)
+        self.assertEqual((4, 2, 3), cube.predictions.shape)
+        rows = cube.transaction_rows(self.tids[1:3])
+        cube.put(self.en, rows, 'b', np.array([1.5, 2.5]))
+        cube.put(self.rf, cube.transaction_rows(self.tids), 'y', np.array([1.0, 2.0, 3.0, 4.0]))
+        self.assertFalse(os.path.exists(os.path.join(self.dir_path, manifest_file_name)))
+        cube.close()
+
+        cube = PredictionCube(self.dir_path)
+        predictions, present = cube.get(self.en, 'b')
+        self.assertEqual([True, False, True, False], list(present))  # sorted by date, then apn
+        self.assertEqual([2.5, 1.5], list(predictions[present]))
+        predictions, present = cube.get(self.rf, 'y', cube.transaction_rows([self.tids[0]]))
+        self.assertEqual([1.0], list(predictions))
+        self.assertFalse(np.any(cube.get(self.en, 'a')[1]))
+        self.assertRaises(KeyError, cube.transaction_rows, [self.tids[0]._replace(apn=99L)])
+        cube.close()
+
+    def test_months(self):
+        cube = PredictionCube.create(self.dir_path, self.tids, [self.en], self.hps_strs)
+        cube.close()
+        cube = PredictionCube(self.dir_path)
+        self.assertEqual(slice(1, 3), cube.rows_in_month(200701))
+        self.assertEqual([10, 12], list(cube.apn[cube.rows_in_month(200701)]))
+        self.assertEqual(slice(1, 4), cube.rows_in_year(2007))
+        self.assertEqual(0, len(cube.apn[cube.rows_in_month(200703)]))
+        self.assertEqual(TransactionId(sale_date=20061231, apn=13L), cube.transaction_ids(slice(0, 1))[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
+    if False:
+        pdb
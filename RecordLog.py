@@ -0,0 +1,231 @@
+'''append-only log of pickled (key, value) records with a sidecar index
+
+The log file at path is a sequence of pickled (key, value) tuples, the format that
+readers of valavm output already load with repeated pickle.load calls. The index file
+at path + '.index' is a sequence of pickled (key, offset, end) tuples, one for each
+record in the log, so that the keys are known without unpickling the values.
+
+Records are only appended; existing records are never rewritten. When the log is
+opened, records after the last indexed one are indexed if they are complete, and a
+torn record at the end of the log, left by a crash while appending, is truncated.
+A log without an index file is indexed by reading it once.
+
+When a key is appended more than once, get returns its last value, and compact drops
+the earlier records.
+'''
+
+import cPickle as pickle
+import os
+import pdb
+import shutil
+import tempfile
+import unittest
+
+import serialize
+
+
+class RecordLog(object):
+    def __init__(self, path):
+        'open the log at path, creating it if it does not exist'
+        self.path = path
+        self.path_index = path + '.index'
+        self._offsets = {}  # key --> (offset, end) in the log
+        if not os.path.exists(self.path):
+            open(self.path, 'wb').close()
+        log_end = self._read_index()
+        self._recover(log_end)
+        self.f = open(self.path, 'ab')
+        self.f.seek(0, os.SEEK_END)  # so that tell() is the offset of the next record
+        self.f_index = open(self.path_index, 'ab')
+
+    def _read_index(self):
+        'read the complete records in the index file; return end in the log of the last one'
+        log_end = 0
+        index_end = 0
+        log_size = os.path.getsize(self.path)
+        if os.path.exists(self.path_index):
+            with open(self.path_index, 'rb') as f:
+                while True:
+                    try:
+                        key, offset, end = pickle.load(f)
+                    except EOFError:
+                        break
+                    except (pickle.UnpicklingError, ValueError, IndexError):
+                        break  # a torn index record
+                    if end > log_size:
+                        break  # the index is ahead of the log, which was truncated
+                    self._offsets[key] = (offset, end)
+                    log_end = max(log_end, end)
+                    index_end = f.tell()
+        with open(self.path_index, 'ab') as f:
+            f.truncate(index_end)
+        return log_end
+
+    def _recover(self, log_end):
+        'index the complete records after log_end in the log and truncate a torn last record'
+        with open(self.path, 'r+b') as f:
+            f.seek(log_end)
+            with open(self.path_index, 'ab') as f_index:
+                while True:
+                    offset = f.tell()
+                    try:
+                        key, value = pickle.load(f)
+                    except EOFError:
+                        break
+                    except (pickle.UnpicklingError, ValueError, IndexError):
+                        break  # a torn record; other errors, such as a missing class, are raised
+                    self._offsets[key] = (offset, f.tell())
+                    serialize.dump((key, offset, f.tell()), f_index)
+            f.truncate(offset)
+
+    def __contains__(self, key):
+        return key in self._offsets
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def keys(self):
+        'return list of the keys, in the order of their records in the log'
+        return sorted(self._offsets, key=lambda key: self._offsets[key][0])
+
+    def append(self, key, value):
+        'append record (key, value) to the log and its offsets to the index'
+        offset = self.f.tell()
+        serialize.dump((key, value), self.f)
+        self.f.flush()  # the record is complete before it is indexed
+        end = self.f.tell()
+        serialize.dump((key, offset, end), self.f_index)
+        self.f_index.flush()
+        self._offsets[key] = (offset, end)
+
+    def get(self, key):
+        'return value for the key'
+        offset, end = self._offsets[key]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            record_key, value = pickle.load(f)
+        return value
+
+    def compact(self):
+        'rewrite the log and index with just the last record for each key, copying the pickled bytes'
+        path_temp = self.path + '.compact'
+        path_index_temp = self.path_index + '.compact'
+        offsets = {}
+        self.f.flush()
+        with open(self.path, 'rb') as f_in:
+            with open(path_temp, 'wb') as f_out:
+                with open(path_index_temp, 'wb') as f_index_out:
+                    for key in self.keys():
+                        offset, end = self._offsets[key]
+                        f_in.seek(offset)
+                        new_offset = f_out.tell()
+                        f_out.write(f_in.read(end - offset))
+                        offsets[key] = (new_offset, f_out.tell())
+                        serialize.dump((key, new_offset, f_out.tell()), f_index_out)
+        self.close()
+        # if interrupted, the log is either the old one or the new one, without an index to rebuild
+        os.remove(self.path_index)
+        os.rename(path_temp, self.path)
+        os.rename(path_index_temp, self.path_index)
+        self._offsets = offsets
+        self.f = open(self.path, 'ab')
+        self.f.seek(0, os.SEEK_END)
+        self.f_index = open(self.path_index, 'ab')
+
+    def close(self):
+        self.f.close()
+        self.f_index.close()
+
+    # implement with RecordLog(path) as log:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class TestRecordLog(unittest.TestCase):
+    def setUp(self):
+        self.dir_temp = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir_temp, 'log.pickle')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_temp)
+
+    def read_records(self):
+        'read the log as the readers of valavm output do'
+        result = []
+        with open(self.path, 'rb') as f:
+            while True:
+                try:
+                    result.append(pickle.load(f))
+                except EOFError:
+                    break
+        return result
+
+    def test_append_and_reopen(self):
+        with RecordLog(self.path) as log:
+            self.assertEqual(0, len(log))
+            log.append(('a', 1), [1.0, 2.0])
+            log.append(('b', 2), [3.0])
+        with RecordLog(self.path) as log:
+            self.assertEqual(2, len(log))
+            self.assertTrue(('a', 1) in log)
+            self.assertFalse(('c', 3) in log)
+            self.assertEqual([('a', 1), ('b', 2)], log.keys())
+            self.assertEqual([3.0], log.get(('b', 2)))
+            log.append(('c', 3), [4.0])
+            self.assertEqual([('a', 1), ('b', 2), ('c', 3)], log.keys())
+            self.assertEqual([4.0], log.get(('c', 3)))
+        self.assertEqual(
+            [(('a', 1), [1.0, 2.0]), (('b', 2), [3.0]), (('c', 3), [4.0])],
+            self.read_records(),
+        )
+
+    def test_torn_last_record_is_truncated(self):
+        with RecordLog(self.path) as log:
+            log.append('a', range(100))
+            log.append('b', range(100))
+        size = os.path.getsize(self.path)
+        with open(self.path, 'ab') as f:
+            f.truncate(size - 10)
+        with RecordLog(self.path) as log:
+            self.assertEqual(['a'], log.keys())
+            log.append('c', 3)
+        self.assertEqual([('a', range(100)), ('c', 3)], self.read_records())
+
+    def test_records_not_in_index_are_indexed(self):
+        with open(self.path, 'wb') as f:  # written before there was an index
+            pickle.dump(('a', 1), f)
+            pickle.dump(('b', 2), f)
+        with RecordLog(self.path) as log:
+            self.assertEqual(['a', 'b'], log.keys())
+        os.remove(self.path + '.index')
+        with RecordLog(self.path) as log:
+            log.append('c', 3)
+        with open(self.path + '.index', 'ab') as f:
+            f.truncate(os.path.getsize(self.path + '.index') - 3)  # torn index record
+        with RecordLog(self.path) as log:
+            self.assertEqual(['a', 'b', 'c'], log.keys())
+            self.assertEqual(3, log.get('c'))
+
+    def test_compact(self):
+        with RecordLog(self.path) as log:
+            log.append('a', 1)
+            log.append('b', 2)
+            log.append('a', 3)
+            self.assertEqual(3, log.get('a'))
+            self.assertEqual(['b', 'a'], log.keys())
+            log.compact()
+            self.assertEqual([('b', 2), ('a', 3)], self.read_records())
+            log.append('c', 4)
+        with RecordLog(self.path) as log:
+            self.assertEqual(['b', 'a', 'c'], log.keys())
+            self.assertEqual(3, log.get('a'))
+        self.assertEqual([('b', 2), ('a', 3), ('c', 4)], self.read_records())
+
+
+if __name__ == '__main__':
+    unittest.main()
+    if False:
+        pdb
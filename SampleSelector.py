@@ -1,29 +1,199 @@
-'select portions of samples'
+'''select portions of samples
 
+The samples are sorted by month once, with the offsets of each month recorded, so that
+the samples in any window of months are a contiguous slice of the sorted samples.
+
+LocationSampleSelector sorts by location and then by month, so that the samples in a
+location are a contiguous slice, with a SampleSelector for them made without rescanning.
+'''
+
+import numpy as np
+import os
+import pandas as pd
 import pdb
+import shutil
+import tempfile
+import unittest
 
+import column_store
 import layout_transactions
+from Month import Month
 
 
 class SampleSelector(object):
-    def __init__(self, samples):
-        self.samples = samples.copy()
-        self.dates = samples[layout_transactions.yyyymm]
+    def __init__(self, samples, index=None):
+        '''sort samples by month and record the offsets of the months
+
+        index: optional (months, starts) for samples already sorted by month, as
+               made by LocationSampleSelector
+        '''
+        if index is not None:
+            self.samples = samples
+            self.months, self.starts = index
+            return
+        months = samples[layout_transactions.yyyymm].values
+        order = np.argsort(months, kind='mergesort')  # stable: samples in a month keep their order
+        if np.all(order == np.arange(len(order))):
+            self.samples = samples  # already sorted, so do not copy
+        else:
+            self.samples = samples.take(order)
+        # self.samples.iloc[self.starts[i]:self.starts[i + 1]] are the samples in month self.months[i]
+        self.months, starts = np.unique(months[order], return_index=True)
+        self.starts = np.append(starts, len(order))
+
+    def rows_between(self, first, last):
+        'return slice of positions in self.samples of the samples in months first through last'
+        start = self.starts[np.searchsorted(self.months, first.as_int(), side='left')]
+        stop = self.starts[np.searchsorted(self.months, last.as_int(), side='right')]
+        return slice(start, stop)
 
     def in_month(self, month):
-        mask = self.dates == month.as_int()
-        kept = self.samples[mask]
-        return kept
+        return self.between_months(month, month)
 
     def between_months(self, first, last):
-        mask_first = self.dates >= first.as_int()
-        mask_last = self.dates <= last.as_int()
-        mask = mask_first & mask_last
-        kept = self.samples[mask]
+        kept = self.samples.iloc[self.rows_between(first, last)]
         return kept
 
 
+class LocationSampleSelector(object):
+    def __init__(self, samples, location_column_name):
+        'sort samples by location and then by month; samples with a missing location are dropped'
+        location_codes, self.locations = pd.factorize(samples[location_column_name])  # missing --> -1
+        months = samples[layout_transactions.yyyymm].values
+        order = np.lexsort((months, location_codes))  # stable
+        order = order[location_codes[order] >= 0]
+        if len(order) == len(samples) and np.all(order == np.arange(len(order))):
+            self.samples = samples  # already sorted, so do not copy
+        else:
+            self.samples = samples.take(order)
+        sorted_codes = location_codes[order]
+        sorted_months = months[order]
+
+        # groups of consecutive samples with the same location and month
+        is_group_start = np.ones(len(order), dtype=bool)
+        is_group_start[1:] = (
+            (sorted_codes[1:] != sorted_codes[:-1]) |
+            (sorted_months[1:] != sorted_months[:-1])
+        )
+        group_starts = np.flatnonzero(is_group_start)
+        self._group_codes = sorted_codes[group_starts]
+        self._group_months = sorted_months[group_starts]
+        self._group_starts = np.append(group_starts, len(order))
+        self._code = {location: code for code, location in enumerate(self.locations)}
+
+    def sample_selector(self, location):
+        'return SampleSelector for the samples in the location'
+        code = self._code.get(location)
+        if code is None:
+            return SampleSelector(self.samples.iloc[0:0], (np.array([], dtype='int64'), np.array([0])))
+        first_group = np.searchsorted(self._group_codes, code, side='left')
+        last_group = np.searchsorted(self._group_codes, code, side='right')
+        start = self._group_starts[first_group]
+        stop = self._group_starts[last_group]
+        return SampleSelector(
+            self.samples.iloc[start:stop],
+            (self._group_months[first_group:last_group], self._group_starts[first_group:last_group + 1] - start),
+        )
+
+
+class TestSampleSelector(unittest.TestCase):
+    def setUp(self):
+        self.samples = pd.DataFrame({
+            layout_transactions.yyyymm: [200702, 200612, 200701, 200702, 200612, 200703],
+            layout_transactions.price: [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        })
+
+    def test_in_month(self):
+        ss = SampleSelector(self.samples)
+        self.assertEqual([1.0, 4.0], list(ss.in_month(Month(200702))[layout_transactions.price]))
+        self.assertEqual([2.0, 5.0], list(ss.in_month(Month(200612))[layout_transactions.price]))
+        self.assertEqual(0, len(ss.in_month(Month(200611))))
+        self.assertEqual(0, len(ss.in_month(Month(200704))))
+
+    def test_between_months(self):
+        ss = SampleSelector(self.samples)
+        kept = ss.between_months(Month(200612), Month(200701))
+        self.assertEqual([2.0, 5.0, 3.0], list(kept[layout_transactions.price]))
+        self.assertEqual([1, 4, 2], list(kept.index))  # index labels of the unsorted samples
+        self.assertEqual(6, len(ss.between_months(Month(200601), Month(200801))))
+        self.assertEqual(0, len(ss.between_months(Month(200705), Month(200801))))
+
+    def test_same_as_mask(self):
+        ss = SampleSelector(self.samples)
+        dates = self.samples[layout_transactions.yyyymm]
+        for first in (200611, 200612, 200701, 200702, 200703):
+            for last in (200612, 200701, 200702, 200703, 200704):
+                expected = self.samples[(dates >= first) & (dates <= last)]
+                kept = ss.between_months(Month(first), Month(last))
+                self.assertEqual(sorted(expected.index), sorted(kept.index))
+
+    def test_sorted_samples_not_copied(self):
+        ss = SampleSelector(self.samples)
+        self.assertTrue(SampleSelector(ss.samples).samples is ss.samples)
+
+    def test_stored_samples_stay_mapped(self):
+        def is_mapped(series):
+            values = series.values
+            while values is not None and not isinstance(values, np.memmap):
+                values = values.base
+            return values is not None
+
+        dir_temp = tempfile.mkdtemp()
+        try:
+            path_csv = os.path.join(dir_temp, 'samples.csv')
+            column_store.write(SampleSelector(self.samples).samples, path_csv)  # sorted by month, as samples.py writes
+            samples = column_store.read(path_csv)
+            ss = SampleSelector(samples)
+            self.assertTrue(ss.samples is samples)
+            kept = ss.between_months(Month(200612), Month(200701))
+            self.assertEqual([2.0, 5.0, 3.0], list(kept[layout_transactions.price]))
+            if column_store.shares_pages:
+                self.assertTrue(is_mapped(kept[layout_transactions.price]))
+                self.assertTrue(is_mapped(kept[layout_transactions.yyyymm]))
+        finally:
+            shutil.rmtree(dir_temp)
+
+
+class TestLocationSampleSelector(unittest.TestCase):
+    def setUp(self):
+        t = layout_transactions
+        self.samples = pd.DataFrame({
+            t.yyyymm: [200702, 200612, 200701, 200702, 200612, 200703, 200701, 200612],
+            t.city: ['B', 'A', 'B', 'A', 'B', np.nan, 'A', 'A'],
+            t.price: [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0],
+        })
+
+    def test_locations(self):
+        lss = LocationSampleSelector(self.samples, layout_transactions.city)
+        self.assertEqual(['A', 'B'], sorted(lss.locations))
+        self.assertEqual(7, len(lss.samples))  # the sample without a city is dropped
+
+    def test_same_as_mask(self):
+        t = layout_transactions
+        lss = LocationSampleSelector(self.samples, t.city)
+        for location in ('A', 'B', 'C'):
+            in_location = self.samples[self.samples[t.city] == location]
+            dates = in_location[t.yyyymm]
+            ss = lss.sample_selector(location)
+            self.assertEqual(sorted(in_location.index), sorted(ss.samples.index))
+            for first in (200611, 200612, 200701, 200702, 200703):
+                for last in (200612, 200701, 200702, 200703, 200704):
+                    expected = in_location[(dates >= first) & (dates <= last)]
+                    kept = ss.between_months(Month(first), Month(last))
+                    self.assertEqual(sorted(expected.index), sorted(kept.index))
+
+    def test_sample_selector_same_as_sorting(self):
+        t = layout_transactions
+        lss = LocationSampleSelector(self.samples, t.city)
+        for location in lss.locations:
+            ss = lss.sample_selector(location)
+            ss_direct = SampleSelector(self.samples[self.samples[t.city] == location])
+            self.assertEqual(list(ss_direct.samples.index), list(ss.samples.index))
+            self.assertEqual(list(ss_direct.months), list(ss.months))
+            self.assertEqual(list(ss_direct.starts), list(ss.starts))
+
+
 if __name__ == '__main__':
-    # TODO: write unit test
+    unittest.main()
     if False:
         pdb
@@ -35,6 +35,7 @@ from Logger import Logger
 from ParseCommandLine import ParseCommandLine
 from Path import Path
 from linval import ResultKey, ResultValue
+import serialize
 cc = columns_contain
 
 
@@ -304,7 +305,7 @@ def main(argv):
     if control.arg.data:
         df, ege_control = make_data(control)
         with open(control.path_reduction, 'wb') as f:
-            pickle.dump((df, ege_control, control), f)
+            serialize.dump((df, ege_control, control), f)
     else:
         with open(control.path_reduction, 'rb') as f:
             df, ege_control, data_control = pickle.load(f)
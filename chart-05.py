@@ -32,6 +32,7 @@ from columns_contain import columns_contain
 from Logger import Logger
 from ParseCommandLine import ParseCommandLine
 from Path import Path
+import serialize
 from valgbr import ResultKey, ResultValue
 cc = columns_contain
 
@@ -320,7 +321,7 @@ def main(argv):
     if control.arg.data:
         df, ege_control = make_data(control)
         with open(control.path_reduction, 'wb') as f:
-            pickle.dump((df, ege_control, control), f)
+            serialize.dump((df, ege_control, control), f)
     else:
         with open(control.path_reduction, 'rb') as f:
             df, ege_control, data_control = pickle.load(f)
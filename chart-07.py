@@ -35,6 +35,7 @@ from Logger import Logger
 from ParseCommandLine import ParseCommandLine
 from Path import Path
 from Report import Report
+import serialize
 cc = columns_contain
 
 Key = collections.namedtuple(  # hold all posssible keys that valavm may have generated
@@ -358,7 +359,7 @@ def make_charts_c(reduction, control, median_prices):
         footer(r)
         r.write(control.path_chart_base + str(year) + '-c.txt')
         with open(control.path_chart_base + 'best.pickle', 'wb') as f:
-            pickle.dump(best, f)
+            serialize.dump(best, f)
         return best
 
     return create_report()
@@ -566,7 +567,7 @@ def main(argv):
         samples = pd.read_csv(control.path_in_samples)
         mae = make_data(control, best, samples)
         with open(control.path_reduction, 'wb') as f:
-            pickle.dump((mae, control), f)
+            serialize.dump((mae, control), f)
     else:
         with open(control.path_reduction, 'rb') as f:
             mae, reduction_control = pickle.load(f)
@@ -40,6 +40,7 @@ import sys
 
 from Bunch import Bunch
 from ColumnsTable import ColumnsTable
+import column_store
 from columns_contain import columns_contain
 import dirutility
 from Logger import Logger
@@ -47,6 +48,7 @@ from Month import Month
 from Path import Path
 from Report import Report
 import layout_transactions as t
+import serialize
 cc = columns_contain
 
 
@@ -413,9 +415,11 @@ def make_data(control):
         day = int(x)
         return datetime.date(year, month, day)
 
-    transactions = pd.read_csv(control.path_in_samples,
-                               nrows=10 if control.test else None,
-                               )
+    transactions = column_store.read(
+        control.path_in_samples,
+        nrows=10 if control.test else None,
+        usecols=[t.sale_date, t.price, t.city],
+    )
 
     dates = [to_datetime_date(x) for x in transactions[t.sale_date]]
     months = [Month(date.year, date.month) for date in dates]
@@ -631,7 +635,7 @@ def main(argv):
     if control.arg.data:
         data = make_data(control)
         with open(control.path_reduction, 'wb') as f:
-            pickle.dump((data, control), f)
+            serialize.dump((data, control), f)
     else:
         with open(control.path_reduction, 'rb') as f:
             data, reduction_control = pickle.load(f)
@@ -1,6 +1,6 @@
 '''create charts showing results of valgbr.py
 INVOCATION
-  python chart06.py FEATURESGROUP-HPS-LOCALITY --data
+  python chart06.py FEATURESGROUP-HPS-LOCALITY --data [--jobs N] [--keep-predictions K]
   python chart06.py FEATURESGROUP-HPS-global [--test] [--subset] [--norwalk] [--all]
   python chart06.py FEATURESGROUP-HPS-city [--test] [--subset] [--norwalk] [--all]  [--trace]
 where
@@ -12,6 +12,9 @@ where
   --subset means to process 0data-subset, not 0data, the full reduction
   --norwalk means to process 0data-norwalk, not 0data, the full reduction
   --all means to process all the cities, not just selected cities
+  --jobs N means to reduce the valavm files in N worker processes (default 1)
+  --keep-predictions K means to keep the predictions of just the K best models each month
+    and of the K best models the month before; the others keep just their errors
   --trace start with pdb.set_trace() call, so that we run under the debugger
 INPUT FILES
  WORKING/chart01/data.pickle
@@ -22,6 +25,7 @@ INPUT AND OUTPUT FILES (build with --data)
  WORKING/chart06/FHL/0data-norwalk.pickle | reduction for just Norwalk (for testing); only if locality == city
  WORKING/chart06/FHL/0data-subset.pickle | random subset of everything (for testing)
  WORKING/chart06/FHL/0all-price-histories.pickle |  
+ WORKING/chart06/FHL/parts/YYYYMM[-CITY].pickle | reduction of one valavm file, reused while the file is unchanged
 OUTPUT FILES
  WORKING/chart06/FHL/0data-report.txt | records retained TODO: Decide whether to keep
  WORKING/chart06/FHL/a.pdf           | range of losses by model (graph)
@@ -42,6 +46,7 @@ The reduction is a dictionary.
   dict[ModelDescription] ModelResults, sorted by increasing ModelResults.mae
 - if LOCALITY is 'city', the type of the reduction is
   dict[city_name] dict[validation_month] sd
+With --keep-predictions K, ModelResults.predictions is None for models not needed by chart h.
 '''
 
 from __future__ import division
@@ -50,7 +55,10 @@ import argparse
 import collections
 import cPickle as pickle
 import glob
+import itertools
+import multiprocessing
 import numpy as np
+import os
 import pandas as pd
 import pdb
 from pprint import pprint
@@ -72,9 +80,10 @@ import errors
 from Logger import Logger
 from Path import Path
 from Report import Report
+import serialize
 from Timer import Timer
 from trace_unless import trace_unless
-from valavmtypes import ResultKeyEn, ResultKeyGbr, ResultKeyRfr, ResultValue
+from valavmtypes import ResultKeyEn, ResultKeyGbr, ResultKeyRfr, ResultReader, ResultValue
 cc = columns_contain
 
 
@@ -90,6 +99,8 @@ def make_control(argv):
     parser.add_argument('--subset', action='store_true')
     parser.add_argument('--norwalk', action='store_true')
     parser.add_argument('--all', action='store_true')
+    parser.add_argument('--jobs', type=arg_type.n_processes, default=1)
+    parser.add_argument('--keep-predictions', type=arg_type.positive_int, default=None)
     parser.add_argument('--trace', action='store_true')
     parser.add_argument('--use-samples-train-analysis-test', action='store_true')
     arg = parser.parse_args(argv)  # arg.__dict__ contains the bindings
@@ -112,6 +123,7 @@ def make_control(argv):
     dir_working = Path().dir_working()
     dir_out_reduction = dirutility.assure_exists(dir_working + arg.base_name) + '/'
     dir_out = dirutility.assure_exists(dir_out_reduction + arg.fhl) + '/'
+    dir_out_parts = dirutility.assure_exists(dir_out + 'parts') + '/'
 
     validation_months = (
             '200612',
@@ -134,6 +146,10 @@ def make_control(argv):
         ks.extend([40, 50, 60, 70, 80, 90, 100, 110, 120, 130, 140, 150, 160, 170, 180, 190, 200])
         return ks
 
+    if arg.keep_predictions is not None:
+        # chart h needs the predictions of the best max(k) experts
+        assert arg.keep_predictions >= max(all_k_values()), arg.keep_predictions
+
     return Bunch(
         all_k_values=all_k_values(),
         arg=arg,
@@ -157,6 +173,7 @@ def make_control(argv):
             'samples-train-analysis%s/transactions.csv' % ('-test' if arg.use_samples_train_analysis_test else '')
             ),
         path_all_price_histories=dir_out + '0all_price_histories.pickle',
+        path_part_template=dir_out_parts + '%s',  # basename of the valavm file
         path_out_a=dir_out + 'a.pdf' if arg.locality == 'global' else dir_out + 'a-%s.pdf',
         path_out_b=dir_out + 'b-%d.txt',
         path_out_cd=dir_out + '%s.txt',
@@ -334,286 +351,395 @@ class ReductionValue(object):
         return pattern % (self.mae, self.model_results, self.feature_group)
 
 
-def make_reduction(control):
-    '''return the reduction dict'''
-
-    def path_city(path):
-        'return city in path to file'
-        last = path.split('/')[-1]
-        date, city = last.split('.')[0].split('-')
-        return city
+def reduce_path(control, path, ids):
+    ''' return (dict, actuals, counter, price_history) for the path where
+    dict has type OrderedDict[ModelDescription] ModelResults, sorted by increasing ModelResults.mae
+    '''
+    def make_model_description(key):
+        is_en = isinstance(key, ResultKeyEn)
+        is_gbr = isinstance(key, ResultKeyGbr)
+        is_rfr = isinstance(key, ResultKeyRfr)
+        is_tree = is_gbr or is_rfr
+        result = ModelDescription(
+            model='en' if is_en else ('gb' if is_gbr else 'rf'),
+            n_months_back=key.n_months_back,
+            units_X=key.units_X if is_en else 'natural',
+            units_y=key.units_y if is_en else 'natural',
+            alpha=key.alpha if is_en else None,
+            l1_ratio=key.l1_ratio if is_en else None,
+            n_estimators=key.n_estimators if is_tree else None,
+            max_features=key.max_features if is_tree else None,
+            max_depth=key.max_depth if is_tree else None,
+            loss=key.loss if is_gbr else None,
+            learning_rate=key.learning_rate if is_gbr else None,
+        )
+        return result
 
-    def process_path(path):
-        ''' return (dict, actuals, counter) for the path where
-        dict has type dict[ModelDescription] ModelResult
-        '''
-        def make_model_description(key):
-            is_en = isinstance(key, ResultKeyEn)
-            is_gbr = isinstance(key, ResultKeyGbr)
-            is_rfr = isinstance(key, ResultKeyRfr)
-            is_tree = is_gbr or is_rfr
-            result = ModelDescription(
-                model='en' if is_en else ('gb' if is_gbr else 'rf'),
-                n_months_back=key.n_months_back,
-                units_X=key.units_X if is_en else 'natural',
-                units_y=key.units_y if is_en else 'natural',
-                alpha=key.alpha if is_en else None,
-                l1_ratio=key.l1_ratio if is_en else None,
-                n_estimators=key.n_estimators if is_tree else None,
-                max_features=key.max_features if is_tree else None,
-                max_depth=key.max_depth if is_tree else None,
-                loss=key.loss if is_gbr else None,
-                learning_rate=key.learning_rate if is_gbr else None,
+    def make_model_results(model_predictions, actuals):
+        'return dict[ModelDescription] ModelResults for dict[ModelDescription] predictions'
+        model_keys = model_predictions.keys()
+        rmse, mae, low, high = errors.errors_batch(
+            actuals,
+            np.vstack([model_predictions[model_key] for model_key in model_keys]),
+            seed=control.random_seed,  # the same confidence intervals however the files are reduced
             )
-            return result
-
-        def make_model_result(value):
-            rmse, mae, low, high = errors.errors(value.actuals, value.predictions)
-            result = ModelResults(
-                rmse=rmse,
-                mae=mae,
-                ci95_low=low,
-                ci95_high=high,
-                predictions=value.predictions,
+        result = {}
+        for i, model_key in enumerate(model_keys):
+            result[model_key] = ModelResults(
+                rmse=rmse[i],
+                mae=mae[i],
+                ci95_low=low[i],
+                ci95_high=high[i],
+                predictions=model_predictions[model_key],
             )
-            return result
-
-        def update_price_history(
-                price_history=None,
-                ids=None,
-                validation_year=None,
-                validation_month=None,
-                valavm_result_value=None,
-                valavm_key=None,
-        ):
-            'return (augmented price history, counter)'
-            def same_apn(df):
-                return (df.apn == df.iloc[0].apn).all()
-
-            def same_actual_price(df):
-                return (df.actual_price == df.iloc[0].actual_price).all()
-
-            def make_data_dict(key, matched):
-                'return dictionary with the columns with want in the price history'
-                # common columns
-                assert isinstance(key, (ResultKeyEn, ResultKeyGbr, ResultKeyRfr)), (key, type(key))
-                # common results (across all methods)
-                result = {
-                    'apn': matched.apn,
-                    'year': matched.year,
-                    'month': matched.month,
-                    'day': matched.day,
-                    'sequence_number': matched.sequence_number,
-                    'date': matched.date,
-                    'price_actual': price_actual,
-                    'price_estimated': price_estimated,
-                    'n_months_back': key.n_months_back,
-                    'method': (
-                        'rfr' if isinstance(key, ResultKeyRfr) else
-                        'gbr' if isinstance(key, ResultKeyGbr) else
-                        'en'
-                        ),
-                }
-
-                # add columns appropriate for the type of result
-                if isinstance(key, (ResultKeyRfr, ResultKeyGbr)):
-                    result.update({
-                        'n_esimators': key.n_estimators,
-                        'max_features': key.max_features,
-                        'max_depth': key.max_depth,
-                    })
-                if isinstance(key, ResultKeyGbr):
-                    result.update({
-                        'loss': key.loss,
-                        'learning_rate': key.learning_rate,
-                        })
-                if isinstance(key, ResultKeyEn):
-                    result.update({
-                        'units_X': key.units_X,
-                        'units_y': key.units_y,
-                        'alpha': key.alpha,
-                        'l1_ratio': key.l1_ratio,
-                        })
-                return result
-
-            debug = False
-            verbose = False
-            if debug:
-                print validation_year, validation_month,
-                print len(ids)
-                print ids[:5]
-                print key
-                print 'len(price_history)', 0 if price_history is None else len(price_history)
-            assert len(valavm_result_value.actuals) == len(valavm_result_value.predictions)
-            counter = collections.Counter()
-            counter_key = 'year, month, price matched %d times'
-            result_price_history = price_history
-            for price_actual, price_estimated in zip(valavm_result_value.actuals, valavm_result_value.predictions):
-                # print price_actual, price_estimated
-                mask1 = ids.year == validation_year
-                mask2 = ids.month == validation_month
-                mask3 = ids.actual_price == price_actual
-                mask = mask1 & mask2 & mask3
-                if debug:
-                    print 'transaction in validation year:     ', sum(mask1)
-                    print 'transactions in validation month:   ', sum(mask2)
-                    print 'transactions with same actual price;', sum(mask3)
-                    print 'transactions that match on all:     ', sum(mask)
-                    print type(key)
-                matched_df = ids[mask]
-                if len(matched_df) == 1:
-                    counter[counter_key % 1] += 1
-                    matched = matched_df.iloc[0]
-                    print 'single match', matched_df.index[0]
-                    data_dict = make_data_dict(key, matched)
-                    df_new = pd.DataFrame(
-                        data=data_dict,
-                        index=[0 if result_price_history is None else len(result_price_history)],
+        return result
+
+    def match_ids(ids, validation_year, validation_month, actuals):
+        '''return (matched, positions, counter) for the actual prices of the validation transactions
+
+        A validation transaction is matched when exactly one transaction in ids has its
+        year, month and actual price. The join is on the actual price of the transactions
+        in ids that are in the validation month.
+        matched: DataFrame with the row in ids for each matched transaction
+        positions: positions in actuals of the matched transactions
+        '''
+        in_month = ids.loc[(ids.year == validation_year) & (ids.month == validation_month)]
+        n_with_price = in_month.actual_price.value_counts()
+        actual_prices = np.asarray(actuals)
+        n_matched = n_with_price.reindex(actual_prices).fillna(0).astype('int64').values
+        counter = collections.Counter('year, month, price matched %d times' % n for n in n_matched)
+        unique_prices = in_month.loc[in_month.actual_price.map(n_with_price) == 1]
+        positions = np.flatnonzero(n_matched == 1)
+        matched = unique_prices.set_index('actual_price').loc[actual_prices[positions]]
+        return matched, positions, counter
+
+    def make_price_history(key, matched, positions, valavm_result_value):
+        'return DataFrame with the price history columns for each matched transaction'
+        assert isinstance(key, (ResultKeyEn, ResultKeyGbr, ResultKeyRfr)), (key, type(key))
+        assert len(valavm_result_value.actuals) == len(valavm_result_value.predictions)
+        # common results (across all methods)
+        data_dict = {
+            'apn': matched.apn.values,
+            'year': matched.year.values,
+            'month': matched.month.values,
+            'day': matched.day.values,
+            'sequence_number': matched.sequence_number.values,
+            'date': matched.date.values,
+            'price_actual': np.asarray(valavm_result_value.actuals)[positions],
+            'price_estimated': np.asarray(valavm_result_value.predictions)[positions],
+            'n_months_back': key.n_months_back,
+            'method': (
+                'rfr' if isinstance(key, ResultKeyRfr) else
+                'gbr' if isinstance(key, ResultKeyGbr) else
+                'en'
+                ),
+        }
+
+        # add columns appropriate for the type of result
+        if isinstance(key, (ResultKeyRfr, ResultKeyGbr)):
+            data_dict.update({
+                'n_esimators': key.n_estimators,
+                'max_features': key.max_features,
+                'max_depth': key.max_depth,
+            })
+        if isinstance(key, ResultKeyGbr):
+            data_dict.update({
+                'loss': key.loss,
+                'learning_rate': key.learning_rate,
+                })
+        if isinstance(key, ResultKeyEn):
+            data_dict.update({
+                'units_X': key.units_X,
+                'units_y': key.units_y,
+                'alpha': key.alpha,
+                'l1_ratio': key.l1_ratio,
+                })
+        result = pd.DataFrame(data=data_dict)
+        if control.debug:
+            print 'DEBUG: keeping just 3 price histories'
+            result = result.iloc[:3]
+        return result
+
+    print 'reducing', path
+    model_predictions = {}  # the errors for all the models are determined after all the records are read
+    counter = collections.Counter()
+    input_record_number = 0
+    actuals = None
+    price_histories = []  # DataFrame for each record, concatenated at the end
+    matched, positions = None, None
+    if len(ids) < 100000:
+        print 'WARNING: TRUNCATED IDS'
+    validation_year_month = int(path.split('/')[-1].split('.')[0])
+    validation_year = int(validation_year_month / 100)
+    validation_month = int(validation_year_month - validation_year * 100)
+    assert validation_year_month == validation_year * 100 + validation_month
+    with open(path, 'rb') as f:
+        reader = ResultReader(f)  # reads both versions of valavm output files
+        while True:  # process each record in path
+            counter['attempted to read'] += 1
+            input_record_number += 1
+            if control.debug and input_record_number > 10:
+                print 'DEBUG: breaking out of record read in path', path
+                break
+            try:
+                # model_predictions[model_key] = predictions, for next model result
+                record = reader.load()
+                counter['actually read'] += 1
+                assert isinstance(record, tuple), type(record)
+                assert len(record) == 2, len(record)
+                key, value = record
+                assert len(value) == 2, len(value)
+                # NOTE: importances is not used
+                valavm_result_value, importances = value
+                # type(valavm_result_value) == namedtuple with fields actuals, predictions
+                # the fields are parallel, corresponding transaction to transaction
+                # verify that actuals is always the same
+                if actuals is not None:
+                    assert np.array_equal(actuals, valavm_result_value.actuals)
+                actuals = valavm_result_value.actuals
+                # verify that each model_key occurs at most once in the validation month
+                model_key = make_model_description(key)
+                if matched is None:
+                    # the actuals are the same in every record, so match them just once
+                    matched, positions, match_counter = match_ids(
+                        ids,
+                        validation_year,
+                        validation_month,
+                        actuals,
                     )
-                    # pdb.set_trace()
-                    result_price_history = (
-                        df_new if result_price_history is None else
-                        result_price_history.append(df_new, verify_integrity=True)
-                        )
-                else:
-                    counter[counter_key % len(matched_df)] += 1
-                    if len(matched_df) > 0:
-                        if verbose:
-                            print 'valavm matched %d training transactions' % len(matched_df)
-                            print matched_df
-                    continue
-                if control.debug and len(result_price_history) > 2:
-                    print 'DEBUG: breaking out of update_price_history'
-                    break
-            print 'identified %d price histories' % len(result_price_history)
-            return result_price_history, counter
+                    print 'path update counters', path
+                    for k, v in match_counter.iteritems():
+                        print k, v
+                price_histories.append(make_price_history(key, matched, positions, valavm_result_value))
+                if model_key in model_predictions:
+                    print '++++++++++++++++++++++'
+                    print path, model_key
+                    print 'duplicate model key'
+                    if control.arg.jobs > 1:
+                        # in a worker process, the debugger would wait for input that never comes
+                        raise RuntimeError('duplicate model key %s in %s' % (model_key, path))
+                    pdb.set_trace()
+                    print '++++++++++++++++++++++'
+                model_predictions[model_key] = valavm_result_value.predictions
+            except ValueError as e:
+                counter['ValueError'] += 1
+                if key is not None:
+                    print key
+                print 'ignoring ValueError in record %d: %s' % (input_record_number, e)
+            except EOFError:
+                counter['EOFError'] += 1
+                print 'found EOFError path in record %d: %s' % (input_record_number, path)
+                print 'continuing'
+                if input_record_number == 1 and False:
+                    # with locality == city, a file can be empty
+                    control.errors.append('eof record 1; path = %s' % path)
+                break
+            except pickle.UnpicklingError as e:
+                counter['UnpicklingError'] += 1
+                print 'cPickle.Unpicklingerror in record %d: %s' % (input_record_number, e)
+
+    price_history = None
+    if len(price_histories) > 0:
+        price_history = pd.concat(price_histories, ignore_index=True)
+        price_history = price_history[sorted(price_history.columns)]
+        print 'identified %d price histories' % len(price_history)
+    model = {}
+    if len(model_predictions) > 0:
+        try:
+            model = make_model_results(model_predictions, actuals)
+        except ValueError as e:
+            counter['ValueError'] += len(model_predictions)
+            print 'ignoring ValueError in the errors for %d models: %s' % (len(model_predictions), e)
+    # type(model) is dict[ModelDescription] ModelResults
+    # sort models by increasing ModelResults.mae
+    sorted_models = collections.OrderedDict(sorted(model.items(), key=lambda t: t[1].mae))
+    check_key_order(sorted_models)
+    return sorted_models, actuals, counter, price_history
+
+
+# (control, ids) for reduce_path_mapper
+# set by _set_reducer_state in this process and, as the Pool initializer, in each worker process
+reducer_state = None
+
+
+def _set_reducer_state(control, ids):
+    global reducer_state
+    reducer_state = (control, ids)
+
+
+def reduce_path_mapper(path):
+    'return (path, result of reduce_path) for the path'
+    control, ids = reducer_state
+    return path, reduce_path(control, path, ids)
+
+
+def file_fingerprint(path):
+    'return (size, mtime) of the file at path'
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+
+def is_current_part(path_part, fingerprint):
+    'return True iff file path_part exists and was made from inputs with the fingerprint; read just the fingerprint'
+    if not os.path.exists(path_part):
+        return False
+    with open(path_part, 'rb') as f:
+        part_fingerprint = pickle.load(f)
+    return part_fingerprint == fingerprint
+
+
+def read_part(path_part):
+    'return the result of reduce_path cached in file path_part'
+    with open(path_part, 'rb') as f:
+        part_fingerprint = pickle.load(f)
+        result = pickle.load(f)
+    return result
+
+
+def write_part(path_part, fingerprint, result):
+    'write the fingerprint of its inputs and then the result of reduce_path to file path_part'
+    path_temp = path_part + '.temp'
+    with open(path_temp, 'wb') as f:
+        serialize.dump(fingerprint, f)
+        serialize.dump(result, f)
+    os.rename(path_temp, path_part)  # a part is never partially written
+
+
+def drop_predictions(sorted_models, keep_keys):
+    'return OrderedDict like sorted_models, with the predictions dropped except for the models in keep_keys'
+    return collections.OrderedDict(
+        (model_key, model_results if model_key in keep_keys else model_results._replace(predictions=None))
+        for model_key, model_results in sorted_models.iteritems()
+        )
+
+
+def with_predictions(sorted_models):
+    'return OrderedDict like sorted_models, with just the models whose predictions were kept'
+    return collections.OrderedDict(
+        (model_key, model_results)
+        for model_key, model_results in sorted_models.iteritems()
+        if model_results.predictions is not None
+        )
+
+
+def path_city(path):
+    'return city in path to valavm file'
+    base_name, suffix = path.split('/')[-1].split('.')
+    validation_month, city_name = base_name.split('-')
+    #  some file systems create all upper case names
+    #  some create mixed-case names
+    #  we map each to upper case
+    return city_name.upper()
+
+
+def make_reduction(control):
+    '''return the reduction dict
+
+    The valavm files are independent, so with control.arg.jobs > 1 they are reduced in
+    worker processes. The results are merged in path order, so the reduction is the same.
 
+    The reduction of each valavm file is cached in a part file, with the size and mtime of the
+    valavm file and the transactions file. Only the files whose fingerprints changed are reduced.
+
+    The parts are merged one at a time. With control.arg.keep_predictions, the predictions of
+    the models not needed by chart h are dropped as each part is merged.
+    '''
+    reduction = collections.defaultdict(dict)
+    all_actuals = collections.defaultdict(dict)
+    paths = sorted(glob.glob(control.path_in_valavm))
+    assert len(paths) > 0, paths
+    if control.test:
+        paths = paths[:1]
+    elif control.debug:
+        print 'DEBUG: reducing just 2 paths'
+        paths = paths[:2]
+
+    # reuse the parts of unchanged files; in debug mode, the parts are not complete, so neither read nor written
+    fingerprint_transactions = file_fingerprint(control.path_in_transactions)
+    fingerprints = {path: (file_fingerprint(path), fingerprint_transactions) for path in paths}
+    path_parts = {path: control.path_part_template % os.path.basename(path) for path in paths}
+    stale_paths = [
+        path
+        for path in paths
+        if control.debug or not is_current_part(path_parts[path], fingerprints[path])
+        ]
+    print 'reusing %d cached parts; reducing %d valavm files' % (len(paths) - len(stale_paths), len(stale_paths))
+    pool = None
+    results = iter([])
+    if len(stale_paths) > 0:
         ids = pd.read_csv(
             control.path_in_transactions,
             index_col=0,
             low_memory=False,
             )
-        print 'reducing', path
-        model = {}
-        counter = collections.Counter()
-        input_record_number = 0
-        actuals = None
-        updated_price_history = None  # mutated in the while True loop below
-        validation_year_month = int(path.split('/')[-1].split('.')[0])
-        validation_year = int(validation_year_month / 100)
-        validation_month = int(validation_year_month - validation_year * 100)
-        assert validation_year_month == validation_year * 100 + validation_month
-        with open(path, 'rb') as f:
-            while True:  # process each record in path
-                counter['attempted to read'] += 1
-                input_record_number += 1
-                if control.debug and input_record_number > 10:
-                    print 'DEBUG: breaking out of record read in path', path
-                    break
-                try:
-                    # model[model_key] = error_analysis, for next model result
-                    record = pickle.load(f)
-                    counter['actually read'] += 1
-                    assert isinstance(record, tuple), type(record)
-                    assert len(record) == 2, len(record)
-                    key, value = record
-                    assert len(value) == 2, len(value)
-                    # NOTE: importances is not used
-                    valavm_result_value, importances = value
-                    # type(valavm_result_value) == namedtuple with fields actuals, predictions
-                    # the fields are parallel, corresponding transaction to transaction
-                    if len(ids) < 100000:
-                        print 'WARNING: TRUNCATED IDS'
-                    # verify that actuals is always the same
-                    if actuals is not None:
-                        assert np.array_equal(actuals, valavm_result_value.actuals)
-                    actuals = valavm_result_value.actuals
-                    # verify that each model_key occurs at most once in the validation month
-                    model_key = make_model_description(key)
-                    updated_price_history, update_counter = update_price_history(
-                        price_history=updated_price_history,
-                        ids=ids,
-                        validation_year=validation_year,
-                        validation_month=validation_month,
-                        valavm_result_value=valavm_result_value,
-                        valavm_key=key,
-                    )
-                    # NOTE: the counters are the same for every path because the actual transactions are the same
-                    if input_record_number == 1:
-                        print 'path update counters', path
-                        for k, v in update_counter.iteritems():
-                            print k, v
-                    if model_key in model:
-                        print '++++++++++++++++++++++'
-                        print path, model_key
-                        print 'duplicate model key'
-                        pdb.set_trace()
-                        print '++++++++++++++++++++++'
-                    model[model_key] = make_model_result(valavm_result_value)
-                except ValueError as e:
-                    counter['ValueError'] += 1
-                    if key is not None:
-                        print key
-                    print 'ignoring ValueError in record %d: %s' % (input_record_number, e)
-                except EOFError:
-                    counter['EOFError'] += 1
-                    print 'found EOFError path in record %d: %s' % (input_record_number, path)
-                    print 'continuing'
-                    if input_record_number == 1 and False:
-                        # with locality == city, a file can be empty
-                        control.errors.append('eof record 1; path = %s' % path)
-                    break
-                except pickle.UnpicklingError as e:
-                    counter['UnpicklingError'] += 1
-                    print 'cPickle.Unpicklingerror in record %d: %s' % (input_record_number, e)
-
-        return model, actuals, counter, updated_price_history
+        _set_reducer_state(control, ids)
+        pool = None if control.arg.jobs == 1 else multiprocessing.Pool(
+            control.arg.jobs,
+            initializer=_set_reducer_state,  # inherited where the pool forks, pickled once per worker elsewhere
+            initargs=(control, ids),
+        )
+        results = (
+            itertools.imap(reduce_path_mapper, stale_paths) if pool is None else
+            pool.imap(reduce_path_mapper, stale_paths)  # results are in the order of the paths
+            )
+
+    def parts():
+        'yield (path, result of reduce_path) in path order, reading the current parts and reducing the others'
+        stale = set(stale_paths)
+        for path in paths:
+            if path in stale:
+                result_path, result = next(results)
+                assert result_path == path, (result_path, path)
+                if not control.debug:
+                    write_part(path_parts[path], fingerprints[path], result)
+            else:
+                result = read_part(path_parts[path])
+            yield path, result
 
-    reduction = collections.defaultdict(dict)
-    all_actuals = collections.defaultdict(dict)
-    paths = sorted(glob.glob(control.path_in_valavm))
-    assert len(paths) > 0, paths
     counters = {}
-    all_price_histories = None
-    for path in paths:
-        model, actuals, counter, price_history = process_path(path)
-        all_price_histories = (
-            price_history if all_price_histories is None else
-            all_price_histories.append(price_history, verify_integrity=True, ignore_index=True)
-            )
-        # type(model) is dict[ModelDescription] ModelResults
-        # sort models by increasing ModelResults.mae
-        sorted_models = collections.OrderedDict(sorted(model.items(), key=lambda t: t[1].mae))
-        check_key_order(sorted_models)
+    price_histories = []
+    previous_best_keys = {}  # location --> keys of the best models in the month before
+    for path, (sorted_models, actuals, counter, price_history) in parts():
+        if price_history is not None:
+            price_histories.append(price_history)
+        if control.arg.keep_predictions is not None:
+            # the paths are in month order within each location, so the previous part is the month before
+            location = None if control.arg.locality == 'global' else path_city(path)
+            best_keys = set(itertools.islice(sorted_models.iterkeys(), control.arg.keep_predictions))
+            sorted_models = drop_predictions(sorted_models, best_keys | previous_best_keys.get(location, set()))
+            previous_best_keys[location] = best_keys
         if control.arg.locality == 'global':
             base_name, suffix = path.split('/')[-1].split('.')
             validation_month = base_name
             reduction[validation_month] = sorted_models
             all_actuals[validation_month] = actuals
         elif control.arg.locality == 'city':
+            city_name_used = path_city(path)
             base_name, suffix = path.split('/')[-1].split('.')
             validation_month, city_name = base_name.split('-')
-            #  some file systems create all upper case names
-            #  some create mixed-case names
-            #  we map each to upper case
-            city_name_used = city_name.upper()
             reduction[city_name_used][validation_month] = sorted_models
             all_actuals[city_name_used][validation_month] = actuals
         else:
             print 'unexpected locality', control.arg.locality
             pdb.set_trace()
         counters[path] = counter
-        if control.debug and len(counters) > 1:
-            print 'DEBUG: stopping iteration over paths'
-            break
-        if control.test:
-            break
+    if pool is not None:
+        pool.close()
+        pool.join()
 
+    all_price_histories = None
+    if len(price_histories) > 0:
+        all_price_histories = pd.concat(price_histories, ignore_index=True)
+        all_price_histories = all_price_histories[sorted(all_price_histories.columns)]
     return reduction, all_actuals, counters, all_price_histories
 
 
 def make_subset_global(reduction, fraction):
-    'return a random sample of the reduction stratified by validation_month as an ordereddict'
+    '''return a random sample of the reduction stratified by validation_month as an ordereddict
+
+    Only models with predictions are sampled, so that the subset is usable when --keep-predictions
+    dropped the predictions of the other models.
+    '''
     # use same keys (models) every validation month
     # generate candidate for common keys in the subset
     subset_common_keys = None
@@ -621,21 +747,21 @@ def make_subset_global(reduction, fraction):
         if len(validation_dict) == 0:
             print 'zero length validation dict', validation_month
             pdb.set_trace()
-        keys = validation_dict.keys()
+        keys = with_predictions(validation_dict).keys()
         n_to_keep = int(len(keys) * fraction)
         subset_common_keys_list = random.sample(keys, n_to_keep)
         subset_common_keys = set(subset_common_keys_list)
         break
 
-    # remove keys from subset_common_keys that are not in each validation_month
+    # remove keys from subset_common_keys that are not in each validation_month or lack predictions there
     print 'n candidate common keys', len(subset_common_keys)
     for validation_month, validation_dict in reduction.iteritems():
         print 'make_subset', validation_month
-        validation_keys = set(validation_dict.keys())
-        for key in subset_common_keys:
+        validation_keys = set(with_predictions(validation_dict).keys())
+        for key in list(subset_common_keys):
             if key not in validation_keys:
                 print 'not in', validation_month, ': ', key
-                subset_common_keys -= set(key)
+                subset_common_keys.discard(key)
     print 'n final common keys', len(subset_common_keys)
 
     # build reduction subset using the actual common keys
@@ -648,21 +774,26 @@ def make_subset_global(reduction, fraction):
         # sort by MAE, low to high
         od = collections.OrderedDict(sorted(d.items(), key=lambda x: x[1].mae))
         results[validation_month] = od
-
-        return results
+    return results
 
 
 def make_subset_city(reduction, path_interesting_cities):
-    'return reduction for just the interesting cities'
+    'return reduction for just the interesting cities, with just the models whose predictions were kept'
+    def city_subset(city):
+        return {
+            validation_month: with_predictions(sorted_models)
+            for validation_month, sorted_models in reduction[city].iteritems()
+            }
+
     result = {}
     if len(reduction) <= 6:
-        return reduction
+        return {city: city_subset(city) for city in reduction}
     with open(path_interesting_cities, 'r') as f:
         lines = f.readlines()
         no_newlines = [line.rstrip('\n') for line in lines]
         for interesting_city in no_newlines:
             if interesting_city in reduction:
-                result[interesting_city] = reduction[interesting_city]
+                result[interesting_city] = city_subset(interesting_city)
             else:
                 print 'not in reduction', interesting_city
                 pdb.set_trace()
@@ -743,7 +874,7 @@ def main(argv):
             pdb.set_trace()
             print 'len(all_price_histories)', len(all_price_histories)
             print 'columns', all_price_histories.columns
-            pickle.dump(all_price_histories, f)
+            serialize.dump(all_price_histories, f)
             lap('write all price histories')
         if len(control.errors) > 0:
             print 'stopping because of errors'
@@ -776,14 +907,14 @@ def main(argv):
         output_norwalk = (norwalk, all_actuals, median_price, control)
         lap('check key order')
         with open(control.path_out_data, 'wb') as f:
-            pickle.dump(output_all, f)
+            serialize.dump(output_all, f)
             lap('write all data')
         with open(control.path_out_data_subset, 'wb') as f:
-            pickle.dump(output_samples, f)
+            serialize.dump(output_samples, f)
             lap('write samples')
         if control.arg.locality == 'city':
             with open(control.path_out_data_norwalk, 'wb') as f:
-                pickle.dump(output_norwalk, f)
+                serialize.dump(output_norwalk, f)
                 lap('write norwalk')
     else:
         with open(control.path_in_data, 'rb') as f:
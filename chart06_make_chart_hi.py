@@ -1,7 +1,7 @@
 from __future__ import division
 
 import collections
-import math
+import itertools
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
@@ -98,6 +98,52 @@ class ChartIReport(object):
 
 
 # return string describing key features of the model
+class Ensembles(object):
+    def __init__(self, reduction, actuals, validation_month, query_month, k_max, eta=1.0, weight_scale=200000.0):
+        '''evaluate the ensembles of the best k experts in the validation month for k = 1 .. k_max
+
+        The experts are the models in reduction[validation_month], which is sorted by increasing
+        mae. The weight of an expert is exp(- eta * mae_validation / weight_scale). The weighted
+        predictions of the experts are stacked and summed cumulatively along the rank, so that
+        row k - 1 is the ensemble of the best k experts.
+
+        Only the leading experts that are also in the query month are used; self.n_experts
+        is the number of them.
+        '''
+        validation = reduction[validation_month]
+        query = reduction[query_month]
+        self.n_models_validation = len(validation)
+        self.expert_keys = []
+        for expert_key in itertools.islice(validation.iterkeys(), k_max):
+            if expert_key not in query:
+                break
+            self.expert_keys.append(expert_key)
+        self.n_experts = len(self.expert_keys)
+        self.first_expert_key_not_in_query = (
+            None if self.n_experts == min(k_max, self.n_models_validation) else
+            validation.keys()[self.n_experts]
+            )
+        if self.n_experts == 0:
+            return
+        maes_validation = np.array([validation[expert_key].mae for expert_key in self.expert_keys])
+        weights = np.exp(- eta * maes_validation / weight_scale)
+        assert np.all(weights < 1), (eta, maes_validation, weight_scale)
+        cum_weights = np.cumsum(weights)[:, np.newaxis]
+
+        def cum_ensemble_predictions(results):
+            'return matrix of the ensemble predictions of the best 1, 2, ..., n_experts experts'
+            predictions = np.vstack([results[expert_key].predictions for expert_key in self.expert_keys])
+            return np.cumsum(weights[:, np.newaxis] * predictions, axis=0) / cum_weights
+
+        def maes(actuals, ensemble_predictions):
+            'return median absolute error of each ensemble'
+            return np.median(np.abs(np.asarray(actuals)[np.newaxis, :] - ensemble_predictions), axis=1)
+
+        self.predictions_query = cum_ensemble_predictions(query)
+        self.maes_query = maes(actuals[query_month], self.predictions_query)
+        self.maes_validation = maes(actuals[validation_month], cum_ensemble_predictions(validation))
+
+
 def short_model_description(model_description):
     # build model decsription
     model = model_description.model
@@ -128,29 +174,25 @@ def short_model_description(model_description):
     return description
 
 
-def make_confidence_intervals(df, regret_column_name, ci):
-    'return ndarrays (ks, lower, upper) of confidence intervals for each value of df.k'
+def make_confidence_intervals(df, regret_column_name, ci, seed=123):
+    'return ndarrays (ks, lower, upper) of confidence intervals for each value of df.k; reproducible for a seed'
     trace = False
     if trace:
         pdb.set_trace()
-    n_resamples = 10000
     lower_percentile = 100 - ci
     upper_percentile = ci
     k_uniques = sorted(set(df.k))
     ks = np.zeros((len(k_uniques),))
     lower = np.zeros((len(k_uniques),))
     upper = np.zeros((len(k_uniques),))
+    # one resample shared by all the k values: uniform draws scaled to the number of values for each k
+    uniforms = np.random.RandomState(seed).random_sample(errors.n_resamples)
     for i, k in enumerate(k_uniques):
         for_k = df[df.k == k]
-        values = np.abs(for_k[regret_column_name])
-        sample = np.random.choice(
-            values,
-            size=n_resamples,
-            replace=True,
-            )
+        values = np.abs(for_k[regret_column_name].values)
+        sample = values[(uniforms * len(values)).astype('int64')]  # draw with replacement
         ks[i] = k
-        lower[i] = np.percentile(sample, lower_percentile)
-        upper[i] = np.percentile(sample, upper_percentile)
+        lower[i], upper[i] = np.percentile(sample, (lower_percentile, upper_percentile))
     if trace:
         print 'lower', lower
         print 'upper', upper
@@ -418,44 +460,19 @@ def make_chart_hi(reduction, actuals, median_prices, control):
                 q_median_error / q_median_value,
                 ))
 
-    def mae(actuals, predictions):
-        'return named tuple'
-        e = errors.errors(actuals, predictions)
-        mae_index = 1
-        return e[mae_index]
-
-    def chart_h(reduction, median_prices, actuals, k, validation_month):
+    def chart_h(reduction, median_prices, actuals, k, validation_month, ensembles):
         'return (Report, oracle_less_best, oracle_less_ensemble)'
 
         def median_price(month_str):
             return median_prices[Month(month_str)]
 
         print 'chart_h', k, validation_month
-        if k == 2 and False:
-            pdb.set_trace()
         h = ChartHReport(k, validation_month, 'exp(-MAE/$100000)', control.column_definitions, control.test)
         query_month = Month(validation_month).increment(1).as_str()
         # write results for each of the k best models in the validation month
-        cum_weight = None
-        eta = 1.0
-        weight_scale = 200000.0  # to get weight < 1
-        for index in xrange(k):
+        for index, expert_key in enumerate(ensembles.expert_keys[:k]):
             # write detail line for this expert
-            try:
-                expert_key = reduction[validation_month].keys()[index]
-            except IndexError as e:
-                h.preformatted_line('IndexError: %s' % str(e))
-                h.preformatted_line('index: %d' % index)
-                h.preformatted_line('giving up on completing the chart')
-                return h, 1, 1
             expert_results_validation_month = reduction[validation_month][expert_key]
-            if expert_key not in reduction[query_month]:
-                h.preformatted_line('expert_key not in query month')
-                h.preformatted_line('expert key: %s' % str(expert_key))
-                h.preformatted_line('query_month: %s' % query_month)
-                h.preformatted_line('index: %d' % index)
-                h.preformatted_line('giving up on completing the chart')
-                return h, 1, 1
             expert_results_query_month = reduction[query_month][expert_key]
             h.detail_line(
                 description='expert ranked %d: %s' % (index + 1, short_model_description(expert_key)),
@@ -464,34 +481,27 @@ def make_chart_hi(reduction, actuals, median_prices, control):
                 mare_validation=expert_results_validation_month.mae / median_price(validation_month),
                 mare_query=expert_results_query_month.mae / median_price(query_month),
                 )
-            # computing running ensemble model prediction
-            weight = math.exp(- eta * expert_results_validation_month.mae / weight_scale)
-            if not (weight < 1):
-                print weight, eta, expert_results_validation_month.mae, weight_scale
-                pdb.set_trace()
-            assert weight < 1, (eta, expert_results_validation_month.mae, weight_scale)
-            incremental_ensemble_predictions_query = weight * expert_results_query_month.predictions
-            incremental_ensemble_predictions_validation = weight * expert_results_validation_month.predictions
-            if cum_weight is None:
-                cum_ensemble_predictions_query = incremental_ensemble_predictions_query
-                cum_ensemble_predictions_validation = incremental_ensemble_predictions_validation
-                cum_weight = weight
-            else:
-                cum_ensemble_predictions_query += incremental_ensemble_predictions_query
-                cum_ensemble_predictions_validation += incremental_ensemble_predictions_validation
-                cum_weight += weight
+        if k > ensembles.n_experts:
+            index = ensembles.n_experts
+            if index >= ensembles.n_models_validation:
+                h.preformatted_line('IndexError: list index out of range')
+                h.preformatted_line('index: %d' % index)
+                h.preformatted_line('giving up on completing the chart')
+                return h, 1, 1
+            h.preformatted_line('expert_key not in query month')
+            h.preformatted_line('expert key: %s' % str(ensembles.first_expert_key_not_in_query))
+            h.preformatted_line('query_month: %s' % query_month)
+            h.preformatted_line('index: %d' % index)
+            h.preformatted_line('giving up on completing the chart')
+            return h, 1, 1
         # write detail line for the ensemble
         # pdb.set_trace()
         h.detail_line(
             description=' ',
             )
-        if k == 10 and validation_month == '200705' and False:
-            print k, validation_month
-            pdb.set_trace()
-        ensemble_predictions_query = cum_ensemble_predictions_query / cum_weight
-        ensemble_predictions_validation = cum_ensemble_predictions_validation / cum_weight
-        ensemble_errors_query_mae = mae(actuals[query_month], ensemble_predictions_query)
-        ensemble_errors_validation_mae = mae(actuals[validation_month], ensemble_predictions_validation)
+        ensemble_predictions_query = ensembles.predictions_query[k - 1]
+        ensemble_errors_query_mae = ensembles.maes_query[k - 1]
+        ensemble_errors_validation_mae = ensembles.maes_validation[k - 1]
         h.detail_line(
             description='ensemble of best %d experts' % k,
             mae_validation=ensemble_errors_validation_mae,
@@ -500,7 +510,7 @@ def make_chart_hi(reduction, actuals, median_prices, control):
             mare_query=ensemble_errors_query_mae / median_price(query_month),
             )
         # write detail line for the oracle's model
-        oracle_key = reduction[query_month].keys()[0]
+        oracle_key = next(reduction[query_month].iterkeys())
         if oracle_key not in reduction[validation_month]:
             h.preformatted_line('validation month %s missing %s' % (validation_month, str(oracle_key)))
             h.preformatted_line('skipping remainder of report')
@@ -515,7 +525,7 @@ def make_chart_hi(reduction, actuals, median_prices, control):
             mare_query=oracle_results_query_month.mae / median_price(query_month),
             )
         # report differences from oracle
-        best_key = reduction[validation_month].keys()[0]
+        best_key = next(reduction[validation_month].iterkeys())
         best_results_query_month = reduction[query_month][best_key]
         mpquery = median_price(query_month)
         oracle_less_best_query_month = oracle_results_query_month.mae - best_results_query_month.mae
@@ -582,22 +592,32 @@ def make_chart_hi(reduction, actuals, median_prices, control):
         # make chart h
         hs = {}
         comparison = {}
-        i_df = None
-        for k in control.all_k_values:
-            for validation_month in control.validation_months:
-                h, oracle_less_best, oracle_less_ensemble = chart_h(reduction, median_prices, actuals, k, validation_month)
+        i_rows = []
+        for validation_month in control.validation_months:
+            # evaluate the ensembles for all the values of k at once
+            ensembles = Ensembles(
+                reduction,
+                actuals,
+                validation_month,
+                Month(validation_month).increment(1).as_str(),
+                max(control.all_k_values),
+                )
+            for k in control.all_k_values:
+                h, oracle_less_best, oracle_less_ensemble = chart_h(
+                    reduction, median_prices, actuals, k, validation_month, ensembles,
+                    )
                 hs[(k, validation_month)] = h
                 comparison[(k, validation_month)] = (oracle_less_best, oracle_less_ensemble)
-                new_i_df = pd.DataFrame(
-                    data={
-                        'k': k,
-                        'validation_month': validation_month,
-                        'oracle_less_best': oracle_less_best,
-                        'oracle_less_ensemble': oracle_less_ensemble,
-                    },
-                    index=['%03d-%s' % (k, validation_month)],
-                )
-                i_df = new_i_df if i_df is None else i_df.append(new_i_df, verify_integrity=True)
+                i_rows.append({
+                    'k': k,
+                    'validation_month': validation_month,
+                    'oracle_less_best': oracle_less_best,
+                    'oracle_less_ensemble': oracle_less_ensemble,
+                })
+        i_df = pd.DataFrame(
+            data=i_rows,
+            index=['%03d-%s' % (row['k'], row['validation_month']) for row in i_rows],
+            ).sort_index()  # ordered by k and then by validation month
         # report I is in inverted order relative to chart h grouped_by
         # make graphical report to help select the best value of k
         if control.arg.locality == 'global':
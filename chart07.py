@@ -42,8 +42,9 @@ import errors
 from Features import Features
 from Path import Path
 from Report import Report
+import serialize
 from Timer import Timer
-from valavmtypes import ResultKeyEn, ResultKeyGbr, ResultKeyRfr, ResultValue
+from valavmtypes import ResultKeyEn, ResultKeyGbr, ResultKeyRfr, ResultReader, ResultValue
 import matplotlib.pyplot as plt
 
 # use valavm imports so as to avoid an error message from pyflakes
@@ -347,6 +348,7 @@ def make_data(control):
         assert control.k == 1
         with open(path, 'rb') as f:
             # read each fitted model and keep the k best
+            reader = ResultReader(f)  # reads both versions of valavm output files
             lowest_mae = None
             best_key = None
             best_importances = None
@@ -356,7 +358,7 @@ def make_data(control):
                 counter['attempted to read'] += 1
                 input_record_number += 1
                 try:
-                    record = pickle.load(f)
+                    record = reader.load()
                     key, value = record
                     actuals_predictions, importances = value
                     actuals = actuals_predictions.actuals
@@ -400,7 +402,7 @@ def main(argv):
         data = make_data(control)
         control.timer.lap('make data reduction')
         with open(control.path_out_data, 'wb') as f:
-            pickle.dump((data, control), f)
+            serialize.dump((data, control), f)
             control.timer.lap('write reduction')
     else:
         with open(control.path_in_data, 'rb') as f:
@@ -30,6 +30,7 @@ from ColumnsTable import ColumnsTable
 from Features import Features
 from Path import Path
 from Report import Report
+import serialize
 from Timer import Timer
 from valavmtypes import ResultKeyEn, ResultKeyGbr, ResultKeyRfr
 
@@ -277,7 +278,7 @@ def main(argv):
         data = make_data(control)
         control.timer.lap('make data reduction')
         with open(control.path_out_data, 'wb') as f:
-            pickle.dump((data, control), f)
+            serialize.dump((data, control), f)
             control.timer.lap('write reduction')
     else:
         with open(control.path_in_data, 'rb') as f:
@@ -0,0 +1,233 @@
+'''typed columnar store for DataFrames: .npy files of columns plus a schema manifest
+
+The store for WORKING/x.csv is the directory WORKING/x/. The numeric, boolean and datetime
+columns of each dtype are the rows of one 2D .npy file, laid out as pandas lays out a
+consolidated block. They are memory mapped copy-on-write when read, so that processes
+reading the same store share the pages of the columns they read, and row slices of the
+DataFrame stay views of the mapped files. Other columns are held as int32 codes into a
+list of strings kept in the manifest, and are decoded into the memory of each reader.
+
+read() falls back to the csv file when there is no store, so callers can use it
+whichever outputs exist.
+'''
+
+import collections
+from distutils.version import LooseVersion
+import json
+import numpy as np
+import os
+import pandas as pd
+import pdb
+import shutil
+import tempfile
+import unittest
+
+import dirutility
+
+
+manifest_file_name = '0schema.json'
+mapped_kinds = 'biufcmM'  # dtype kinds stored as themselves (bool, numbers, datetimes)
+
+# the public DataFrame constructors consolidate the columns of a dtype into a new array,
+# which copies the mapped files; so for the pandas versions whose internal BlockManager
+# has been checked, the DataFrame is made from blocks that are the mapped arrays
+shares_pages = LooseVersion('0.20') <= LooseVersion(pd.__version__) < LooseVersion('0.25')
+if shares_pages:
+    from pandas.core.internals import BlockManager, make_block
+
+
+def dir_path_for(path_csv):
+    'return path to the store directory that parallels the csv file'
+    root, extension = os.path.splitext(path_csv)
+    assert extension == '.csv', path_csv
+    return os.path.join(root, '')
+
+
+def exists(path_csv):
+    'return True iff the store for the csv file has been completely written'
+    return os.path.isfile(os.path.join(dir_path_for(path_csv), manifest_file_name))
+
+
+def write(df, path_csv):
+    'write the columns of df into the store that parallels the csv file; the index is not written'
+    dir_path = dirutility.assure_exists(dir_path_for(path_csv))
+    manifest_path = os.path.join(dir_path, manifest_file_name)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)  # the store is incomplete until the new manifest is written
+
+    columns = []
+    block_columns = collections.OrderedDict()  # file name --> list of the values of its rows
+    for i, column_name in enumerate(df.columns):
+        series = df[column_name]
+        if series.dtype.kind in mapped_kinds:
+            values = series.values
+            categories = None
+            file_name = 'block-%s.npy' % values.dtype.str.strip('<>|=').replace('[', '-').rstrip(']')
+        else:
+            as_str = series.astype(str).where(series.notnull())  # missing values stay missing
+            codes, uniques = pd.factorize(as_str)  # missing values have code -1
+            values = codes.astype('int32')
+            categories = list(uniques)
+            file_name = 'column-%04d.npy' % i
+        block_columns.setdefault(file_name, []).append(values)
+        columns.append({
+            'name': column_name,
+            'file': file_name,
+            'row': len(block_columns[file_name]) - 1,
+            'dtype': values.dtype.str,
+            'categories': categories,
+        })
+    for file_name, values in block_columns.iteritems():
+        np.save(os.path.join(dir_path, file_name), np.vstack(values))
+
+    schema = {'n_rows': len(df), 'columns': columns}
+    temp_path = manifest_path + '.temp'
+    with open(temp_path, 'w') as f:
+        json.dump(schema, f)
+    os.rename(temp_path, manifest_path)
+
+
+def read_schema(path_csv):
+    'return dict with keys n_rows and columns'
+    def as_str(x):
+        return x if x is None else x.encode('utf-8')
+
+    with open(os.path.join(dir_path_for(path_csv), manifest_file_name), 'r') as f:
+        schema = json.load(f)
+    for column in schema['columns']:
+        column['name'] = as_str(column['name'])
+        if column['categories'] is not None:
+            column['categories'] = [as_str(category) for category in column['categories']]
+    return schema
+
+
+def read_store(path_csv, usecols=None, nrows=None):
+    'return DataFrame with columns usecols (default: all) and the first nrows rows (default: all)'
+    dir_path = dir_path_for(path_csv)
+    schema = read_schema(path_csv)
+    n_rows = schema['n_rows'] if nrows is None else min(nrows, schema['n_rows'])
+    by_name = {column['name']: column for column in schema['columns']}
+    names = (
+        [column['name'] for column in schema['columns']] if usecols is None else
+        [column['name'] for column in schema['columns'] if column['name'] in set(usecols)]
+    )
+    if usecols is not None:
+        missing = set(usecols) - set(names)
+        if len(missing) > 0:
+            raise ValueError('columns not in store %s: %s' % (dir_path, sorted(missing)))
+
+    # one block for the columns of each mapped file and one block for the decoded columns,
+    # as in a consolidated DataFrame, so that pandas has no reason to copy the blocks
+    placements = collections.OrderedDict()  # file name --> positions in names of its columns
+    for placement, name in enumerate(names):
+        column = by_name[name]
+        placements.setdefault(None if column['categories'] is not None else column['file'], []).append(placement)
+    blocks = []  # (values, placement)
+    for file_name, placement in placements.iteritems():
+        if file_name is None:
+            decoded = np.empty((len(placement), n_rows), dtype=object)
+            for i, position in enumerate(placement):
+                column = by_name[names[position]]
+                codes = np.load(os.path.join(dir_path, column['file']), mmap_mode='c')[0, :n_rows]
+                lookup = np.array(column['categories'] + [np.nan], dtype=object)  # code -1 --> nan
+                decoded[i] = lookup[codes]
+            blocks.append((decoded, placement))
+            continue
+        mapped = np.load(os.path.join(dir_path, file_name), mmap_mode='c')
+        rows = [by_name[names[position]]['row'] for position in placement]
+        if rows == range(rows[0], rows[-1] + 1):
+            values = mapped[rows[0]:rows[-1] + 1, :n_rows]  # a view of the mapped file
+        else:
+            values = mapped[rows, :n_rows]  # some of the columns of the file: a copy of just those
+        blocks.append((values, placement))
+
+    if shares_pages:
+        manager = BlockManager(
+            [make_block(values, placement=placement) for values, placement in blocks],
+            [pd.Index(names), pd.RangeIndex(n_rows)],
+        )
+        return pd.DataFrame(manager)
+    return pd.concat(
+        [
+            pd.DataFrame(values.T, columns=[names[position] for position in placement], copy=False)
+            for values, placement in blocks
+        ],
+        axis=1,
+    )[names]
+
+
+def read(path_csv, usecols=None, nrows=None):
+    'return DataFrame from the store for the csv file if it exists, otherwise from the csv file'
+    if exists(path_csv):
+        return read_store(path_csv, usecols=usecols, nrows=nrows)
+    return pd.read_csv(
+        path_csv,
+        usecols=usecols,
+        nrows=nrows,
+        low_memory=False,
+    )
+
+
+class TestColumnStore(unittest.TestCase):
+    def setUp(self):
+        self.dir_temp = tempfile.mkdtemp()
+        self.path_csv = os.path.join(self.dir_temp, 'samples.csv')
+        self.df = pd.DataFrame({
+            'price': [100.0, 200.0, 300.0],
+            'apn': [10L, 11L, 12L],
+            'city': ['MALIBU', np.nan, 'VENICE'],
+            'has_pool': [True, False, True],
+        }, columns=['price', 'apn', 'city', 'has_pool'])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir_temp)
+
+    def test_round_trip(self):
+        write(self.df, self.path_csv)
+        self.assertTrue(exists(self.path_csv))
+        df = read(self.path_csv)
+        self.assertEqual(list(self.df.columns), list(df.columns))
+        self.assertEqual(list(self.df.dtypes), list(df.dtypes))
+        self.assertEqual([100.0, 200.0, 300.0], list(df['price']))
+        self.assertEqual([10, 11, 12], list(df['apn']))
+        self.assertEqual('MALIBU', df['city'][0])
+        self.assertTrue(pd.isnull(df['city'][1]))
+        self.assertEqual([True, False, True], list(df['has_pool']))
+
+    def test_usecols_nrows(self):
+        write(self.df, self.path_csv)
+        df = read(self.path_csv, usecols=['city', 'price'], nrows=2)
+        self.assertEqual(['price', 'city'], list(df.columns))
+        self.assertEqual(2, len(df))
+        self.assertRaises(ValueError, read, self.path_csv, ['price', 'unknown'])
+
+    def test_columns_are_mapped(self):
+        def is_mapped(series):
+            values = series.values
+            while values is not None and not isinstance(values, np.memmap):
+                values = values.base
+            return values is not None
+
+        self.df['size'] = [1000.0, 2000.0, 3000.0]  # a second float64 column, in the same block file
+        write(self.df, self.path_csv)
+        df = read(self.path_csv)
+        if not shares_pages:
+            return
+        for column_name in ('price', 'apn', 'has_pool', 'size'):
+            self.assertTrue(is_mapped(df[column_name]), column_name)
+            self.assertTrue(is_mapped(df.iloc[1:3][column_name]), column_name)  # a row slice is a view
+        self.assertEqual([2000.0, 3000.0], list(df.iloc[1:3]['size']))
+        df.loc[df['price'] > 150.0, 'price'] = 0.0  # copy on write: the store is unchanged
+        self.assertEqual([100.0, 200.0, 300.0], list(read(self.path_csv)['price']))
+
+    def test_fallback_to_csv(self):
+        self.df.to_csv(self.path_csv, index=False)
+        self.assertFalse(exists(self.path_csv))
+        df = read(self.path_csv, usecols=['price'])
+        self.assertEqual([100.0, 200.0, 300.0], list(df['price']))
+
+
+if __name__ == '__main__':
+    unittest.main()
+    if False:
+        pdb
@@ -9,7 +9,6 @@ OUTPUT FILE: one of
 
 from __future__ import division
 
-import cPickle as pickle
 import numpy as np
 import pandas as pd
 import pdb
@@ -28,6 +27,7 @@ from Logger import Logger
 from ParseCommandLine import ParseCommandLine
 from Path import Path
 # from TimeSeriesCV import TimeSeriesCV
+import serialize
 cc = columns_contain
 
 
@@ -283,7 +283,7 @@ def do_rfbound(control, samples):
     gscv = best_hps(int(control.arg.yyyymm))
     print_gscv(gscv, tag=control.arg.rfbound, only_best=True)
     with open(control.path_out, 'wb') as f:
-        pickle.dump(gscv, f)
+        serialize.dump(gscv, f)
     return gscv
 
 
@@ -304,7 +304,7 @@ def main(argv):
     result = runner(control, samples)
 
     with open(control.path_out, 'wb') as f:
-        pickle.dump((result, control), f)
+        serialize.dump((result, control), f)
 
     print control
     if control.test:
@@ -27,6 +27,7 @@ from DataframeAppender import DataframeAppender
 from directory import directory
 from Logger import Logger
 import parse_command_line
+import serialize
 
 
 def usage(msg=None):
@@ -480,7 +481,7 @@ def main(argv):
             if not os.path.exists(directory):
                 os.makedirs(directory)
             f = open(directory + file_name(k), 'wb')
-            pickle.dump((k, v), f)
+            serialize.dump((k, v), f)
             f.close()
 
     write('cv/', results_cv)
@@ -0,0 +1,193 @@
+'''fit ElasticNet models for many alphas with one warm-started path solve
+
+The models are sklearn ElasticNet instances with coef_ and intercept_ set, so that
+callers can use them exactly as they use models fitted one at a time.
+'''
+import numpy as np
+import pdb
+import sklearn
+import sklearn.linear_model
+try:
+    from sklearn.linear_model import _cd_fast as cd_fast  # scikit-learn 0.22 and later
+except ImportError:
+    from sklearn.linear_model import cd_fast
+import unittest
+
+import GramStore
+
+
+def fit_path(X, y, alphas, l1_ratio,
+             normalize=False,
+             selection='cyclic',
+             random_state=None,
+             max_iter=1000,
+             tol=0.0001,
+             ):
+    '''return list of fitted ElasticNet models, parallel to alphas
+
+    Coordinate descent runs once from the largest alpha to the smallest, starting
+    each alpha from the coefficients of the previous one. The intercept is fitted
+    by centering X and y, as ElasticNet(fit_intercept=True) does.
+    '''
+    assert len(alphas) > 0
+    for alpha in alphas:
+        assert alpha > 0.0, alpha  # otherwise, not reliable
+
+    X_offset = np.average(X, axis=0)
+    y_offset = np.average(y)
+    X_centered = X - X_offset
+    y_centered = y - y_offset
+    if normalize:
+        X_scale = np.sqrt(np.sum(X_centered * X_centered, axis=0))
+        X_scale[X_scale == 0.0] = 1.0
+        X_centered /= X_scale
+    else:
+        X_scale = np.ones(X.shape[1], dtype='float64')
+
+    path_alphas, coefs, dual_gaps, n_iters = sklearn.linear_model.enet_path(
+        X_centered,
+        y_centered,
+        l1_ratio=l1_ratio,
+        alphas=alphas,
+        precompute=False,
+        copy_X=False,
+        return_n_iter=True,
+        max_iter=max_iter,
+        tol=tol,
+        selection=selection,
+        random_state=random_state,
+    )
+    # enet_path solves the alphas in decreasing order
+    path_index = {path_alpha: i for i, path_alpha in enumerate(path_alphas)}
+
+    result = []
+    for alpha in alphas:
+        i = path_index[alpha]
+        coef = coefs[:, i] / X_scale
+        model = sklearn.linear_model.ElasticNet(
+            alpha=alpha,
+            l1_ratio=l1_ratio,
+            fit_intercept=True,
+            normalize=normalize,
+            max_iter=max_iter,
+            tol=tol,
+            selection=selection,
+            random_state=random_state,
+        )
+        model.coef_ = coef
+        model.intercept_ = y_offset - np.dot(X_offset, coef)
+        model.dual_gap_ = dual_gaps[i]
+        model.n_iter_ = n_iters[i]
+        result.append(model)
+    return result
+
+
+def fit_path_gram(gram, alphas, l1_ratio,
+                  max_iter=1000,
+                  tol=0.0001,
+                  ):
+    '''return list of fitted ElasticNet models, parallel to alphas, from a GramStore.Gram
+
+    Call sklearn's coordinate descent for a precomputed Gram matrix, the solver that
+    ElasticNet(precompute=True) uses, from the largest alpha to the smallest, starting
+    each alpha from the coefficients of the previous one. The work depends on the number
+    of features, not on the number of samples.
+    '''
+    assert len(alphas) > 0
+    for alpha in alphas:
+        assert alpha > 0.0, alpha  # otherwise, not reliable
+
+    X_mean, y_mean, Q, q, y_norm2 = GramStore.centered(gram)
+    n_samples = gram.n_samples
+    Q = np.ascontiguousarray(Q, dtype='float64')
+    q = np.ascontiguousarray(q, dtype='float64')
+    y_like = np.array([np.sqrt(max(y_norm2, 0.0))])  # the solver uses y only for its squared norm
+    rng = np.random.RandomState(0)  # used only by selection='random'
+    w = np.zeros(len(q), dtype='float64')
+
+    solutions = {}
+    for alpha in sorted(set(alphas), reverse=True):
+        w, gap, _, n_iter = cd_fast.enet_coordinate_descent_gram(
+            w,
+            alpha * l1_ratio * n_samples,
+            alpha * (1.0 - l1_ratio) * n_samples,
+            Q,
+            q,
+            y_like,
+            max_iter,
+            tol,
+            rng,
+            False,  # cyclic selection
+            False,  # coefficients may be negative
+        )
+        w = np.asarray(w)
+        solutions[alpha] = (w.copy(), gap, n_iter)
+
+    result = []
+    for alpha in alphas:
+        coef, gap, n_iter = solutions[alpha]
+        model = sklearn.linear_model.ElasticNet(
+            alpha=alpha,
+            l1_ratio=l1_ratio,
+            fit_intercept=True,
+            normalize=False,
+            max_iter=max_iter,
+            tol=tol,
+            precompute=True,
+        )
+        model.coef_ = coef
+        model.intercept_ = y_mean - np.dot(X_mean, coef)
+        model.dual_gap_ = gap
+        model.n_iter_ = n_iter
+        result.append(model)
+    return result
+
+
+class TestFitPath(unittest.TestCase):
+    def test_same_as_separate_fits(self):
+        random_state = np.random.RandomState(123)
+        X = random_state.rand(200, 5)
+        y = np.dot(X, [1.0, 2.0, 0.0, -1.0, 0.5]) + 3.0 + 0.1 * random_state.rand(200)
+        alphas = (0.01, 0.03, 0.1, 0.3, 1.0)
+        for normalize in (False, True):
+            for l1_ratio in (0.0, 0.5, 1.0):
+                path_models = fit_path(X, y, alphas, l1_ratio, normalize=normalize, tol=1e-10)
+                self.assertEqual(len(alphas), len(path_models))
+                for alpha, path_model in zip(alphas, path_models):
+                    model = sklearn.linear_model.ElasticNet(
+                        alpha=alpha,
+                        l1_ratio=l1_ratio,
+                        normalize=normalize,
+                        tol=1e-10,
+                    ).fit(X, y)
+                    self.assertEqual(alpha, path_model.alpha)
+                    self.assertTrue(np.allclose(model.coef_, path_model.coef_, atol=1e-6))
+                    self.assertAlmostEqual(model.intercept_, path_model.intercept_, places=6)
+                    self.assertTrue(np.allclose(model.predict(X), path_model.predict(X), atol=1e-6))
+
+
+class TestFitPathGram(unittest.TestCase):
+    def test_same_as_separate_fits(self):
+        random_state = np.random.RandomState(123)
+        X = 1000.0 * random_state.rand(200, 5)
+        y = np.dot(X, [1.0, 2.0, 0.0, -1.0, 0.5]) + 3.0 + 10.0 * random_state.rand(200)
+        gram = GramStore.make_gram(X, y, np.mean(X, axis=0), np.mean(y))
+        alphas = (0.01, 0.03, 0.1, 0.3, 1.0)
+        for l1_ratio in (0.0, 0.5, 1.0):
+            path_models = fit_path_gram(gram, alphas, l1_ratio, tol=1e-10)
+            self.assertEqual(len(alphas), len(path_models))
+            for alpha, path_model in zip(alphas, path_models):
+                model = sklearn.linear_model.ElasticNet(
+                    alpha=alpha,
+                    l1_ratio=l1_ratio,
+                    tol=1e-10,
+                ).fit(X, y)
+                self.assertEqual(alpha, path_model.alpha)
+                self.assertTrue(np.allclose(model.coef_, path_model.coef_, rtol=1e-6, atol=1e-6))
+                self.assertTrue(np.allclose(model.predict(X), path_model.predict(X), rtol=1e-6))
+
+
+if __name__ == '__main__':
+    unittest.main()
+    if False:
+        pdb
@@ -1,19 +1,86 @@
+'''error metrics for predictions of actual prices
+
+errors_batch computes the metrics for many models that predict the same transactions.
+The bootstrap for the confidence intervals draws one resample of the transactions that is
+shared by all the models, and selects the interval bounds with np.partition, not a full sort.
+'''
+
 import numpy as np
+import pdb
+import unittest
 
 
-def errors(actuals, predictions):
-    'return root_mean_squared_error, median_absolute_error, ci95_low, ci95_high'
-    def make_ci95(v):
-        'return tuple with 95 percent confidence interval for the value in np.array v'
-        n_samples = 10000
-        samples = np.random.choice(v, size=n_samples, replace=True)  # draw with replacement
-        sorted_samples = np.sort(samples)
-        ci = (sorted_samples[int(n_samples * 0.025) - 1], sorted_samples[int(n_samples * 0.975) - 1])
-        return ci
+n_resamples = 10000
+max_rows_per_batch = 100  # bounds the resample matrix to max_rows_per_batch * n_resamples values
+
+
+def errors_batch(actuals, predictions, seed=None):
+    '''return arrays root_mean_squared_error, median_absolute_error, ci95_low, ci95_high
 
+    actuals: vector of actual prices of the transactions
+    predictions: matrix with one row for each model and one column for each transaction
+    seed: None or int; when an int, the confidence intervals are reproducible
+    '''
+    actuals = np.asarray(actuals, dtype='float64')
+    predictions = np.atleast_2d(np.asarray(predictions, dtype='float64'))
+    n_models, n_transactions = predictions.shape
+    assert n_transactions == len(actuals), (n_transactions, len(actuals))
     errors = actuals - predictions
-    mse = np.sum(errors * errors) / len(errors)
-    root_mean_squared_error = np.sqrt(mse)
-    median_absolute_error = np.median(np.abs(errors))
-    ci95_low, ci95_high = make_ci95(errors)
+    root_mean_squared_error = np.sqrt(np.sum(errors * errors, axis=1) / n_transactions)
+    median_absolute_error = np.median(np.abs(errors), axis=1)
+
+    # 95 percent confidence interval for the errors of each model
+    randint = np.random.randint if seed is None else np.random.RandomState(seed).randint
+    rows = randint(0, n_transactions, size=n_resamples)  # draw with replacement
+    low_index = int(n_resamples * 0.025) - 1
+    high_index = int(n_resamples * 0.975) - 1
+    ci95_low = np.empty(n_models)
+    ci95_high = np.empty(n_models)
+    for first in xrange(0, n_models, max_rows_per_batch):
+        last = min(first + max_rows_per_batch, n_models)
+        samples = np.partition(errors[first:last, rows], (low_index, high_index), axis=1)
+        ci95_low[first:last] = samples[:, low_index]
+        ci95_high[first:last] = samples[:, high_index]
     return root_mean_squared_error, median_absolute_error, ci95_low, ci95_high
+
+
+def errors(actuals, predictions, seed=None):
+    'return root_mean_squared_error, median_absolute_error, ci95_low, ci95_high'
+    return tuple(metric[0] for metric in errors_batch(actuals, predictions, seed))
+
+
+class TestErrors(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.actuals = rng.uniform(100000, 900000, 500)
+        self.predictions = self.actuals * rng.uniform(0.7, 1.3, (250, 500))
+
+    def test_same_as_each_model(self):
+        rmse, mae, low, high = errors_batch(self.actuals, self.predictions, seed=123)
+        for i in (0, 99, 100, 249):
+            e = self.actuals - self.predictions[i]
+            self.assertAlmostEqual(np.sqrt(np.mean(e * e)), rmse[i])
+            self.assertAlmostEqual(np.median(np.abs(e)), mae[i])
+            self.assertEqual((low[i], high[i]), errors(self.actuals, self.predictions[i], seed=123)[2:])
+
+    def test_same_as_sorting(self):
+        rmse, mae, low, high = errors_batch(self.actuals, self.predictions, seed=123)
+        rows = np.random.RandomState(123).randint(0, len(self.actuals), size=n_resamples)
+        sorted_samples = np.sort((self.actuals - self.predictions[7])[rows])
+        self.assertEqual(sorted_samples[249], low[7])
+        self.assertEqual(sorted_samples[9749], high[7])
+
+    def test_reproducible(self):
+        self.assertEqual(
+            errors(self.actuals, self.predictions[0], seed=5),
+            errors(self.actuals, self.predictions[0], seed=5),
+            )
+
+    def test_no_transactions(self):
+        self.assertRaises(ValueError, errors, np.array([]), np.array([]))
+
+
+if __name__ == '__main__':
+    unittest.main()
+    if False:
+        pdb
@@ -12,7 +12,6 @@ OUTPUT FILES
 '''
 
 import collections
-import cPickle as pickle
 import pandas as pd
 import pdb
 import random
@@ -24,6 +23,7 @@ import Logger
 import ParseCommandLine
 import Path
 from Report import Report
+import serialize
 
 
 def usage(msg=None):
@@ -149,7 +149,7 @@ def main(argv):
     r = make_report(d_mutual_info, d_pearson)
 
     f = open(control.path_out_report, 'wb')
-    pickle.dump((d_mutual_info, d_pearson, r, control), f)
+    serialize.dump((d_mutual_info, d_pearson, r, control), f)
     f.close()
 
     if control.test:
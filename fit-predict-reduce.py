@@ -1,4 +1,4 @@
-'''reduce all the fit-predict output into a single large CSV file with all predictions
+'''reduce all the fit-predict output into a single indexed store with all predictions
 
 INVOCATION
   python fit-predict-reduce.py training_data neighborhood model n_processes [--test] [--trace] [--cache] [--testmapper]
@@ -19,18 +19,24 @@ INPUTS
  WORKING/fit-predict/{training_data}-{neighborhood}-{model}-{prediction_month}/actuals.pickle
 
 OUTPUTS
- WORKING/fit-predict-reduce/reduction.csv with columns
-   transaction_id apn sale_date
-   training_data in {all, train}
-   query_in_testing_set query_in_training_set
-   model hps_str hps_1 ... (all hyperparameters)
-   model_neighborhood
-   price_actual price_predicted
-   model_coef model_intercept model_importances
+ WORKING/fit-predict-reduce/{training_data}-{neighborhood}-{model}/predictions.pickle
+   a RecordLog with one record for each fit-predict directory
+   key: the directory name
+   value: dict of columns
+     apn, sale_date: int64 arrays for the query transactions, sale_date as yyyymmdd
+     hps_str: list of the hyperparameter strings
+     transaction_index, hps_id, prediction: parallel arrays, one element for each prediction
+       transaction_index is a position in apn and sale_date; hps_id is a position in hps_str
+   directories already in the store are not mapped again
+ WORKING/fit-predict-reduce/{training_data}-{neighborhood}-{model}/{dirname}-fitted-attributes.pickle
+ WORKING/fit-predict-reduce/{training_data}-{neighborhood}-{model}/{dirname}-chunk.pickle
+   the mapper's output for a directory; removed once it is in predictions.pickle
 
 OPERATIONAL NOTES:
 - Running train global en on 16 processes uses about 25 GB RAM on Windows 10
 - Running train global rf on 16 processes uses about 28 GB RAM on Windows 10
+  (measured when each mapper built a DataFrame row by row; now each mapper holds
+  one directory's predictions as columns)
 '''
 
 from __future__ import division
@@ -38,10 +44,9 @@ from __future__ import division
 import argparse
 import collections
 import cPickle as pickle
-import gc
 import multiprocessing
+import numpy as np
 import os
-import pandas as pd
 import pdb
 from pprint import pprint
 import random
@@ -51,14 +56,16 @@ import time
 import arg_type
 from Bunch import Bunch
 from Cache import Cache
+import column_store
 import dirutility
-import HPs
 import layout_transactions
 from Logger import Logger
 from lower_priority import lower_priority
 from Path import Path
+from RecordLog import RecordLog
+import serialize
 from Timer import Timer
-from TransactionId import TransactionId
+import transaction_key
 
 
 def make_control(argv):
@@ -101,6 +108,7 @@ def make_control(argv):
         path_out_dir=dir_out,
         # path_out_fitted_attributes=os.path.join(dir_out, 'fitted-attributes.pickle'),
         path_out_log=os.path.join(dir_out, '0log.txt'),
+        path_out_predictions=os.path.join(dir_out, 'predictions.pickle'),
         random_seed=random_seed,
         timer=Timer(),
     )
@@ -108,11 +116,11 @@ def make_control(argv):
 
 MapperArg = collections.namedtuple(
     'MapperArg',
-    'in_dir dirname out_path_actuals_predictions out_path_fitted_attributes fitted_dirname, test',
+    'in_dir dirname out_path_chunk out_path_fitted_attributes fitted_dirname, test',
     )
 MapperResult = collections.namedtuple(
     'MapperResult',
-    'mapper_arg ok n_rows_written',
+    'mapper_arg ok n_rows_written error',
     )
 ActualPrediction = collections.namedtuple(
     'ActualPrediction',
@@ -121,10 +129,10 @@ ActualPrediction = collections.namedtuple(
 
 
 def mapper(mapper_arg):
-    'return (mapper_arg, n_rows) and write a CSV file to mapper_arg.out_path'
+    'return MapperResult and write the predictions as a chunk of columns to mapper_arg.out_path_chunk'
     def load_pickled(dir, filename_base):
         path = os.path.join(dir, filename_base + '.pickle')
-        with open(path, 'r') as f:
+        with open(path, 'rb') as f:
             result = pickle.load(f)
         return result
 
@@ -141,37 +149,6 @@ def mapper(mapper_arg):
         pdb.set_trace()
         return False
 
-    def make_rows(dirname, hps_str, predictions, transaction_ids):
-        'for now, return pd.DataFrame containing the predictions; later return several DataFrames'
-        def in_prediction_month(sale_date, prediction_month):
-            factor_year = 10000.0
-            factor_month = 100.0
-            sale_date_year = int(sale_date / factor_year)
-            sale_date_month = int((sale_date - sale_date_year * factor_year) / factor_month)
-            return sale_date_year == prediction_month.year and sale_date_month == prediction_month.month
-
-        assert len(actuals) == len(predictions)
-        assert len(actuals) == len(transaction_ids)
-        print 'making %d rows dirname %s hps %s' % (len(actuals), dirname, hps_str)
-        training_data, neighborhood, model, prediction_month_str = dirname.split('-')
-        hps = HPs.from_str(hps_str)
-        if False:
-            hps  # use variable
-        apns = [transaction_id.apn for transaction_id in transaction_ids]
-        sale_dates = [transaction_id.sale_date for transaction_id in transaction_ids]
-        result2 = pd.DataFrame(
-            data={
-                # 'transaction_id': transaction_ids,
-                'apn': apns,
-                'sale_date': sale_dates,
-                'dirname': dirname,
-                'hps_str': hps_str,
-                'prediction': predictions,
-            },
-            index=range(len(transaction_ids))
-        )
-        return result2
-
     # BODY STARTS HERE
     debug = False
     start_time = time.time()
@@ -189,14 +166,21 @@ def mapper(mapper_arg):
     path = os.path.join(mapper_arg.in_dir, 'predictions-attributes.pickle')
     if not file_is_readable(path):
         return MapperResult(
+            mapper_arg=mapper_arg,
             ok=False,
+            n_rows_written=0,
             error='skipping file that is not openable: %s' % path,
         )
 
+    n_transactions = len(transaction_ids)
+    assert len(actuals) == n_transactions
     records_processed = 0
-    result = pd.DataFrame()
+    hps_strs = []
+    # prediction[i * n_transactions:(i + 1) * n_transactions] are the predictions for hps_strs[i]
+    # the array grows by doubling, so that appending is linear in the number of predictions
+    prediction = np.empty(n_transactions * 16, dtype='float64')
     all_fitted_attributes = {}
-    with open(path, 'r') as f:
+    with open(path, 'rb') as f:
         unpickler = pickle.Unpickler(f)
         try:
             while True:
@@ -204,83 +188,85 @@ def mapper(mapper_arg):
                 assert len(obj) in (2, 3), (obj, len(obj))
                 if len(obj) == 2:
                     hps_str, error_message = obj
-                    print 'skipping %s: error %' % (hps_str, error_message)
+                    print 'skipping %s: error %s' % (hps_str, error_message)
                 else:
                     hps_str, predictions, fitted_attributes = obj
                     all_fitted_attributes[(mapper_arg.fitted_dirname, hps_str)] = fitted_attributes
-                    rows = make_rows(
-                        mapper_arg.fitted_dirname,
-                        hps_str,
-                        predictions,
-                        transaction_ids,
-                    )
-                    result = result.append(rows, ignore_index=True)
+                    assert len(predictions) == n_transactions, (hps_str, len(predictions), n_transactions)
+                    start = records_processed * n_transactions
+                    if start + n_transactions > len(prediction):
+                        prediction = np.resize(prediction, 2 * len(prediction))
+                    prediction[start:start + n_transactions] = predictions
+                    hps_strs.append(hps_str)
                     records_processed += 1
-                    gc.collect()
                 if debug and records_processed >= 2:
                     print 'breaking because we are debugging'
                     break
         except EOFError as e:
             print 'EOFError raised after %d records processes: %s' % (records_processed, e)
+    n_rows = records_processed * n_transactions
+    keys = transaction_key.from_transaction_ids(transaction_ids)
+    chunk = {
+        'apn': transaction_key.apns(keys),
+        'sale_date': transaction_key.sale_dates(keys),
+        'hps_str': hps_strs,
+        'transaction_index': np.tile(np.arange(n_transactions, dtype='int32'), records_processed),
+        'hps_id': np.repeat(np.arange(records_processed, dtype='int32'), n_transactions),
+        'prediction': prediction[:n_rows],
+    }
     print 'created %d result records in %f wallclock seconds for %s' % (
-        len(result),
+        n_rows,
         time.time() - start_time,
         mapper_arg,
     )
     # write files
-    result.to_csv(mapper_arg.out_path_actuals_predictions + '.csv')
-    with open(mapper_arg.out_path_fitted_attributes, 'w') as f:
-        pickle.dump(all_fitted_attributes, f)
+    with open(mapper_arg.out_path_chunk, 'wb') as f:
+        serialize.dump(chunk, f)
+    with open(mapper_arg.out_path_fitted_attributes, 'wb') as f:
+        serialize.dump(all_fitted_attributes, f)
 
     return MapperResult(
         mapper_arg=mapper_arg,
         ok=True,
-        n_rows_written=len(result),
+        n_rows_written=n_rows,
+        error=None,
     )
 
 
+def reduce_chunk(store, mapped_result):
+    'append the chunk written by the mapper to the store and remove the chunk file'
+    path = mapped_result.mapper_arg.out_path_chunk
+    with open(path, 'rb') as f:
+        chunk = pickle.load(f)
+    store.append(mapped_result.mapper_arg.fitted_dirname, chunk)
+    os.remove(path)
+
+
 def do_work(control):
     'create csv file that summarizes all actual and predicted prices'
     def read_csv(path):
-        df = pd.read_csv(
+        df = column_store.read(
             path,
             nrows=8000 if control.arg.test else None,
-            usecols=None,  # TODO: change to columns we actually use
-            low_memory=False
+            usecols=[layout_transactions.sale_date, layout_transactions.apn],
         )
         print 'read %d samples from file %s' % (len(df), path)
         return df
 
-    def make_transaction_ids(df):
-        'return dates and apns for the query samples'
-        result = []
-        for index, row in df.iterrows():
-            next = TransactionId(
-                sale_date=row[layout_transactions.sale_date],
-                apn=row[layout_transactions.apn],
-            )
-            result.append(next)
-        return result
-
     def transaction_id_set(path):
-        'return set of TransactionId for file at the path'
+        'return sorted int64 array of the transaction_key of each sample in the file at the path'
         df = read_csv(path)
-        lst = make_transaction_ids(df)
-        result = set(lst)
-        assert len(lst) == len(result), path
+        keys = transaction_key.pack(df[layout_transactions.sale_date].values, df[layout_transactions.apn].values)
+        result = np.unique(keys)
+        assert len(keys) == len(result), path
         return result
 
     def make_testing_training_sets(control):
+        'return sorted keys of the query transactions (in testing set, in training set)'
         all = transaction_id_set(control.path_in_query_samples_all)
         train = transaction_id_set(control.path_in_query_samples_train)
-        query_in_testing_set = set()
-        query_in_training_set = set()
-        for query in all:
-            if query in train:
-                query_in_training_set.add(query)
-            else:
-                query_in_testing_set.add(query)
-        return query_in_testing_set, query_in_training_set
+        in_train = transaction_key.is_in(all, train)
+        return all[~in_train], all[in_train]
 
     def dirname_training_data(dirname):
         training_data, neighborhood, model, prediction_month = dirname.split('-')
@@ -309,14 +295,16 @@ def do_work(control):
     print '# training queries', len(query_in_training_set)
     print '# testing queries', len(query_in_testing_set)
 
-    # create DataFrame in subprocess for each input directory in dirnames below
+    # map each input directory in dirnames below in a subprocess
+    # reduce each mapped directory as soon as it is done into the prediction store
+    store = RecordLog(control.path_out_predictions)
     dirpath, dirnames, filenames = next(os.walk(control.path_in_dir_fit_predict))
     pool = multiprocessing.Pool(control.arg.n_processes)
     worker_args = [
         MapperArg(
             in_dir=os.path.join(dirpath, dirname),
             dirname=dirname,
-            out_path_actuals_predictions=os.path.join(control.path_out_dir, dirname + '-actuals-predictions'),
+            out_path_chunk=os.path.join(control.path_out_dir, dirname + '-chunk.pickle'),
             out_path_fitted_attributes=os.path.join(control.path_out_dir, dirname + '-fitted-attributes.pickle'),
             fitted_dirname=dirname,
             test=control.arg.test
@@ -325,25 +313,30 @@ def do_work(control):
         if dirname_training_data(dirname) == control.arg.training_data
         if dirname_neighborhood(dirname) == control.arg.neighborhood
         if dirname_model(dirname) == control.arg.model
+        if dirname not in store
     ]
     print 'will process %d dirnames in %d processes' % (len(worker_args), control.arg.n_processes)
-    # mapped_results is a list of results from the mapper
+    print 'skipping %d dirnames already in %s' % (len(store), control.path_out_predictions)
+    # mapped_results is an iterable of results from the mapper, in the order of the worker_args
     mapped_results = (
         [mapper(worker_args[0])] if control.arg.testmapper else
-        pool.map(mapper, worker_args)
+        pool.imap(mapper, worker_args)
     )
-    # reduce the mapped results, which are mainly in the file system
+    # reduce the mapped results, which are in the file system, one at a time
     print 'mapped_results'
-    for mapped_result in mapped_results:
-        # print mapped_result.mapper_arg
-        if mapped_result.ok:
-            print '%s succesfully created %d rows' % (
-                mapped_result.mapper_arg.fitted_dirname,
-                mapped_result.n_rows_written,
-            )
-        else:
-            print 'bad result', mapped_result.error
-    # TODO: combine the results, which are in files, into one big DataFrame
+    with store:
+        for mapped_result in mapped_results:
+            # print mapped_result.mapper_arg
+            if mapped_result.ok:
+                print '%s succesfully created %d rows' % (
+                    mapped_result.mapper_arg.fitted_dirname,
+                    mapped_result.n_rows_written,
+                )
+                reduce_chunk(store, mapped_result)
+            else:
+                print 'bad result', mapped_result.error
+    pool.close()
+    pool.join()
     return
 
 
@@ -10,12 +10,14 @@ INPUTS
  WORKING/fit-predict-v2/{training_data}-{neighborhood}-{model}-{prediction_month}/prediction-attributes.pickle
 
 OUTPUTS
- WORKING/fit-predict-reduce2/reduction.pickle: Dict[(date,apn), Dict[(fitted, hps_str), prediction]]
- WORKING/fit-predict-reduce2/reduction_2007.pickle: Dict[(date,apn), Dict[(fitted, hps_str), prediction]]
+ WORKING/fit-predict-reduce2/cube/: PredictionCube with the predictions in natural units
+   [transaction, (training_data, neighborhood, model), hps] and a mask of the predictions present;
+   the transactions in a month or year, such as 2007 or 200701, are a slice of the cube
  WORKING/fit-predict-reduce2/no_data.pickle: Set[dirname]  # dirnames without any data (must be refitted)
 
 OPERATIONAL NOTES:
  single threaded
+ two passes over the dirnames: the first reads just the transaction ids to size the cube
 '''
 
 from __future__ import division
@@ -34,8 +36,9 @@ import dirutility
 from Fitted import Fitted
 import HPs
 from Logger import Logger
-from Month import Month
 from Path import Path
+from PredictionCube import PredictionCube
+import serialize
 from Timer import Timer
 import TransactionId
 
@@ -63,10 +66,8 @@ def make_control(argv):
     return Bunch(
         arg=arg,
         path_in_dir=os.path.join(dir_working, 'fit-predict-v2'),
+        path_out_cube=os.path.join(dir_out, 'cube'),
         path_out_no_data=os.path.join(dir_out, 'no_data.pickle'),
-        path_out_reduction=os.path.join(dir_out, 'reduction.pickle'),
-        path_out_reduction_2007=os.path.join(dir_out, 'reduction_2007.pickle'),
-        path_out_reduction_200701=os.path.join(dir_out, 'reduction_200701.pickle'),
         path_out_log=os.path.join(dir_out, '0log.txt'),
         random_seed=random_seed,
         timer=Timer(),
@@ -76,35 +77,42 @@ def make_control(argv):
 def read_transaction_ids(dirpath, dirname):
     'return tuple of transaction ids'
     path = os.path.join(dirpath, dirname, 'transaction_ids.pickle')
-    with open(path, 'r') as f:
+    with open(path, 'rb') as f:
         reduction = pickle.load(f)
     return tuple(reduction)
 
 
-def process_dirname(dirpath, dirname, reduction, reduction_2007, reduction_200701, no_data, test):
-    'mutate result and no_data to include info in the transactions and predictions files in dirname'
-    verbose = False
-    if verbose:
-        print dirname
+def make_fitted(dirname):
+    'return (training_data, neighborhood, model) for the dirname or None if it is skipped'
     training_data, neighborhood, model, month_str = dirname.split('-')
     if model == 'gb':
         print 'for now, skipping gb', dirname
+        return None
+    Fitted(training_data, neighborhood, model)  # validate
+    return training_data, neighborhood, model
+
+
+def read_canonical_transaction_ids(dirpath, dirname):
+    'return list of TransactionId with datetime.date sale dates'
+    return [
+        TransactionId.canonical(transaction_id_raw)
+        for transaction_id_raw in read_transaction_ids(dirpath, dirname)
+    ]
+
+
+def process_dirname(dirpath, dirname, cube, no_data, test):
+    'mutate cube and no_data to include info in the transactions and predictions files in dirname'
+    verbose = False
+    if verbose:
+        print dirname
+    fitted = make_fitted(dirname)
+    if fitted is None:
         return
-    month = Month(month_str)
-    in_2007 = month.year == 2007
-    in_200701 = month.year == 2007 and month.month == 1
-    fitted = Fitted(training_data, neighborhood, model)
-    transaction_ids_raw = read_transaction_ids(dirpath, dirname)
-    transaction_ids_list = []
-    for transaction_id_raw in transaction_ids_raw:
-        canonical = TransactionId.canonical(transaction_id_raw)
-        transaction_ids_list.append(canonical)
-    transaction_ids = tuple(transaction_ids_list)
+    rows = cube.transaction_rows(read_canonical_transaction_ids(dirpath, dirname))
     path = os.path.join(dirpath, dirname, 'predictions-attributes.pickle')
     n_records_processed = 0
-    with open(path, 'r') as f:
+    with open(path, 'rb') as f:
         unpickler = pickle.Unpickler(f)
-        dirname_reduction = {}
         try:
             while True:
                 obj = unpickler.load()
@@ -115,7 +123,7 @@ def process_dirname(dirpath, dirname, reduction, reduction_2007, reduction_20070
                     predictions_restated = np.exp(predictions) if units_y == 'log' else predictions
                     if verbose:
                         print hps_str
-                    dirname_reduction[hps_str] = predictions_restated
+                    cube.put(fitted, rows, hps_str, predictions_restated)
                 else:
                     print 'error:', obj
                 n_records_processed += 1
@@ -131,37 +139,44 @@ def process_dirname(dirpath, dirname, reduction, reduction_2007, reduction_20070
         except ValueError as e:
             print '%s' % e
             no_data.add(dirname)
-    reduction_key = (fitted, transaction_ids)
-    reduction[reduction_key] = dirname_reduction
-    if in_2007:
-        reduction_2007[reduction_key] = dirname_reduction
-    if in_200701:
-        reduction_200701[reduction_key] = dirname_reduction
-    print dirname, n_records_processed, len(reduction), len(reduction_2007), len(no_data)
+    print dirname, n_records_processed, len(no_data)
 
 
 def do_work(control):
-    reduction = {}
-    reduction_2007 = {}
-    reduction_200701 = {}
+    dirpath_dirnames = [
+        (dirpath, dirname)
+        for dirpath, dirnames, filenames in os.walk(control.path_in_dir)
+        for dirname in dirnames
+    ]
+
+    # first pass: determine the transactions and fitted models, which size the cube
+    all_transaction_ids = set()
+    fitteds = set()
+    for dirpath, dirname in dirpath_dirnames:
+        fitted = make_fitted(dirname)
+        if fitted is not None:
+            fitteds.add(fitted)
+            all_transaction_ids.update(read_canonical_transaction_ids(dirpath, dirname))
+    hps_strs = {
+        model: [HPs.to_str(hps) for hps in HPs.iter_hps_model(model)]
+        for model in set(fitted[2] for fitted in fitteds)
+    }
+    cube = PredictionCube.create(control.path_out_cube, all_transaction_ids, fitteds, hps_strs)
+    print 'cube has shape %s' % (cube.predictions.shape,)
+
+    # second pass: fill in the predictions
     no_data = set()
-    for dirpath, dirnames, filenames in os.walk(control.path_in_dir):
-        for dirname in dirnames:
-            process_dirname(
-                dirpath, dirname,
-                reduction, reduction_2007, reduction_200701,
-                no_data,
-                control.arg.test,
-            )
+    for dirpath, dirname in dirpath_dirnames:
+        process_dirname(
+            dirpath, dirname,
+            cube,
+            no_data,
+            control.arg.test,
+        )
     print 'writing output files'
-    with open(control.path_out_reduction, 'w') as f:
-        pickle.dump(reduction, f)
-    with open(control.path_out_reduction_2007, 'w') as f:
-        pickle.dump(reduction_2007, f)
-    with open(control.path_out_reduction_200701, 'w') as f:
-        pickle.dump(reduction_200701, f)
-    with open(control.path_out_no_data, 'w') as f:
-        pickle.dump(no_data, f)
+    cube.close()
+    with open(control.path_out_no_data, 'wb') as f:
+        serialize.dump(no_data, f)
     print 'found %d dirnames without data (need to refit these models)' % len(no_data)
     for dirname in no_data:
         print dirname
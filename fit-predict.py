@@ -40,11 +40,10 @@ OUTPUTS
 from __future__ import division
 
 import argparse
+import collections
 import cPickle as pickle
-import datetime
 import gc
 import os
-import pandas as pd
 import pdb
 from pprint import pprint
 import random
@@ -56,16 +55,22 @@ import time
 
 import arg_type
 from Bunch import Bunch
+import column_store
+from DesignMatrixCache import DesignMatrixCache
 import dirutility
+import elastic_net_path
 from Features import Features
+from GramStore import GramStore
 import HPs
 import layout_transactions
 from Logger import Logger
 from lower_priority import lower_priority
 from Month import Month
 from Path import Path
+from SampleSelector import SampleSelector
+import serialize
 from Timer import Timer
-from TransactionId import TransactionId
+import transaction_key
 
 
 def make_control(argv):
@@ -119,24 +124,6 @@ class FittingError(Exception):
         super(FittingError, self).__init__(message)
 
 
-def select_in_time_period(df, last_month_str, n_months_back):
-    'return subset of DataFrame df that are in the time period'
-    first_date_float = float(Month(last_month_str).decrement(n_months_back).as_int() * 100 + 1)
-    next_month = Month(last_month_str).increment()
-    last_date = datetime.date(next_month.year, next_month.month, 1) - datetime.timedelta(1)
-    last_date_float = last_date.year * 10000.0 + last_date.month * 100.0 + last_date.day
-
-    sale_date_column = layout_transactions.sale_date
-    sale_dates_float = df[sale_date_column]  # type is float
-    assert isinstance(sale_dates_float.iloc[0], float)
-
-    mask1 = sale_dates_float >= first_date_float
-    mask2 = sale_dates_float <= last_date_float
-    mask_in_range = mask1 & mask2
-    df_in_range = df.loc[mask_in_range]
-    return df_in_range
-
-
 def select_in_city(df, city):
     'return subset of DataFrame df that are in the city'
     pdb.set_trace()
@@ -146,27 +133,6 @@ def select_in_city(df, city):
     return df_in_city
 
 
-def select_in_time_period_and_in_city(df, last_month, n_months_back, neighborhood):
-    'return new df with the specified training data'
-    verbose = False
-    in_time_period = select_in_time_period(
-        df.copy(),
-        last_month,
-        n_months_back,
-    )
-    in_neighborhood = (
-        in_time_period if neighborhood == 'global' else
-        select_in_city(in_time_period, neighborhood)
-    )
-    if verbose:
-        print 'neighborhood %s: %d in time period, %d also in neighborhood' % (
-            'all' if neighborhood is None else neighborhood,
-            len(in_time_period),
-            len(in_neighborhood),
-        )
-    return in_neighborhood
-
-
 def fit_en(X, y, hps, random_seed):
     'return fitted ElastNet model'
     assert len(hps) == 5
@@ -214,8 +180,8 @@ def fit_gb(X, y, hps, random_seed):
     return fitted
 
 
-def fit_rf(X, y, hps, random_seed):
-    'return fitted RandomForestRegressor model'
+def make_rf(hps, random_seed, warm_start=False):
+    'return unfitted RandomForestRegressor model'
     assert len(hps) == 6
     model = sklearn.ensemble.RandomForestRegressor(
         n_estimators=hps['n_estimators'],
@@ -233,8 +199,14 @@ def fit_rf(X, y, hps, random_seed):
         oob_score=False,
         n_jobs=1,
         verbose=0,
-        warm_start=False,
+        warm_start=warm_start,
     )
+    return model
+
+
+def fit_rf(X, y, hps, random_seed):
+    'return fitted RandomForestRegressor model'
+    model = make_rf(hps, random_seed)
     fitted = model.fit(X, y)
     return fitted
 
@@ -247,18 +219,34 @@ def make_n_hps(model):
     return count
 
 
-def fit_and_predict(training_samples, query_samples, hps, control):
-    'return (predictions, attributes, n_training_samples)'
-    def X_y(df):
-        return Features().extract_and_transform(df, hps['units_X'], hps['units_y'])
-
-    relevant_training_samples = select_in_time_period_and_in_city(
-        training_samples,
-        Month(control.arg.prediction_month).decrement(1),
-        hps['n_months_back'],
-        control.arg.neighborhood,
-    )
-    if len(relevant_training_samples) == 0:
+def iter_hps_groups(model):
+    '''yield lists of hps that are fitted together
+
+    For en, the hps that differ only in alpha form one group, as they are on one
+    regularization path. For rf, the hps that differ only in n_estimators form one
+    group, as the forests for all of them are grown in one pass. Otherwise, each
+    hps is alone.
+    '''
+    varying_name = {'en': 'alpha', 'rf': 'n_estimators'}.get(model)
+    groups = collections.OrderedDict()
+    for hps in HPs.iter_hps_model(model):
+        group_key = (
+            HPs.to_str(hps) if varying_name is None else
+            HPs.to_str({k: v for k, v in hps.iteritems() if k != varying_name})
+        )
+        if group_key not in groups:
+            groups[group_key] = []
+        groups[group_key].append(hps)
+    for group in groups.itervalues():
+        yield group
+
+
+def make_X_y(design_matrix_cache, training_sample_selector, hps, control):
+    'return (X_train, y_train, X_query, actuals, n_training_samples)'
+    last_month = Month(control.arg.prediction_month).decrement(1)
+    rows = training_sample_selector.rows_between(last_month.decrement(hps['n_months_back']), last_month)
+    n_training_samples = rows.stop - rows.start
+    if n_training_samples == 0:
         message = 'no relevant samples hps:%s neighborhood: %s prediction_month %s' % (
             HPs.to_str(hps),
             control.arg.neighborhood,
@@ -266,9 +254,19 @@ def fit_and_predict(training_samples, query_samples, hps, control):
         )
         raise FittingError(message)
 
-    X_train, y_train = X_y(relevant_training_samples)
-    X_query, actuals = X_y(query_samples)
+    X_train, y_train = design_matrix_cache.X_y('training', 'swpn', hps['units_X'], hps['units_y'], rows)
+    X_query, actuals = design_matrix_cache.X_y('query', 'swpn', hps['units_X'], hps['units_y'])
+    return X_train, y_train, X_query, actuals, n_training_samples
 
+
+def fit_and_predict(design_matrix_cache, training_sample_selector, hps, control):
+    'return (predictions, attributes, n_training_samples)'
+    X_train, y_train, X_query, actuals, n_training_samples = make_X_y(
+        design_matrix_cache,
+        training_sample_selector,
+        hps,
+        control,
+    )
     fitter = (
         fit_en if control.arg.model == 'en' else
         fit_gb if control.arg.model == 'gb' else
@@ -280,28 +278,88 @@ def fit_and_predict(training_samples, query_samples, hps, control):
         {'feature_importances_': fitted.feature_importances_}
     )
     predictions = fitted.predict(X_query)
-    return predictions, attributes, len(relevant_training_samples)
+    return predictions, attributes, n_training_samples
+
+
+def fit_and_predict_en_path(gram_store, design_matrix_cache, hps_group, control):
+    '''return list of (predictions, attributes, n_training_samples), parallel to hps_group
+
+    The hps in hps_group differ only in alpha. Solve for all the alphas with one
+    warm-started regularization path on the Gram matrix of the training window,
+    which is assembled from the per-month statistics in the gram_store.
+    '''
+    hps = hps_group[0]
+    last_month = Month(control.arg.prediction_month).decrement(1)
+    gram = gram_store.window(
+        hps['units_X'],
+        hps['units_y'],
+        last_month.decrement(hps['n_months_back']),  # same window as make_X_y
+        last_month,
+    )
+    if gram is None:
+        message = 'no relevant samples hps:%s neighborhood: %s prediction_month %s' % (
+            HPs.to_str(hps),
+            control.arg.neighborhood,
+            control.arg.prediction_month,
+        )
+        raise FittingError(message)
+
+    X_query, actuals = design_matrix_cache.X_y('query', 'swpn', hps['units_X'], hps['units_y'])
+    fitteds = elastic_net_path.fit_path_gram(
+        gram,
+        [hps['alpha'] for hps in hps_group],
+        hps['l1_ratio'],
+    )
+    result = []
+    for fitted in fitteds:
+        attributes = {'coef_': fitted.coef_, 'intercept_': fitted.intercept_}
+        result.append((fitted.predict(X_query), attributes, gram.n_samples))
+    return result
+
+
+def fit_and_predict_rf_grown(design_matrix_cache, training_sample_selector, hps_group, control):
+    '''return list of (predictions, attributes, n_training_samples), parallel to hps_group
+
+    The hps in hps_group differ only in n_estimators. Grow one forest with warm_start
+    through the n_estimators, predicting at each size. The trees are the same as
+    those built by fitting each n_estimators from scratch.
+    '''
+    X_train, y_train, X_query, actuals, n_training_samples = make_X_y(
+        design_matrix_cache,
+        training_sample_selector,
+        hps_group[0],
+        control,
+    )
+    model = make_rf(hps_group[0], control.random_seed, warm_start=True)
+    snapshots = {}
+    for n_estimators in sorted(set(hps['n_estimators'] for hps in hps_group)):
+        model.set_params(n_estimators=n_estimators)
+        model.fit(X_train, y_train)
+        snapshots[n_estimators] = (
+            model.predict(X_query),
+            {'feature_importances_': model.feature_importances_},
+        )
+    result = []
+    for hps in hps_group:
+        predictions, attributes = snapshots[hps['n_estimators']]
+        result.append((predictions, attributes, n_training_samples))
+    return result
 
 
 def do_work(control):
     'write fitted models to file system'
     def make_transaction_ids(df):
-        'return dates and apns for the query samples'
-        result = []
-        for index, row in df.iterrows():
-            next = TransactionId(
-                sale_date=row[layout_transactions.sale_date],
-                apn=row[layout_transactions.apn],
-            )
-            result.append(next)
-        return result
+        'return list of TransactionId in canonical form for the query samples, in the order of the samples'
+        return transaction_key.to_transaction_ids(transaction_key.pack(
+            df[layout_transactions.sale_date].values,
+            df[layout_transactions.apn].values,
+        ))
 
     def read_csv(path):
-        df = pd.read_csv(
+        df = column_store.read(
             path,
             nrows=100 if control.arg.test else None,
             usecols=None,  # TODO: change to columns we actually use
-            low_memory=False
         )
         print 'read %d samples from file %s' % (len(df), path)
         return df
@@ -334,9 +392,9 @@ def do_work(control):
     # reduce process priority, to try to keep the system responsive
     lower_priority()
 
-    with open(control.path_out_feature_names, 'w') as f:
+    with open(control.path_out_feature_names, 'wb') as f:
         feature_names = Features().ege_names('swpn')
-        pickle.dump(feature_names, f)
+        serialize.dump(feature_names, f)
 
     training_samples = read_csv(control.path_in_training_samples)
 
@@ -347,12 +405,30 @@ def do_work(control):
         len(query_samples),
         control.arg.prediction_month,
     )
-    with open(control.path_out_transaction_ids, 'w') as f:
+    with open(control.path_out_transaction_ids, 'wb') as f:
         transaction_ids = make_transaction_ids(query_samples)
-        pickle.dump(transaction_ids, f)
-    with open(control.path_out_actuals, 'w') as f:
-        X, actuals = Features().extract_and_transform(query_samples, 'natural', 'natural')
-        pickle.dump(actuals, f)
+        serialize.dump(transaction_ids, f)
+
+    # the training samples are sorted by month once, so that any window of months is a slice
+    training_sample_selector = SampleSelector(
+        training_samples if control.arg.neighborhood == 'global' else
+        select_in_city(training_samples, control.arg.neighborhood)
+    )
+
+    # the transformed features of the samples are computed once for each units
+    design_matrix_cache = DesignMatrixCache()
+    design_matrix_cache.add_samples('training', training_sample_selector.samples)
+    design_matrix_cache.add_samples('query', query_samples)
+
+    with open(control.path_out_actuals, 'wb') as f:
+        X, actuals = design_matrix_cache.X_y('query', 'swpn', 'natural', 'natural')
+        serialize.dump(actuals, f)
+
+    gram_store = None
+    if control.arg.model == 'en':
+        # the en models are fitted from per-month statistics of the training samples
+        gram_store = GramStore(training_sample_selector.samples, features_group='swpn')
+        control.timer.lap('make gram store')
 
     count_fitted = 0
     n_hps = make_n_hps(control.arg.model)
@@ -360,7 +436,7 @@ def do_work(control):
     # determine hps we have already fitted and predicted
     already_seen = set()
     if os.path.exists(control.path_out_predictions_attributes):
-        with open(control.path_out_predictions_attributes, 'r') as f:
+        with open(control.path_out_predictions_attributes, 'rb') as f:
             unpickler = pickle.Unpickler(f)
             try:
                 while True:
@@ -372,42 +448,54 @@ def do_work(control):
     print 'have already seen %d hps_str values' % len(already_seen)
 
     # fit and predict HPs that we have not already seen
-    with open(control.path_out_predictions_attributes, 'w') as results_file:
-        pickler = pickle.Pickler(results_file)
-        for hps in HPs.iter_hps_model(control.arg.model):
-            count_fitted += 1
+    with open(control.path_out_predictions_attributes, 'wb') as results_file:
+        pickler = serialize.Pickler(results_file)
+        for hps_group in iter_hps_groups(control.arg.model):
             start_time = time.clock()  # wall clock time on Windows, processor time on Unix
-            hps_str = HPs.to_str(hps)
-            if hps_str in already_seen:
-                print 'skipping already seen: %s' % hps_str
+            new_hps_group = []
+            for hps in hps_group:
+                count_fitted += 1
+                hps_str = HPs.to_str(hps)
+                if hps_str in already_seen:
+                    print 'skipping already seen: %s' % hps_str
+                    continue
+                new_hps_group.append(hps)
+            if len(new_hps_group) == 0:
                 continue
             try:
-                predictions, fitted_attributes, n_training_samples = fit_and_predict(
-                    training_samples,
-                    query_samples,
-                    hps, control,
-                )
-                pickler.dump((hps_str, predictions, fitted_attributes))
-                pickler.clear_memo()  # don't build up a large data structure
-                print 'fit-predict #%4d/%4d on:%6d in: %6.2f %s %s %s %s hps: %s ' % (
-                    count_fitted,
-                    n_hps,
-                    n_training_samples,
-                    time.clock() - start_time,
-                    control.arg.training_data,
-                    control.arg.neighborhood,
-                    control.arg.model,
-                    control.arg.prediction_month,
-                    hps_str,
+                results = (
+                    fit_and_predict_en_path(gram_store, design_matrix_cache, new_hps_group, control)
+                    if control.arg.model == 'en' else
+                    fit_and_predict_rf_grown(design_matrix_cache, training_sample_selector, new_hps_group, control)
+                    if control.arg.model == 'rf' else
+                    [fit_and_predict(design_matrix_cache, training_sample_selector, hps, control)
+                     for hps in new_hps_group]
                 )
+                for hps, result in zip(new_hps_group, results):
+                    predictions, fitted_attributes, n_training_samples = result
+                    hps_str = HPs.to_str(hps)
+                    pickler.dump((hps_str, predictions, fitted_attributes))
+                    pickler.clear_memo()  # don't build up a large data structure
+                    print 'fit-predict #%4d/%4d on:%6d in: %6.2f %s %s %s %s hps: %s ' % (
+                        count_fitted,
+                        n_hps,
+                        n_training_samples,
+                        time.clock() - start_time,
+                        control.arg.training_data,
+                        control.arg.neighborhood,
+                        control.arg.model,
+                        control.arg.prediction_month,
+                        hps_str,
+                    )
             except Exception as e:
                 print 'exception: %s' % e
                 pdb.set_trace()
-                pickler.dump((hps_str, e))
+                for hps in new_hps_group:
+                    pickler.dump((HPs.to_str(hps), e))
 
             # collect to get memory usage stable, so that we can run this program many time in parallel
             gc.collect()
-            if control.arg.test and count_fitted == 5:
+            if control.arg.test and count_fitted >= 5:
                 print 'breaking because we are testing'
                 break
 
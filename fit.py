@@ -24,8 +24,6 @@ where
 from __future__ import division
 
 import argparse
-import cPickle as pickle
-import datetime
 import gc
 import os
 import pandas as pd
@@ -40,12 +38,15 @@ import time
 
 from Bunch import Bunch
 import dirutility
+import elastic_net_path
 from Features import Features
 import HPs
 import layout_transactions
 from Logger import Logger
 from Month import Month
 from Path import Path
+from SampleSelector import SampleSelector
+import serialize
 from Timer import Timer
 
 
@@ -98,23 +99,10 @@ def make_control(argv):
     )
 
 
-def select_in_time_period(df, last_month_str, n_months_back):
-    'return subset of DataFrame df that are in the time period'
-
-    first_date_float = float(Month(last_month_str).decrement(n_months_back).as_int() * 100 + 1)
-    next_month = Month(last_month_str).increment()
-    last_date = datetime.date(next_month.year, next_month.month, 1) - datetime.timedelta(1)
-    last_date_float = last_date.year * 10000.0 + last_date.month * 100.0 + last_date.day
-
-    sale_date_column = layout_transactions.sale_date
-    sale_dates_float = df[sale_date_column]  # type is float
-    assert isinstance(sale_dates_float.iloc[0], float)
-
-    mask1 = sale_dates_float >= first_date_float
-    mask2 = sale_dates_float <= last_date_float
-    mask_in_range = mask1 & mask2
-    df_in_range = df.loc[mask_in_range]
-    return df_in_range
+def select_in_time_period(sample_selector, last_month_str, n_months_back):
+    'return subset of the samples in SampleSelector sample_selector that are in the time period'
+    last_month = Month(last_month_str)
+    return sample_selector.between_months(last_month.decrement(n_months_back), last_month)
 
 
 def select_in_city(df, city):
@@ -125,27 +113,6 @@ def select_in_city(df, city):
     return df_in_city
 
 
-def select_in_time_period_and_in_city(df, last_month, n_months_back, city):
-    'return new df with the specified training data'
-    verbose = False
-    in_time_period = select_in_time_period(
-        df.copy(),
-        last_month,
-        n_months_back,
-    )
-    in_neighborhood = (
-        in_time_period if city is None else
-        select_in_city(in_time_period, city)
-    )
-    if verbose:
-        print 'neighborhood %s: %d in time period, %d also in neighborhood' % (
-            'all' if city is None else city,
-            len(in_time_period),
-            len(in_neighborhood),
-        )
-    return in_neighborhood
-
-
 def fit_en(X, y, hps, random_seed):
     'return fitted ElastNet model'
     assert len(hps) == 5
@@ -166,6 +133,28 @@ def fit_en(X, y, hps, random_seed):
     return fitted
 
 
+def fit_en_path(X, y, hps, random_seed, path_fitteds, missing_alphas):
+    '''return fitted ElastNet model, fitting all the alphas on its regularization path at once
+
+    path_fitteds: dict; key is hps without alpha, value is dict alpha --> fitted model
+    missing_alphas: the alphas on the path of hps whose fitted models are still needed
+    Only the models for the missing alphas are kept, and they are removed as they are
+    returned, so that the dict stays small.
+    '''
+    assert len(hps) == 5
+    path_key = HPs.to_str({k: v for k, v in hps.iteritems() if k != 'alpha'})
+    if path_key not in path_fitteds:
+        alphas = HPs.values('alpha')
+        fitteds = elastic_net_path.fit_path(X, y, alphas, hps['l1_ratio'], random_state=random_seed)
+        missing = set(missing_alphas)
+        path_fitteds[path_key] = {alpha: fitted for alpha, fitted in zip(alphas, fitteds) if alpha in missing}
+    remaining = path_fitteds[path_key]
+    fitted = remaining.pop(hps['alpha'])
+    if len(remaining) == 0:
+        del path_fitteds[path_key]
+    return fitted
+
+
 def fit_gb(X, y, hps, random_seed):
     'return fitted GradientBoostingRegressor model'
     assert len(hps) == 7
@@ -236,15 +225,31 @@ def do_work(control):
         low_memory=False,
     )
     print 'read %d rows of training data from file %s' % (len(training_data), path_in)
+    # sort by month once, so that the time period for each hps is a slice
+    training_sample_selector = SampleSelector(
+        training_data if control.arg.city is None else
+        select_in_city(training_data, control.arg.city)
+    )
+    def make_file_path(hps):
+        return os.path.join(control.path_out_dir, HPs.to_str(hps) + '.pickle')
+
+    def missing_alphas(hps):
+        'return list of the alphas on the regularization path of hps whose output files do not exist'
+        return [
+            alpha
+            for alpha in HPs.values('alpha')
+            if not os.path.exists(make_file_path(dict(hps, alpha=alpha)))
+        ]
+
     n_hps = num_hps(control.arg.model)
     count_fitted = 0
+    path_fitteds = {}
     for hps in HPs.iter_hps_model(control.arg.model):
         start_time = time.clock()
-        relevant = select_in_time_period_and_in_city(
-            training_data,
+        relevant = select_in_time_period(
+            training_sample_selector,
             control.arg.last_month,
             hps['n_months_back'],
-            control.arg.city,
         )
         if len(relevant) == 0:
             print 'skipping fitting of model, because no training samples for those hyperparameters'
@@ -259,7 +264,7 @@ def do_work(control):
         # implement checkpoint restart
         # by skipping creating of output files that already exist
         count_fitted += 1
-        file_path = os.path.join(control.path_out_dir,  HPs.to_str(hps) + '.pickle')
+        file_path = make_file_path(hps)
         if os.path.exists(file_path):
             print 'skipped #%4d/%4d as already exists: hps: %s' % (
                 count_fitted,
@@ -268,17 +273,17 @@ def do_work(control):
             )
         else:
             fitted = (
-                fit_en(X, y, hps, control.random_seed) if control.arg.model == 'en' else
+                fit_en_path(X, y, hps, control.random_seed, path_fitteds, missing_alphas(hps)) if control.arg.model == 'en' else
                 fit_gb(X, y, hps, control.random_seed) if control.arg.model == 'gb' else
                 fit_rf(X, y, hps, control.random_seed)
             )
             if not control.arg.dry:
-                with open(file_path, 'w') as f:
+                with open(file_path, 'wb') as f:
                     obj = (
                         (False, fitted) if isinstance(fitted, str) else
                         (True, fitted)  # not an error message
                     )
-                    pickle.dump(obj, f)
+                    serialize.dump(obj, f)
             print 'fitted #%4d/%4d on:%6d in: %6.2f %s %s %s %s hps: %s ' % (
                 count_fitted,
                 n_hps,
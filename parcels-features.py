@@ -16,7 +16,6 @@ The fields in the output csv files are
  has_X where X is in layout_parcels.propn.keys()
 '''
 
-import cPickle as pickle
 import numpy as np
 import pandas as pd
 import pdb
@@ -29,6 +28,7 @@ import layout_parcels as parcels
 from Logger import Logger
 from Path import Path
 from ParseCommandLine import ParseCommandLine
+import serialize
 
 
 def usage(msg=None):
@@ -177,7 +177,7 @@ def main(argv):
     # write the results
     has_indicators.to_csv(control.path_out_csv)
     f = open(control.path_out_occurs, 'wb')
-    pickle.dump((occurs, control), f)
+    serialize.dump((occurs, control), f)
     f.close()
 
     print control
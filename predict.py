@@ -48,6 +48,7 @@ from Month import Month
 from Path import Path
 from Report import Report
 from SampleSelector import SampleSelector
+import serialize
 from valavmtypes import ResultKeyEn, ResultKeyGbr, ResultKeyRfr, ResultValue
 from Timer import Timer
 # from TimeSeriesCV import TimeSeriesCV
@@ -129,7 +130,7 @@ def do_work(control):
             hps_string = filename[:-len(suffix_we_process)]
             hps = HPs.from_str(hps_string)
             path_to_file = os.path.join(root, filename)
-            with open(path_to_file, 'r') as f:
+            with open(path_to_file, 'rb') as f:
                 ok, fitted_model = pickle.load(f)
             if ok:
                 print 'predicting samples using fitted model %s' % filename
@@ -150,8 +151,8 @@ def do_work(control):
         'sale_dates': sale_dates,
         'hps_predictions': hps_predictions,
     }
-    with open(control.path_out_file, 'w') as f:
-        pickle.dump(out, f)
+    with open(control.path_out_file, 'wb') as f:
+        serialize.dump(out, f)
     print 'wr0te results to %s' % control.path_out_file
     return
 
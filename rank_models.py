@@ -27,6 +27,7 @@ from Bunch import Bunch
 from chart06 import ModelDescription, ModelResults, ColumnDefinitions
 from Path import Path
 # from Report import Report
+import serialize
 from Timer import Timer
 # from valavm import ResultKeyEn, ResultKeyGbr, ResultKeyRfr, ResultValue
 # cc = columns_contain
@@ -88,7 +89,7 @@ def main(argv):
             print 'saving', month
             path = control.path_out_dir + month + '.pickle'
             with open(path, 'wb') as f:
-                pickle.dump(reduction[month], f)
+                serialize.dump(reduction[month], f)
         else:
             print 'month not in reduction from chart06:', month
 
@@ -10,11 +10,11 @@ OUTPUT FILES
  WORKING/samples-train.csv
  WORKING/samples-train-validate.csv
  WORKING/samples-validate.csv
+ WORKING/samples-{test,train,train-validate,validate}/  same samples in column_store format
 '''
 
 from __future__ import division
 
-import cPickle as pickle
 import datetime
 import numpy as np
 import pandas as pd
@@ -25,12 +25,14 @@ from sklearn import cross_validation
 import sys
 
 from Bunch import Bunch
+import column_store
 from columns_contain import columns_contain
 from Features import Features
 from Logger import Logger
 from ParseCommandLine import ParseCommandLine
 from Path import Path
 import layout_transactions as layout
+import serialize
 cc = columns_contain
 
 
@@ -315,12 +317,27 @@ def main(argv):
     fraction_test = control.fraction_test / (1 - control.fraction_test)
     train_test, train_train = split(train, fraction_test)
 
+    # sort by month, so that SampleSelector uses the mapped columns of the stores without copying them
+    def by_month(df):
+        return df.sort_values(layout.yyyymm, kind='mergesort')  # stable
+
+    test = by_month(test)
+    train = by_month(train)
+    train_test = by_month(train_test)
+    train_train = by_month(train_train)
+
     # write the csv files
     test.to_csv(control.path_out_test)
     train.to_csv(control.path_out_train)
     train_test.to_csv(control.path_out_train_validate)
     train_train.to_csv(control.path_out_validate)
 
+    # write the column stores
+    column_store.write(test, control.path_out_test)
+    column_store.write(train, control.path_out_train)
+    column_store.write(train_test, control.path_out_train_validate)
+    column_store.write(train_train, control.path_out_validate)
+
     # count samples in each strata (= month)
     yyyymms = sorted(set(subset[layout.yyyymm]))
     format_string = '%6d # total %6d # test %6d # train %6d # train_test %6d # train_train %6d'
@@ -341,7 +358,7 @@ def main(argv):
     print format_string % (0, len(subset), len(test), len(train), len(train_train), len(train_test))
 
     f = open(control.path_out_info_reasonable, 'wb')
-    pickle.dump((info_reasonable, control), f)
+    serialize.dump((info_reasonable, control), f)
     f.close()
 
     print control
@@ -13,11 +13,10 @@ OUTPUT FILES:
  WORKING/samples2/test.csv           enques transactions from samples-test.csv
  WORKING/samples2/train.csv          uniques transactions from samples-train.csv
  WORKING/samples2/all.csv            unique transactions from samples-test and sampes-train
+ WORKING/samples2/{test,train,all}/  same transactions as the csv files, in column_store format
 '''
 
 import argparse
-import collections
-import cPickle as pickle
 import numpy as np
 import os
 import pandas as pd
@@ -26,12 +25,14 @@ import random
 import sys
 
 import Bunch
+import column_store
 import dirutility
 import layout_transactions
 import Logger
 import Path
+import serialize
 import Timer
-import TransactionId
+import transaction_key
 
 
 def make_control(argv):
@@ -73,75 +74,64 @@ def make_control(argv):
 
 
 def read_extract_transform(path, nrows):
-    'return (DataFrame with created transaction_id, collections.counter of transaction_ids)'
+    'return (DataFrame with created transaction_id, int64 array of the transaction_key of each row)'
     df = pd.read_csv(path, low_memory=False, nrows=nrows)
-    canonical = TransactionId.canonical
-    TId = TransactionId.TransactionId
-    id_count = collections.Counter()
-    transaction_ids = []
-    for index, row in df.iterrows():
-        transaction_id = canonical(TId(
-            apn=row[layout_transactions.apn],
-            sale_date=row[layout_transactions.sale_date],
-        ))
-        transaction_ids.append(transaction_id)
-        id_count[transaction_id] += 1
+    keys = transaction_key.pack(
+        df[layout_transactions.sale_date].values,
+        df[layout_transactions.apn].values,
+    )
+    transaction_ids = transaction_key.to_transaction_ids(keys)
     df[layout_transactions.transaction_id] = transaction_ids
     df.index = transaction_ids
-    return df, id_count
-
-
-def make_uniques_dups(counts_a, counts_b):
-    all_counts = collections.Counter()
-    all_counts.update(counts_a)
-    all_counts.update(counts_b)
-    uniques = set()
-    dups = set()
-    for id in all_counts:
-        if all_counts[id] == 1:
-            assert id not in uniques
-            uniques.add(id)
-        else:
-            assert id not in dups
-            dups.add(id)
-    return uniques, dups
-
-
-def select_uniques(df, uniques):
-    'return df containing only unique transactions; add transaction_id; set index to transaction_id'
-    has_unique_transaction_id = [
-        transaction_id in uniques
-        for transaction_id in df['transaction_id']
-        ]
-    result = df.loc[has_unique_transaction_id]
-    return result
+    return df, keys
+
+
+def make_uniques_dups(keys_a, keys_b):
+    'return sorted arrays (keys that occur once, keys that occur more than once) in keys_a and keys_b together'
+    return transaction_key.uniques_duplicates(np.concatenate((keys_a, keys_b)))
+
+
+def select_uniques(df, keys, uniques):
+    'return rows of df whose keys are in the sorted array uniques'
+    return df.loc[transaction_key.is_in(keys, uniques)]
 
 
 def do_work(control):
     # read input files
     nrows = 2000 if control.test else None  # 2000 will find duplicates, 1000 will not
-    in_test_df, in_test_counts = read_extract_transform(control.path_in_test, nrows)
-    in_train_df, in_train_counts = read_extract_transform(control.path_in_train, nrows)
+    in_test_df, in_test_keys = read_extract_transform(control.path_in_test, nrows)
+    in_train_df, in_train_keys = read_extract_transform(control.path_in_train, nrows)
     in_all = in_train_df.append(in_test_df)
+    in_all_keys = np.concatenate((in_train_keys, in_test_keys))
 
     # determine unique transaction ids
 
-    uniques, duplicates = make_uniques_dups(in_test_counts, in_train_counts)
+    uniques, duplicates = make_uniques_dups(in_test_keys, in_train_keys)
+    print 'transactions: %d unique, %d duplicated' % (len(uniques), len(duplicates))
 
     # retain only unique transactions
-    out_test_df = select_uniques(in_test_df, uniques)
-    out_train_df = select_uniques(in_train_df, uniques)
-    out_all_df = select_uniques(in_all, uniques)
+    out_test_df = select_uniques(in_test_df, in_test_keys, uniques)
+    out_train_df = select_uniques(in_train_df, in_train_keys, uniques)
+    out_all_df = select_uniques(in_all, in_all_keys, uniques)
+
+    # sort by month, so that SampleSelector uses the mapped columns of the stores without copying them
+    out_test_df = out_test_df.sort_values(layout_transactions.yyyymm, kind='mergesort')  # stable
+    out_train_df = out_train_df.sort_values(layout_transactions.yyyymm, kind='mergesort')
+    out_all_df = out_all_df.sort_values(layout_transactions.yyyymm, kind='mergesort')
 
     out_test_df.to_csv(control.path_out_test)
     out_train_df.to_csv(control.path_out_train)
     out_all_df.to_csv(control.path_out_all)
 
-    # write unique and duplicate
-    with open(control.path_out_duplicates, 'w') as f:
-        pickle.dump(duplicates, f)
-    with open(control.path_out_uniques, 'w') as f:
-        pickle.dump(uniques, f)
+    column_store.write(out_test_df, control.path_out_test)
+    column_store.write(out_train_df, control.path_out_train)
+    column_store.write(out_all_df, control.path_out_all)
+
+    # write unique and duplicate, as sets of TransactionId
+    with open(control.path_out_duplicates, 'wb') as f:
+        serialize.dump(set(transaction_key.to_transaction_ids(duplicates)), f)
+    with open(control.path_out_uniques, 'wb') as f:
+        serialize.dump(set(transaction_key.to_transaction_ids(uniques)), f)
 
 
 def main(argv):
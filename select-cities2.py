@@ -31,6 +31,7 @@ import sys
 
 import arg_type
 from Bunch import Bunch
+import column_store
 import columns_table
 from ColumnsTable import ColumnsTable
 import dirutility
@@ -86,11 +87,10 @@ def etl(path_in, nrows, test):
     city_column = layout_transactions.city
     price_column = layout_transactions.price
 
-    extracted = pd.read_csv(
+    extracted = column_store.read(
         path_in,
         nrows=nrows,
         usecols=[city_column, price_column],
-        low_memory=False
     )
 
     print 'read %d samples from file %s' % (len(extracted), path_in)
@@ -0,0 +1,59 @@
+'''write pickles with the highest binary protocol
+
+cPickle writes the ASCII protocol 0 unless given a protocol, which is slow and large
+for numpy arrays and DataFrames. Every writer in the pipeline uses these functions
+instead of calling cPickle directly. Open the files in binary mode ('wb').
+
+Readers need no change: pickle.load recognizes the protocol of each pickle, so files
+written with protocol 0 stay readable.
+'''
+
+import cPickle as pickle
+import io
+import numpy as np
+import pdb
+import unittest
+
+
+protocol = pickle.HIGHEST_PROTOCOL
+
+
+def dump(obj, f):
+    'write obj to file f'
+    pickle.dump(obj, f, protocol)
+
+
+def dumps(obj):
+    'return str holding obj'
+    return pickle.dumps(obj, protocol)
+
+
+def Pickler(f):
+    'return cPickle.Pickler that writes to file f'
+    return pickle.Pickler(f, protocol)
+
+
+class TestSerialize(unittest.TestCase):
+    def test_round_trip(self):
+        obj = {'a': np.arange(1000, dtype='float64'), 'b': [1, 'two', 3.0]}
+        f = io.BytesIO()
+        dump(obj, f)
+        Pickler(f).dump(obj)
+        f.seek(0)
+        for i in xrange(2):
+            loaded = pickle.load(f)
+            self.assertTrue(np.array_equal(obj['a'], loaded['a']))
+            self.assertEqual(obj['b'], loaded['b'])
+        self.assertTrue(len(dumps(obj)) < len(pickle.dumps(obj)))  # protocol 0 is larger
+
+    def test_protocol_0_still_readable(self):
+        f = io.BytesIO()
+        pickle.dump(np.arange(3), f)  # as written before this module
+        f.seek(0)
+        self.assertEqual([0, 1, 2], list(pickle.load(f)))
+
+
+if __name__ == '__main__':
+    unittest.main()
+    if False:
+        pdb
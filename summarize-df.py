@@ -5,7 +5,6 @@ OUTPUT FILES
  WORKING/summarize-df-IN-report.csv
 '''
 
-import cPickle as pickle
 import pandas as pd
 import pdb
 import random
@@ -16,6 +15,7 @@ import Logger
 import ParseCommandLine
 import Path
 from Report import Report
+import serialize
 import summarize
 
 
@@ -102,7 +102,7 @@ def main(argv):
     summary_df.to_csv(control.path_out_summary)
 
     f = open(control.path_out_report, 'wb')
-    pickle.dump((report_summary, control), f)
+    serialize.dump((report_summary, control), f)
     f.close()
 
     if control.test:
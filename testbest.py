@@ -31,6 +31,7 @@ from make_test_train import make_test_train
 from Month import Month
 from ParseCommandLine import ParseCommandLine
 from Path import Path
+import serialize
 from Timer import Timer
 import valavm
 # from TimeSeriesCV import TimeSeriesCV
@@ -211,7 +212,7 @@ def main(argv):
     result = do_testbest(control, samples, best)
 
     with open(control.path_out, 'wb') as f:
-        pickle.dump((result, control), f)
+        serialize.dump((result, control), f)
 
     print 'elapsed wall clock seconds:', timer.elapsed_wallclock_seconds()
     print 'elapsed CPU seconds       :', timer.elapsed_cpu_seconds()
@@ -0,0 +1,140 @@
+'''packed int64 keys for transactions, which are identified by sale date and apn
+
+The key for a transaction is sale_date * 10**10 + apn, where sale_date is the yyyymmdd
+number. Keys sort by sale date and then by apn, so that the keys for a month are
+contiguous in a sorted array. The functions take and return whole columns, so that sets
+of transactions are built, compared and searched with numpy, not row by row.
+
+to_transaction_ids and from_transaction_ids convert to and from the TransactionId
+namedtuples in the pickles written before there were keys.
+'''
+
+import datetime
+import numpy as np
+import pdb
+import unittest
+
+from TransactionId import TransactionId
+
+
+apn_limit = 10 ** 10  # apns have at most 10 digits
+
+
+def pack(sale_dates, apns):
+    '''return int64 array of keys for parallel columns of sale dates and apns
+
+    sale_dates: yyyymmdd numbers, as in the samples files, or datetime.date values
+    apns: integral numbers
+    Raise ValueError for a sale date or apn that cannot be packed.
+    '''
+    sale_dates = np.asarray(sale_dates)
+    if sale_dates.dtype == object:
+        sale_dates = np.array(
+            [x if not isinstance(x, datetime.date) else x.year * 10000 + x.month * 100 + x.day for x in sale_dates],
+            dtype='float64',
+        )
+    sale_dates = sale_dates.astype('float64')
+    apns = np.asarray(apns).astype('float64')
+    if not (np.all(sale_dates == np.floor(sale_dates)) and np.all((sale_dates > 0) & (sale_dates <= 99999999))):
+        raise ValueError('sale dates not yyyymmdd numbers')
+    if not (np.all(apns == np.floor(apns)) and np.all((apns >= 0) & (apns < apn_limit))):
+        raise ValueError('apns not integers with at most 10 digits')
+    return sale_dates.astype('int64') * apn_limit + apns.astype('int64')
+
+
+def sale_dates(keys):
+    'return int64 array of the yyyymmdd sale dates in the keys'
+    return np.asarray(keys) // apn_limit
+
+
+def apns(keys):
+    'return int64 array of the apns in the keys'
+    return np.asarray(keys) % apn_limit
+
+
+def from_transaction_ids(transaction_ids):
+    'return int64 array of keys for an iterable of objects with sale_date and apn attributes, such as TransactionId'
+    transaction_ids = list(transaction_ids)
+    return pack(
+        np.array([transaction_id.sale_date for transaction_id in transaction_ids], dtype=object),
+        [transaction_id.apn for transaction_id in transaction_ids],
+    )
+
+
+def to_transaction_ids(keys):
+    'return list of TransactionId in canonical form (datetime.date, long) for the keys'
+    return [
+        TransactionId(
+            sale_date=datetime.date(sale_date // 10000, sale_date // 100 % 100, sale_date % 100),
+            apn=long(apn),
+        )
+        for sale_date, apn in zip(sale_dates(keys).tolist(), apns(keys).tolist())
+    ]
+
+
+def uniques_duplicates(keys):
+    'return (sorted keys that occur once, sorted keys that occur more than once)'
+    values, counts = np.unique(keys, return_counts=True)
+    return values[counts == 1], values[counts > 1]
+
+
+def is_in(keys, sorted_keys):
+    'return bool array, True where a key is in sorted_keys'
+    keys = np.asarray(keys)
+    if len(sorted_keys) == 0:
+        return np.zeros(len(keys), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return sorted_keys[positions] == keys
+
+
+def rows(sorted_keys, keys):
+    'return int array of the positions of the keys in sorted_keys; raise KeyError if one is not there'
+    positions = np.searchsorted(sorted_keys, keys)
+    if len(positions) > 0 and (positions.max() >= len(sorted_keys) or np.any(sorted_keys[positions] != keys)):
+        raise KeyError('transaction not in keys')
+    return positions
+
+
+class TestTransactionKey(unittest.TestCase):
+    def test_pack(self):
+        keys = pack([20070105.0, 20061231.0], [2425019009.0, 7.0])
+        self.assertEqual([20070105 * 10 ** 10 + 2425019009, 20061231 * 10 ** 10 + 7], list(keys))
+        self.assertEqual([20070105, 20061231], list(sale_dates(keys)))
+        self.assertEqual([2425019009, 7], list(apns(keys)))
+        self.assertTrue(keys[1] < keys[0])  # sorted by date first
+        dates = np.array([datetime.date(2007, 1, 5)], dtype=object)
+        self.assertEqual(keys[0], pack(dates, [2425019009L])[0])
+        self.assertRaises(ValueError, pack, [20070105.5], [1])
+        self.assertRaises(ValueError, pack, [20070105], [1.5])
+        self.assertRaises(ValueError, pack, [20070105], [np.nan])
+        self.assertRaises(ValueError, pack, [20070105], [10 ** 10])
+
+    def test_round_trip(self):
+        legacy = [
+            TransactionId(sale_date=20070124.0, apn=2425019009.0),  # as in the samples files
+            TransactionId(sale_date=datetime.date(2006, 12, 31), apn=3L),  # canonical
+        ]
+        keys = from_transaction_ids(legacy)
+        transaction_ids = to_transaction_ids(keys)
+        self.assertEqual(
+            [TransactionId(sale_date=datetime.date(2007, 1, 24), apn=2425019009L), legacy[1]],
+            transaction_ids,
+        )
+        self.assertTrue(isinstance(transaction_ids[0].apn, long))
+        self.assertEqual(list(keys), list(from_transaction_ids(transaction_ids)))
+
+    def test_set_operations(self):
+        keys = pack([20070101, 20070102, 20070101, 20070103], [1, 2, 1, 3])
+        uniques, duplicates = uniques_duplicates(keys)
+        self.assertEqual(list(pack([20070102, 20070103], [2, 3])), list(uniques))
+        self.assertEqual(list(pack([20070101], [1])), list(duplicates))
+        self.assertEqual([False, True, False, True], list(is_in(keys, uniques)))
+        self.assertEqual([False] * 4, list(is_in(keys, np.array([], dtype='int64'))))
+        self.assertEqual([1, 0], list(rows(uniques, uniques[::-1])))
+        self.assertRaises(KeyError, rows, uniques, duplicates)
+
+
+if __name__ == '__main__':
+    unittest.main()
+    if False:
+        pdb
@@ -16,7 +16,6 @@ OUTPUT FILE:
 from __future__ import division
 
 import collections
-import cPickle as pickle
 import numpy as np
 import os
 import pandas as pd
@@ -33,6 +32,7 @@ from Logger import Logger
 from ParseCommandLine import ParseCommandLine
 from Path import Path
 # from TimeSeriesCV import TimeSeriesCV
+import serialize
 cc = columns_contain
 
 
@@ -157,7 +157,7 @@ def main(argv):
     result = do_linval(control, samples)
 
     with open(control.path_out, 'wb') as f:
-        pickle.dump((result, control), f)
+        serialize.dump((result, control), f)
 
     print control
     if control.test:
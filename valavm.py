@@ -3,7 +3,7 @@ for AVMs based on 3 models (linear, random forests, gradient boosting regression
 
 INVOCATION
   python valavm.py {features_group}-{hps}-{locality}{-validation_month} \
-                   [--test] [--renameoutput] [--makefile [{system} {threads} ...]]
+                   [--test] [--renameoutput] [--makefile [{system} {threads} ...]] [--staged] [--jobs N]
   where
    features_group in {s, sw, swp, swpn}
      features to use
@@ -33,6 +33,17 @@ INVOCATION
      create valavm.makefile containing rules that make valavm outputs on the specified
      {system}s each of which has the specified number of {threads}.
      Default arg is 'dell 16 roy 12 judith 7 hp 4'
+   --staged
+     solve each elastic net model for all the alphas with one regularization path;
+     fit each gradient boosting model just once, with the largest n_estimators,
+     and read the predictions for the smaller n_estimators from its stages;
+     grow each random forest with warm_start through the n_estimators,
+     predicting at each size
+   --jobs N
+     fit the result keys in N worker processes (default 1, in this process).
+     The workers are forked after the samples are read and transformed, so they
+     share them copy on write instead of receiving pickled copies. This process
+     writes all the results, in the same order as when N is 1.
 
 INPUTS
  WORKING/samples-train.csv
@@ -41,10 +52,14 @@ OUTPUTS
  SRC/valavm.makefile
  working/valavm/{features_group}-{hps}-global/{validation_month}.pickle
    key = ResultKeyEn | ResultKeyGbr | ResultKeyRft
-   value = ResultValue
+   value = (ResultValueCompact, importances)
  working/valavm/{features_group}-{hps}-{locality}/{validation_month}-{location}.pickle
    key = ResultKeyEn | ResultKeyGbr | ResultKeyRft
-   value = (ResultValue, location)
+   value = (ResultValueCompact, importances)
+ each output file is an append-only RecordLog, with its key index in {output file}.index
+ each output file starts with the record (HeaderKey(version=2), Header), which holds the actuals
+ read the files with valavmtypes.ResultReader, which also reads the version 1 files written
+ before there was a header, whose values are (ResultValue, importances)
 
 NOTE 1
 The codes for the FEATURES are used directly in AVM and Features, so if you
@@ -61,6 +76,7 @@ import argparse
 import collections
 import cPickle as pickle
 import itertools
+import multiprocessing
 import numpy as np
 import os
 import pandas as pd
@@ -72,15 +88,19 @@ import sys
 import arg_type
 import AVM
 from Bunch import Bunch
+import column_store
 from columns_contain import columns_contain
+from DesignMatrixCache import DesignMatrixCache
 # from Features import Features
 import layout_transactions
 from Logger import Logger
 from Month import Month
 from Path import Path
+from RecordLog import RecordLog
 from Report import Report
-from SampleSelector import SampleSelector
+from SampleSelector import LocationSampleSelector, SampleSelector
 from valavmtypes import ResultKeyEn, ResultKeyGbr, ResultKeyRfr, ResultValue
+from valavmtypes import compact, Header, HeaderKey
 from Timer import Timer
 # from TimeSeriesCV import TimeSeriesCV
 cc = columns_contain
@@ -127,6 +147,8 @@ def make_control(argv):
     parser.add_argument('--test', action='store_true')
     parser.add_argument('--renameoutput', action='store_true')
     parser.add_argument('--makefile', nargs='*')
+    parser.add_argument('--staged', action='store_true')
+    parser.add_argument('--jobs', type=arg_type.n_processes, default=1)
     arg = parser.parse_args(argv)
     arg.base_name = 'valavm'
 
@@ -183,6 +205,7 @@ def make_control(argv):
         file_out_log='valavm-%s' % arg.features_hps_locality_month,
         path_in_samples=dir_working + 'samples-train.csv',
         path_out_file=path_out_file,
+        design_matrix_cache=DesignMatrixCache(),
         grid_seq=make_grid(),
         random_seed=random_seed,
         timer=Timer(),
@@ -212,15 +235,14 @@ class LocationSelector(object):
         return subset
 
 
-def split_train_validate(n_months_back, samples, validation_month):
-    '''return (train, validate)
+def split_train_validate(n_months_back, ss, validation_month):
+    '''return (train, validate), slices of the samples in SampleSelector ss
     where
     - test contains only transactions in the validation_month
     - train contains only transactions in the n_months_back preceeding the
       validation_month
     '''
     the_validation_month = Month(validation_month)
-    ss = SampleSelector(samples)
     samples_validate = ss.in_month(the_validation_month)
     samples_train = ss.between_months(
         the_validation_month.decrement(n_months_back),
@@ -297,6 +319,71 @@ def make_result_keys(control):
     return result
 
 
+def make_avm(control, result_key):
+    'return avm using specified hyperparameters'
+    model_name = (
+        'ElasticNet' if isinstance(result_key, ResultKeyEn) else
+        'GradientBoostingRegressor' if isinstance(result_key, ResultKeyGbr) else
+        'RandomForestRegressor' if isinstance(result_key, ResultKeyRfr) else
+        None)
+    if model_name == 'ElasticNet':
+        return AVM.AVM(
+            model_name=model_name,
+            random_state=control.random_seed,
+            units_X=result_key.units_X,
+            units_y=result_key.units_y,
+            alpha=result_key.alpha,
+            l1_ratio=result_key.l1_ratio,
+            features_group=control.arg.features_group,
+            design_matrix_cache=control.design_matrix_cache,
+            samples_name='samples',
+            )
+    elif model_name == 'GradientBoostingRegressor':
+        return AVM.AVM(
+            model_name=model_name,
+            random_state=control.random_seed,
+            learning_rate=result_key.learning_rate,
+            loss=result_key.loss,
+            alpha=0.5 if result_key.loss == 'quantile' else None,
+            n_estimators=result_key.n_estimators,
+            max_depth=result_key.max_depth,
+            max_features=result_key.max_features,
+            features_group=control.arg.features_group,
+            design_matrix_cache=control.design_matrix_cache,
+            samples_name='samples',
+            )
+    elif model_name == 'RandomForestRegressor':
+        return AVM.AVM(
+            model_name=model_name,
+            random_state=control.random_seed,
+            n_estimators=result_key.n_estimators,
+            max_depth=result_key.max_depth,
+            max_features=result_key.max_features,
+            features_group=control.arg.features_group,
+            design_matrix_cache=control.design_matrix_cache,
+            samples_name='samples',
+            )
+    else:
+        print 'bad model_name', (model_name, result_key)
+        pdb.set_trace()
+
+
+def make_importances(model_name, fitted_avm, features_group):
+    'return dict describing the fitted model'
+    if model_name == 'ElasticNet':
+        return {
+                'intercept': fitted_avm.intercept_,
+                'coefficients': fitted_avm.coef_,
+                'features_group': features_group,
+                }
+    else:
+        # the tree-based models have the same structure for their important features
+        return {
+                'feature_importances': fitted_avm.feature_importances_,
+                'features_group': features_group,
+                }
+
+
 def make_result_value(
         control=None,
         result_key=None,
@@ -310,70 +397,171 @@ def make_result_value(
     assert samples_validate is not None
     assert features_group is not None
 
-    def make_avm(result_key):
-        'return avm using specified hyperparameters'
-        model_name = (
-            'ElasticNet' if isinstance(result_key, ResultKeyEn) else
-            'GradientBoostingRegressor' if isinstance(result_key, ResultKeyGbr) else
-            'RandomForestRegressor' if isinstance(result_key, ResultKeyRfr) else
-            None)
-        if model_name == 'ElasticNet':
-            return AVM.AVM(
-                model_name=model_name,
-                random_state=control.random_seed,
-                units_X=result_key.units_X,
-                units_y=result_key.units_y,
-                alpha=result_key.alpha,
-                l1_ratio=result_key.l1_ratio,
-                features_group=control.arg.features_group,
-                )
-        elif model_name == 'GradientBoostingRegressor':
-            return AVM.AVM(
-                model_name=model_name,
-                random_state=control.random_seed,
-                learning_rate=result_key.learning_rate,
-                loss=result_key.loss,
-                alpha=0.5 if result_key.loss == 'quantile' else None,
-                n_estimators=result_key.n_estimators,
-                max_depth=result_key.max_depth,
-                max_features=result_key.max_features,
-                features_group=control.arg.features_group,
-                )
-        elif model_name == 'RandomForestRegressor':
-            return AVM.AVM(
-                model_name=model_name,
-                random_state=control.random_seed,
-                n_estimators=result_key.n_estimators,
-                max_depth=result_key.max_depth,
-                max_features=result_key.max_features,
-                features_group=control.arg.features_group,
-                )
-        else:
-            print 'bad model_name', (model_name, result_key)
-            pdb.set_trace()
-
-    def make_importances(model_name, fitted_avm):
-        if model_name == 'ElasticNet':
-            return {
-                    'intercept': fitted_avm.intercept_,
-                    'coefficients': fitted_avm.coef_,
-                    'features_group': features_group,
-                    }
-        else:
-            # the tree-based models have the same structure for their important features
-            return {
-                    'feature_importances': fitted_avm.feature_importances_,
-                    'features_group': features_group,
-                    }
-
-    avm = make_avm(result_key)
+    avm = make_avm(control, result_key)
     fitted_avm = avm.fit(samples_train)
     predictions = avm.predict(samples_validate)
     actuals = samples_validate[layout_transactions.price]
-    importances = make_importances(avm.model_name, fitted_avm)
+    importances = make_importances(avm.model_name, fitted_avm, features_group)
     return ResultValue(actuals=actuals, predictions=predictions), importances
 
 
+def make_result_values_en_path(
+        control=None,
+        result_keys=None,
+        samples_train=None,
+        samples_validate=None,
+        features_group=None):
+    '''return list of (ResultKeyEn, (ResultValue, importances))
+
+    The result_keys differ only in alpha. Solve for all of them with one
+    regularization path.
+    '''
+    assert control is not None
+    assert result_keys is not None
+    assert samples_train is not None
+    assert samples_validate is not None
+    assert features_group is not None
+
+    avm = make_avm(control, result_keys[0])
+    path = avm.fit_predict_path(
+        samples_train,
+        samples_validate,
+        [result_key.alpha for result_key in result_keys],
+        )
+    actuals = samples_validate[layout_transactions.price]
+    result = []
+    for result_key in result_keys:
+        predictions, fitted = path[result_key.alpha]
+        importances = make_importances(avm.model_name, fitted, features_group)
+        result_value = ResultValue(actuals=actuals, predictions=predictions)
+        result.append((result_key, (result_value, importances)))
+    return result
+
+
+def make_result_values_gbr_staged(
+        control=None,
+        result_keys=None,
+        samples_train=None,
+        samples_validate=None,
+        features_group=None):
+    '''return list of (ResultKeyGbr, (ResultValue, importances))
+
+    The result_keys differ only in n_estimators. Fit one model with the largest
+    n_estimators and read the predictions for the other keys from its stages.
+    '''
+    assert control is not None
+    assert result_keys is not None
+    assert samples_train is not None
+    assert samples_validate is not None
+    assert features_group is not None
+
+    largest_result_key = max(result_keys, key=lambda result_key: result_key.n_estimators)
+    avm = make_avm(control, largest_result_key)
+    avm.fit(samples_train)
+    staged_predictions = avm.staged_predict(
+        samples_validate,
+        [result_key.n_estimators for result_key in result_keys],
+        )
+    actuals = samples_validate[layout_transactions.price]
+    result = []
+    for result_key in result_keys:
+        importances = {
+            'feature_importances': avm.implementation_module.feature_importances(avm, result_key.n_estimators),
+            'features_group': features_group,
+            }
+        result_value = ResultValue(actuals=actuals, predictions=staged_predictions[result_key.n_estimators])
+        result.append((result_key, (result_value, importances)))
+    return result
+
+
+def make_result_values_rfr_grown(
+        control=None,
+        result_keys=None,
+        samples_train=None,
+        samples_validate=None,
+        features_group=None):
+    '''return list of (ResultKeyRfr, (ResultValue, importances))
+
+    The result_keys differ only in n_estimators. Grow one forest through the
+    n_estimators and snapshot its predictions and importances at each size.
+    '''
+    assert control is not None
+    assert result_keys is not None
+    assert samples_train is not None
+    assert samples_validate is not None
+    assert features_group is not None
+
+    avm = make_avm(control, result_keys[0])
+    grown = avm.fit_predict_grown(
+        samples_train,
+        samples_validate,
+        [result_key.n_estimators for result_key in result_keys],
+        )
+    actuals = samples_validate[layout_transactions.price]
+    result = []
+    for result_key in result_keys:
+        predictions, feature_importances = grown[result_key.n_estimators]
+        importances = {
+            'feature_importances': feature_importances,
+            'features_group': features_group,
+            }
+        result_value = ResultValue(actuals=actuals, predictions=predictions)
+        result.append((result_key, (result_value, importances)))
+    return result
+
+
+def make_result_key_groups(result_keys, staged):
+    '''return list of lists of ResultKey; the keys in each list are fitted together
+
+    If staged, the ResultKeyEn that differ only in alpha form one group, as do the
+    ResultKeyGbr and the ResultKeyRfr that differ only in n_estimators.
+    Otherwise, every result key is in its own group.
+    '''
+    groups = collections.OrderedDict()
+    for result_key in result_keys:
+        group_key = (
+            ('en', result_key._replace(alpha=None)) if staged and isinstance(result_key, ResultKeyEn) else
+            ('gbr', result_key._replace(n_estimators=None)) if staged and isinstance(result_key, ResultKeyGbr) else
+            ('rfr', result_key._replace(n_estimators=None)) if staged and isinstance(result_key, ResultKeyRfr) else
+            ('single', result_key)
+            )
+        if group_key not in groups:
+            groups[group_key] = []
+        groups[group_key].append(result_key)
+    return groups.values()
+
+
+def make_result_values(
+        control=None,
+        result_keys=None,
+        samples_train=None,
+        samples_validate=None,
+        features_group=None):
+    'return list of (ResultKey, (ResultValue, importances)) for a group of result keys'
+    if len(result_keys) > 1:
+        make = (
+            make_result_values_en_path if isinstance(result_keys[0], ResultKeyEn) else
+            make_result_values_gbr_staged if isinstance(result_keys[0], ResultKeyGbr) else
+            make_result_values_rfr_grown
+            )
+        return make(
+            control=control,
+            result_keys=result_keys,
+            samples_train=samples_train,
+            samples_validate=samples_validate,
+            features_group=features_group,
+            )
+    result_key = result_keys[0]
+    result_value, importances = make_result_value(
+        control=control,
+        result_key=result_key,
+        samples_train=samples_train,
+        samples_validate=samples_validate,
+        features_group=features_group,
+        )
+    return [(result_key, (result_value, importances))]
+
+
 def fit_and_predict(samples, control, already_exists, save):
     'call save(ResultKey, ResultValue) for all the hps that do not exist in the output file'
 
@@ -383,7 +571,7 @@ def fit_and_predict(samples, control, already_exists, save):
     for result_key_index, result_key in enumerate(result_keys):
         all_samples_train, all_samples_validate = split_train_validate(
             result_key.n_months_back,
-            samples,
+            SampleSelector(samples),
             control.arg.validation_month,
             )
         if control.arg.locality == 'global':
@@ -436,6 +624,83 @@ def fit_and_predict(samples, control, already_exists, save):
 FittedAvm = collections.namedtuple('FittedAVM', 'index key fitted')
 
 
+# (control, sample_selector) for result_values_mapper
+# set by _set_mapper_state in this process and, as the Pool initializer, in each worker process
+mapper_state = None
+
+
+def _set_mapper_state(control, sample_selector):
+    global mapper_state
+    mapper_state = (control, sample_selector)
+
+
+def result_values_mapper(task):
+    '''return list of (ResultKey, value) for task = (location, result_keys)
+
+    The result_keys are a group from make_result_key_groups. The location is None for the
+    global locality.
+    '''
+    control, sample_selector = mapper_state
+    location, result_keys = task
+    train, validate = split_train_validate(
+        result_keys[0].n_months_back,  # all keys in the group have the same n_months_back
+        sample_selector if location is None else sample_selector.sample_selector(location),
+        control.arg.validation_month,
+        )
+    if location is not None:
+        if len(train) == 0:
+            print 'skipping %s, as no training data' % location
+            return []
+        if len(validate) == 0:
+            print 'skippig %s, as no validation data' % location
+            return []
+        print 'location %s validation_month %s n_months_back %d train %d validation %d' % (
+            location,
+            control.arg.validation_month,
+            result_keys[0].n_months_back,
+            len(train),
+            len(validate),
+            )
+    return list(make_result_values(
+        result_keys=result_keys,
+        samples_train=train,
+        samples_validate=validate,
+        features_group=control.arg.features_group,
+        control=control,
+        ))
+
+
+def make_pool(control, sample_selector):
+    'return Pool of control.arg.jobs worker processes for result_values_mapper or None if just 1 job'
+    _set_mapper_state(control, sample_selector)
+    if control.arg.jobs == 1:
+        return None
+
+    # transform the features in this process, so that the workers share the design matrices
+    all_units = set(
+        (result_key.units_X, result_key.units_y) if isinstance(result_key, ResultKeyEn) else
+        ('natural', 'natural')
+        for result_key in make_result_keys(control)
+        )
+    for units_X, units_y in sorted(all_units):
+        control.design_matrix_cache.X_y('samples', control.arg.features_group, units_X, units_y)
+    control.timer.lap('transform features for %d units' % len(all_units))
+    # the initializer sets the state once in each worker: inherited where the pool forks, pickled once
+    # per worker where it cannot fork (Windows), instead of once per task
+    return multiprocessing.Pool(
+        control.arg.jobs,
+        initializer=_set_mapper_state,
+        initargs=(control, sample_selector),
+    )
+
+
+def map_result_values(pool, tasks):
+    'return iterable of the results of result_values_mapper for the tasks, in the order of the tasks'
+    if pool is None:
+        return itertools.imap(result_values_mapper, tasks)
+    return pool.imap(result_values_mapper, tasks)
+
+
 def read_existing_keys_values(path, timer):
     'return dict of keys and values found in file at path'
     existing_keys_values = {}
@@ -460,45 +725,46 @@ def read_existing_keys_values(path, timer):
     return existing_keys_values
 
 
-def process_hps_all_global(control, samples):
+header_key = HeaderKey(version=2)
+
+
+def start_output(output, samples_validate):
+    'write the header into an empty output RecordLog; an existing version 1 output is continued as it is'
+    if len(output) == 0:
+        output.append(header_key, Header(
+            actuals=samples_validate[layout_transactions.price],
+            apn=samples_validate[layout_transactions.apn].values,
+            sale_date=samples_validate[layout_transactions.sale_date].values,
+            ))
+
+
+def append_result(output, result_key, value):
+    'append (ResultKey, (ResultValue, importances)) in the format of the output RecordLog'
+    output.append(result_key, compact(value) if header_key in output else value)
+
+
+def process_hps_all_global(control, sample_selector):
     'append new keys and values to the known global output file'
-    # rewrite output file, staring with existing values
     assert control.arg.locality == 'global'
-    existing_keys_values = read_existing_keys_values(control.path_out_file, control.timer)
-
-    with open(control.path_out_file, 'wb') as output:
-        written_keys = set()
-
-        # rewrite existing values
-        existing_keys_values = read_existing_keys_values(control.path_out_file, control.timer)
-        count = 0
-        for existing_key, existing_value in existing_keys_values.iteritems():
-            record = (existing_key, existing_value)
-            pickle.dump(record, output)
-            written_keys.add(existing_key)
-            count += 1
-        control.timer.lap('rewrote new output file with %d existing keys and valuess' % count)
-
-        # create and write new values
-        for result_key in make_result_keys(control):
-            if result_key in written_keys:
-                continue
-            pdb.set_trace()
-            train, validate = split_train_validate(
-                result_key.n_months_back,
-                samples,
-                control.arg.validation_month,
-                )
-            result_value, importances = make_result_value(
-                result_key=result_key,
-                samples_train=train,
-                samples_validate=validate,
-                features_group=control.arg.features_group,
-                control=control,
-                )
-            record = (result_key, (result_value, importances))
-            pickle.dump(record, output)
-            control.timer.lap('create one additional key and value')
+    with RecordLog(control.path_out_file) as output:
+        print 'number of existing keys in output file:', len(output)
+        control.timer.lap('read existing keys')
+        start_output(output, sample_selector.in_month(Month(control.arg.validation_month)))
+
+        # create and append new values
+        tasks = []
+        for result_keys in make_result_key_groups(make_result_keys(control), control.arg.staged):
+            new_result_keys = [result_key for result_key in result_keys if result_key not in output]
+            if len(new_result_keys) > 0:
+                tasks.append((None, new_result_keys))
+        pool = make_pool(control, sample_selector)
+        for result_keys_values in map_result_values(pool, tasks):
+            for result_key, value in result_keys_values:
+                append_result(output, result_key, value)
+            control.timer.lap('create %d additional keys and values' % len(result_keys_values))
+        if pool is not None:
+            pool.close()
+            pool.join()
         control.timer.lap('create all additional keys and values')
 
 
@@ -548,72 +814,44 @@ class KeyTracker(object):
         pass
 
 
-def process_hps_all_local(control, samples):
+def process_hps_all_local(control, location_sample_selector):
     'append new keys and values to the output files corresponding to the locations'
     # we don't know the output file name
     # there is a different output file name for every location handed to save()
 
-    def append_to_location_file(location, location_selector):
+    def append_to_location_file(location, pool):
         'append new keys and values to the location file'
         path = control.path_out_file % location
-        with open(path, 'wb') as output:
-            written_keys = set()
-
-            # rewrite existing values
-            existing_keys_values = read_existing_keys_values(path, control.timer)
-            count = 0
-            for existing_key, existing_value in existing_keys_values.iteritems():
-                record = (existing_key, existing_value)
-                pickle.dump(record, output)
-                written_keys.add(existing_key)
-                count += 1
-            control.timer.lap('rewrote new output file with existing keys and values')
-
-            # create and write new values
-            for result_key in make_result_keys(control):
-                if result_key in written_keys:
-                    continue
-                in_location_samples = location_selector.in_location(samples, location)
-                if len(in_location_samples) == 0:
-                    print 'skipping %s, as no samples for that location' % location
-                    continue
-                train, validate = split_train_validate(
-                    result_key.n_months_back,
-                    in_location_samples,
-                    control.arg.validation_month,
-                    )
-                if len(train) == 0:
-                    print 'skipping %s, as no training data' % location
-                    continue
-                if len(validate) == 0:
-                    print 'skippig %s, as no validation data' % location
-                    continue
-                print 'location %s samples %d validation_month %s n_months_back %d train %d validation %d' % (
+        with RecordLog(path) as output:
+            print 'number of existing keys in output file %s: %d' % (path, len(output))
+            start_output(
+                output,
+                location_sample_selector.sample_selector(location).in_month(Month(control.arg.validation_month)),
+                )
+
+            # create and append new values
+            tasks = []
+            for result_keys in make_result_key_groups(make_result_keys(control), control.arg.staged):
+                new_result_keys = [result_key for result_key in result_keys if result_key not in output]
+                if len(new_result_keys) > 0:
+                    tasks.append((location, new_result_keys))
+            for result_keys_values in map_result_values(pool, tasks):
+                for new_result_key, value in result_keys_values:
+                    append_result(output, new_result_key, value)
+                control.timer.lap('create %d additional keys and values in location %s' % (
+                    len(result_keys_values),
                     location,
-                    len(in_location_samples),
-                    control.arg.validation_month,
-                    result_key.n_months_back,
-                    len(train),
-                    len(validate),
-                    )
-                result_value, importances = make_result_value(
-                    result_key=result_key,
-                    samples_train=train,
-                    samples_validate=validate,
-                    features_group=control.arg.features_group,
-                    control=control,
-                    )
-                record = (result_key, (result_value, importances))
-                pickle.dump(record, output)
-                control.timer.lap('create on additional key value in location %s' % location)
+                    ))
             control.timer.lap('create additional keys and values')
 
-    location_selector = LocationSelector(control.arg.locality)
-    locations = location_selector.location_values(samples)
-    unique_locations = set(locations)
+    unique_locations = location_sample_selector.locations
     print 'found %d unique locations' % len(unique_locations)
+    pool = make_pool(control, location_sample_selector)
     for location in unique_locations:
-        append_to_location_file(location, location_selector)
+        append_to_location_file(location, pool)
+    if pool is not None:
+        pool.close()
+        pool.join()
 
 
 def renameoutput(control):
@@ -750,11 +988,17 @@ def main(argv):
         makefile(control)
         sys.exit()
 
-    samples = pd.read_csv(
+    samples = column_store.read(
         control.path_in_samples,
         nrows=None if control.arg.test else None,
     )
     print 'samples.shape', samples.shape
+    # sort once, so that the training and validation samples are slices
+    sample_selector = (
+        SampleSelector(samples) if control.arg.locality == 'global' else
+        LocationSampleSelector(samples, LocationSelector(control.arg.locality).locality_column_name)
+    )
+    control.design_matrix_cache.add_samples('samples', sample_selector.samples)
     control.timer.lap('read samples')
 
     # assure output file exists
@@ -763,9 +1007,9 @@ def main(argv):
 
     if control.arg.hps == 'all':
         if control.arg.locality == 'global':
-            process_hps_all_global(control, samples)
+            process_hps_all_global(control, sample_selector)
         else:
-            process_hps_all_local(control, samples)
+            process_hps_all_local(control, sample_selector)
     else:
         print 'invalid arg.hps', control.arg.hps
         pdb.set_trace()
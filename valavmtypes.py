@@ -1,9 +1,24 @@
-'''mock module for valavm.py
+'''types in the output files of valavm.py and a reader for them
 
-Provide just the objects imported by chart07.py
+Provide the objects imported by valavm.py and by the readers of its output
+
+A version 2 output file starts with the record (HeaderKey(version=2), Header), which
+holds the actuals for the validation samples and their identifiers. Each later record
+is (ResultKey, (ResultValueCompact, importances)), with the predictions as float32.
+
+A version 1 output file has no header. Each record is (ResultKey, (ResultValue, importances)),
+with the actuals repeated in every record.
+
+ResultReader reads either version and returns the records of version 1.
 '''
 
 import collections
+import cPickle as pickle
+import io
+import numpy as np
+import pandas as pd
+import pdb
+import unittest
 
 
 ResultKeyEn = collections.namedtuple(
@@ -27,3 +42,91 @@ ResultValueLocal = collections.namedtuple(
     'ResultValueLocal',
     'actuals predictions location',
 )
+
+HeaderKey = collections.namedtuple(
+    'HeaderKey',
+    'version',
+)
+Header = collections.namedtuple(
+    'Header',
+    'actuals apn sale_date',  # parallel to the validation samples; actuals is a Series
+)
+ResultValueCompact = collections.namedtuple(
+    'ResultValueCompact',
+    'predictions',  # float32 array, parallel to Header.actuals
+)
+
+
+def compact(value):
+    'return (ResultValueCompact, importances) for (ResultValue, importances)'
+    result_value, importances = value
+    return ResultValueCompact(predictions=np.asarray(result_value.predictions, dtype='float32')), importances
+
+
+class ResultReader(object):
+    def __init__(self, f):
+        'read records from file f, which is open for reading'
+        self.f = f
+        self.header = None
+
+    def load(self):
+        'return next record as (ResultKey, (ResultValue, importances)); raise EOFError at the end'
+        key, value = pickle.load(self.f)
+        if isinstance(key, HeaderKey):
+            assert key.version == 2, key
+            self.header = value
+            key, value = pickle.load(self.f)
+        result_value, importances = value
+        if isinstance(result_value, ResultValueCompact):
+            result_value = ResultValue(actuals=self.header.actuals, predictions=result_value.predictions)
+        return key, (result_value, importances)
+
+
+class TestResultReader(unittest.TestCase):
+    def setUp(self):
+        self.actuals = pd.Series([100.0, 200.0, 300.0], index=[7, 8, 9])
+        self.key1 = ResultKeyRfr(n_months_back=1, n_estimators=10, max_features='auto', max_depth=3)
+        self.key2 = ResultKeyRfr(n_months_back=2, n_estimators=10, max_features='auto', max_depth=3)
+        self.value1 = (ResultValue(actuals=self.actuals, predictions=np.array([110.0, 190.0, 310.0])), None)
+        self.value2 = (ResultValue(actuals=self.actuals, predictions=np.array([105.0, 205.0, 295.0])), None)
+
+    def read_all(self, f):
+        reader = ResultReader(f)
+        result = []
+        while True:
+            try:
+                result.append(reader.load())
+            except EOFError:
+                break
+        return result
+
+    def check(self, records):
+        self.assertEqual([self.key1, self.key2], [key for key, value in records])
+        for (key, (result_value, importances)), (expected, expected_importances) in zip(
+                records, (self.value1, self.value2)):
+            self.assertTrue(self.actuals.equals(result_value.actuals))
+            self.assertTrue(np.allclose(expected.predictions, result_value.predictions))
+
+    def test_version_1(self):
+        f = io.BytesIO()
+        pickle.dump((self.key1, self.value1), f)
+        pickle.dump((self.key2, self.value2), f)
+        f.seek(0)
+        self.check(self.read_all(f))
+
+    def test_version_2(self):
+        f = io.BytesIO()
+        header = Header(actuals=self.actuals, apn=np.array([1, 2, 3]), sale_date=np.array([20070101.0] * 3))
+        pickle.dump((HeaderKey(version=2), header), f)
+        pickle.dump((self.key1, compact(self.value1)), f)
+        pickle.dump((self.key2, compact(self.value2)), f)
+        f.seek(0)
+        records = self.read_all(f)
+        self.check(records)
+        self.assertEqual(np.float32, records[0][1][0].predictions.dtype)
+
+
+if __name__ == '__main__':
+    unittest.main()
+    if False:
+        pdb